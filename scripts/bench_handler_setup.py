@@ -0,0 +1,59 @@
+"""Micro-benchmark of per-request webhook handler setup.
+
+Compares building the handler and its CORS headers for every request (as /webhook used to)
+against looking up the instance cached in app.state.
+"""
+
+import timeit
+from argparse import ArgumentParser
+from dataclasses import dataclass
+from types import SimpleNamespace
+
+from qram.config import AppConfig, CfgGithub
+from qram.web import get_cors_headers
+from qram.web.dedup import DeliveryDedup
+from qram.web.github import GithubWebhookHandler
+from qram.web.queue import WorkQueue
+
+
+@dataclass
+class Args:
+    number: int
+
+
+def parse_args() -> Args:
+    p = ArgumentParser()
+    _ = p.add_argument('--number', type=int, default=200_000)
+    return Args(**p.parse_args().__dict__)
+
+
+def main(args: Args) -> None:
+    cfg = AppConfig(
+        bind_to='127.0.0.1',
+        port=0,
+        cors_origin='https://example.com',
+        github=CfgGithub(app_id='1', installation_id='2', pem='pem', hmac='hmac'),
+    )
+    assert cfg.github
+    github = cfg.github
+    queue = WorkQueue(workers=1, max_size=1)
+    dedup = DeliveryDedup(max_size=1, ttl=1)
+    state = SimpleNamespace(webhook_handler=GithubWebhookHandler(cfg, queue, dedup=dedup))
+
+    def per_request() -> None:
+        _ = GithubWebhookHandler(cfg, queue, dedup=dedup)
+        _ = get_cors_headers(cfg.cors_origin, additional_headers=['x-hub-signature-256'])
+        _ = github.hmac.encode('utf-8')
+
+    def cached() -> None:
+        h = state.webhook_handler
+        _ = h.get_cors_headers()
+        _ = h.hmac_key
+
+    for name, fn in (('rebuilt per request', per_request), ('cached in app.state', cached)):
+        seconds = min(timeit.repeat(fn, number=args.number, repeat=5))
+        print(f'{name:>20}: {seconds / args.number * 1e9:8.1f} ns/request')
+
+
+if __name__ == '__main__':
+    main(parse_args())
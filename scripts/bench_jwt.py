@@ -0,0 +1,57 @@
+"""Micro-benchmark of github app JWT signing.
+
+Compares signing a fresh JWT from PEM on every call (as `rejwt` used to) against JwtSigner,
+which parses the key once and reuses the signed token for most of its lifetime.
+"""
+
+import timeit
+from argparse import ArgumentParser
+from dataclasses import dataclass
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+from qram.web.github.api import JwtSigner, make_jwt
+
+
+@dataclass
+class Args:
+    number: int
+
+
+def parse_args() -> Args:
+    p = ArgumentParser()
+    _ = p.add_argument('--number', type=int, default=2_000)
+    return Args(**p.parse_args().__dict__)
+
+
+def main(args: Args) -> None:
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    pem = key.private_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PrivateFormat.PKCS8,
+        encryption_algorithm=serialization.NoEncryption(),
+    ).decode()
+    signer = JwtSigner('1', pem)
+    uncached = JwtSigner('1', pem)
+
+    def from_pem() -> None:
+        _ = make_jwt('1', pem)
+
+    def preloaded_key() -> None:
+        _ = uncached.sign(0)
+
+    def cached() -> None:
+        _ = signer.get()
+
+    for name, fn in (
+        ('signed from PEM', from_pem),
+        ('signed, key loaded', preloaded_key),
+        ('cached JwtSigner', cached),
+    ):
+        seconds = min(timeit.repeat(fn, number=args.number, repeat=5))
+        print(f'{name:>20}: {seconds / args.number * 1e6:10.2f} us/call')
+
+
+if __name__ == '__main__':
+    main(parse_args())
@@ -0,0 +1,328 @@
+"""Load benchmark of the /webhook endpoint.
+
+Replays correctly signed github deliveries of mixed event types and payload sizes against
+the app, either in-process through the ASGI interface or over a real uvicorn socket, and
+reports throughput, latency percentiles and memory allocated per request.
+
+Results can be saved as JSON (`--output`), so that runs on different commits can be diffed.
+Load generator runs on the same event loop as the app in both modes: numbers are for
+comparing commits with each other, not for capacity planning.
+"""
+
+import asyncio
+import hashlib
+import hmac
+import json
+import platform
+import random
+import subprocess
+import tempfile
+import time
+import tracemalloc
+import uuid
+from argparse import ArgumentParser
+from collections import Counter
+from collections.abc import AsyncIterator, Iterator, Sequence
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from datetime import UTC, datetime
+from pathlib import Path
+from typing import Any
+from unittest.mock import patch
+
+import httpx
+import uvicorn
+from fastapi import FastAPI
+
+from qram.config import AppConfig, CfgGithub, CfgQueue, CfgSpool
+from qram.web.app import create_app
+from qram.web.github import AsyncGithubApi
+from qram.web.serve import bind_socket
+
+SECRET = 'bench-secret'  # noqa: S105
+
+# rough shape of what a busy repository sends: mostly CI chatter
+EVENT_WEIGHTS = {
+    'check_run': 30,
+    'status': 20,
+    'pull_request': 15,
+    'push': 12,
+    'check_suite': 10,
+    'pull_request_review': 5,
+    'issue_comment': 5,
+    # not handled, acked without decoding
+    'workflow_job': 3,
+}
+# payload size in bytes -> weight; real ones are mostly 5-50KB with a long tail
+SIZE_WEIGHTS = {2_000: 30, 20_000: 45, 100_000: 20, 1_000_000: 5}
+# distinct payloads to build; requests cycle through them with fresh delivery ids
+CORPUS_SIZE = 200
+
+
+@dataclass
+class Args:
+    requests: int
+    concurrency: int
+    warmup: int
+    alloc_requests: int
+    mode: str
+    spool: bool
+    seed: int
+    output: Path | None
+
+
+def parse_args() -> Args:
+    p = ArgumentParser()
+    _ = p.add_argument('--requests', type=int, default=5_000)
+    _ = p.add_argument('--concurrency', type=int, default=32)
+    _ = p.add_argument('--warmup', type=int, default=200, help='requests not measured')
+    _ = p.add_argument(
+        '--alloc-requests', type=int, default=200, help='requests traced for allocations'
+    )
+    _ = p.add_argument('--mode', choices=('asgi', 'uvicorn', 'both'), default='both')
+    _ = p.add_argument('--spool', action='store_true', help='journal deliveries to disk')
+    _ = p.add_argument('--seed', type=int, default=0)
+    _ = p.add_argument('--output', type=Path, help='write results as JSON here')
+    return Args(**p.parse_args().__dict__)
+
+
+@dataclass(frozen=True)
+class Delivery:
+    event: str
+    body: bytes
+    signature: str
+
+
+def payload(event: str, size: int, rng: random.Random) -> dict[str, Any]:
+    sha = f'{rng.getrandbits(160):040x}'
+    number = rng.randrange(1, 5000)
+    repo = dict(full_name='octo/bench', name='bench', owner=dict(login='octo'))
+    pr = dict(
+        number=number,
+        head=dict(sha=sha, ref=f'feature-{number}'),
+        base=dict(sha=sha, ref='main'),
+        state='open',
+        draft=False,
+        merged=False,
+        labels=[dict(name='ready')],
+    )
+    check = dict(
+        id=rng.getrandbits(32),
+        name='build',
+        head_sha=sha,
+        head_branch=f'feature-{number}',
+        status='completed',
+        conclusion='success',
+        app=dict(slug='ci'),
+        pull_requests=[dict(number=number)],
+    )
+    by_event: dict[str, dict[str, Any]] = {
+        'check_run': dict(action='completed', check_run=check),
+        'status': dict(sha=sha, context='ci/build', state='success'),
+        'pull_request': dict(action='synchronize', pull_request=pr),
+        'push': dict(ref='refs/heads/main', before='0' * 40, after=sha),
+        'check_suite': dict(action='completed', check_suite=check),
+        'pull_request_review': dict(
+            action='submitted',
+            pull_request=pr,
+            review=dict(commit_id=sha, state='APPROVED', user=dict(login='reviewer')),
+        ),
+        'issue_comment': dict(
+            action='created',
+            issue=dict(number=number, pull_request={}),
+            comment=dict(body='/merge', user=dict(login='someone')),
+        ),
+        'workflow_job': dict(action='queued', workflow_job=dict(id=1)),
+    }
+    p = dict(**by_event[event], repository=repo, sender=dict(login='octo'))
+    # bulk standing in for the nested objects real payloads carry (users, repo, commits)
+    filler = dict(id=sha, message='x' * 200, url=f'https://api.github.com/repos/octo/bench/{sha}')
+    p['commits'] = [filler] * max(0, (size - len(json.dumps(p))) // len(json.dumps(filler)))
+    return p
+
+
+def corpus(rng: random.Random) -> list[Delivery]:
+    events = rng.choices(list(EVENT_WEIGHTS), list(EVENT_WEIGHTS.values()), k=CORPUS_SIZE)
+    sizes = rng.choices(list(SIZE_WEIGHTS), list(SIZE_WEIGHTS.values()), k=CORPUS_SIZE)
+    deliveries = []
+    for event, size in zip(events, sizes, strict=True):
+        body = json.dumps(payload(event, size, rng)).encode()
+        mac = hmac.new(SECRET.encode(), body, hashlib.sha256).hexdigest()
+        deliveries.append(Delivery(event, body, f'sha256={mac}'))
+    return deliveries
+
+
+def requests(deliveries: list[Delivery], n: int) -> Iterator[tuple[dict[str, str], bytes]]:
+    for i in range(n):
+        d = deliveries[i % len(deliveries)]
+        headers = {
+            'content-type': 'application/json',
+            'x-github-event': d.event,
+            # fresh id, or everything after the first round would be skipped as redelivery
+            'x-github-delivery': str(uuid.uuid4()),
+            'x-hub-signature-256': d.signature,
+        }
+        yield headers, d.body
+
+
+def make_config(args: Args, spool_dir: Path) -> AppConfig:
+    return AppConfig(
+        bind_to='127.0.0.1',
+        port=0,
+        cors_origin='',
+        github=CfgGithub(app_id='1', installation_id='2', pem='unused', hmac=SECRET),
+        # room for every job: measured is the ack path, not queue-full rejections
+        queue=CfgQueue(max_size=args.requests + args.warmup + args.alloc_requests),
+        spool=CfgSpool(path=str(spool_dir / 'spool.sqlite') if args.spool else None),
+    )
+
+
+@asynccontextmanager
+async def asgi_client(app: FastAPI) -> AsyncIterator[httpx.AsyncClient]:
+    async with (
+        app.router.lifespan_context(app),
+        httpx.AsyncClient(transport=httpx.ASGITransport(app), base_url='http://bench') as client,
+    ):
+        yield client
+
+
+@asynccontextmanager
+async def uvicorn_client(app: FastAPI) -> AsyncIterator[httpx.AsyncClient]:
+    sock = bind_socket('127.0.0.1', 0, reuse_port=False)
+    port = sock.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(app, log_level='warning', lifespan='on'))
+    serving = asyncio.create_task(server.serve(sockets=[sock]))
+    while not server.started:  # noqa: ASYNC110
+        await asyncio.sleep(0.01)
+    try:
+        limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+        async with httpx.AsyncClient(base_url=f'http://127.0.0.1:{port}', limits=limits) as client:
+            yield client
+    finally:
+        server.should_exit = True
+        await serving
+        sock.close()
+
+
+async def load(
+    client: httpx.AsyncClient,
+    reqs: Iterator[tuple[dict[str, str], bytes]],
+    concurrency: int,
+) -> tuple[list[float], Counter[int]]:
+    latencies: list[float] = []
+    statuses: Counter[int] = Counter()
+
+    async def user() -> None:
+        for headers, body in reqs:
+            start = time.perf_counter()
+            r = await client.post('/webhook', content=body, headers=headers)
+            latencies.append(time.perf_counter() - start)
+            statuses[r.status_code] += 1
+
+    _ = await asyncio.gather(*(user() for _ in range(concurrency)))
+    return latencies, statuses
+
+
+async def allocations(
+    client: httpx.AsyncClient, reqs: Iterator[tuple[dict[str, str], bytes]]
+) -> dict[str, float]:
+    """Traced memory per request, one request at a time: peak above baseline and retained."""
+    peaks = []
+    tracemalloc.start()
+    try:
+        start, _ = tracemalloc.get_traced_memory()
+        for headers, body in reqs:
+            before, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            _ = await client.post('/webhook', content=body, headers=headers)
+            _, peak = tracemalloc.get_traced_memory()
+            peaks.append(peak - before)
+        end, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return dict(
+        peak_kib_p50=percentile(peaks, 0.5) / 1024,
+        peak_kib_max=max(peaks) / 1024,
+        retained_bytes_per_request=(end - start) / len(peaks),
+    )
+
+
+def percentile(values: Sequence[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[round(q * (len(ordered) - 1))]
+
+
+async def run(mode: str, args: Args, deliveries: list[Delivery]) -> dict[str, Any]:
+    with tempfile.TemporaryDirectory() as spool_dir:
+        app = create_app(make_config(args, Path(spool_dir)))
+        client_for = asgi_client if mode == 'asgi' else uvicorn_client
+        async with client_for(app) as client:
+            _ = await load(client, requests(deliveries, args.warmup), args.concurrency)
+            start = time.perf_counter()
+            latencies, statuses = await load(
+                client, requests(deliveries, args.requests), args.concurrency
+            )
+            seconds = time.perf_counter() - start
+            alloc = await allocations(client, requests(deliveries, args.alloc_requests))
+    return dict(
+        requests=len(latencies),
+        seconds=seconds,
+        rps=len(latencies) / seconds,
+        latency_ms=dict(
+            p50=percentile(latencies, 0.5) * 1000,
+            p99=percentile(latencies, 0.99) * 1000,
+            p999=percentile(latencies, 0.999) * 1000,
+            max=max(latencies) * 1000,
+        ),
+        statuses={str(k): v for k, v in sorted(statuses.items())},
+        alloc=alloc,
+    )
+
+
+def git_commit() -> str | None:
+    try:
+        r = subprocess.run(
+            ['git', 'rev-parse', 'HEAD'],
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+    except OSError, subprocess.CalledProcessError:
+        return None
+    return r.stdout.strip()
+
+
+def main(args: Args) -> None:
+    deliveries = corpus(random.Random(args.seed))  # noqa: S311
+    modes = ('asgi', 'uvicorn') if args.mode == 'both' else (args.mode,)
+    results: dict[str, Any] = dict(
+        commit=git_commit(),
+        at=datetime.now(tz=UTC).isoformat(),
+        python=platform.python_version(),
+        params=dict(
+            requests=args.requests,
+            concurrency=args.concurrency,
+            spool=args.spool,
+            seed=args.seed,
+            events=dict(Counter(d.event for d in deliveries)),
+            mean_payload_bytes=sum(len(d.body) for d in deliveries) / len(deliveries),
+        ),
+    )
+    # webhook path never calls github; keep background token renewal from trying either
+    with patch.object(AsyncGithubApi, 'start'):
+        for mode in modes:
+            r = results[mode] = asyncio.run(run(mode, args, deliveries))
+            lat = r['latency_ms']
+            print(
+                f'{mode:>8}: {r["rps"]:8.0f} req/s'
+                f'  p50 {lat["p50"]:6.2f}ms  p99 {lat["p99"]:6.2f}ms  p999 {lat["p999"]:6.2f}ms'
+                f'  peak {r["alloc"]["peak_kib_p50"]:7.1f}KiB/req  statuses {r["statuses"]}'
+            )
+    if args.output:
+        args.output.parent.mkdir(parents=True, exist_ok=True)
+        _ = args.output.write_text(json.dumps(results, indent=2) + '\n')
+        print(f'results written to {args.output}')
+
+
+if __name__ == '__main__':
+    main(parse_args())
@@ -1,9 +1,10 @@
+import json
 import logging
 import os
 from pathlib import Path
-from typing import Any
+from typing import Any, Literal
 
-from pydantic import BaseModel, StrictStr, model_validator
+from pydantic import BaseModel, Field, StrictStr, field_validator, model_validator
 
 logger = logging.getLogger(__name__)
 
@@ -15,6 +16,17 @@ class AppConfig(BaseModel, extra='forbid'):
     port: int
     cors_origin: StrictStr
     github: CfgGithub | None
+    # github caps webhook payloads at 25MB
+    max_body_size: int = 25 * 1024 * 1024
+    # lambdas, since sub-configs are defined below
+    http: CfgHttp = Field(default_factory=lambda: CfgHttp())  # noqa: PLW0108
+    retry: CfgRetry = Field(default_factory=lambda: CfgRetry())  # noqa: PLW0108
+    queue: CfgQueue = Field(default_factory=lambda: CfgQueue())  # noqa: PLW0108
+    spool: CfgSpool = Field(default_factory=lambda: CfgSpool())  # noqa: PLW0108
+    dedup: CfgDedup = Field(default_factory=lambda: CfgDedup())  # noqa: PLW0108
+    coalesce: CfgCoalesce = Field(default_factory=lambda: CfgCoalesce())  # noqa: PLW0108
+    server: CfgServer = Field(default_factory=lambda: CfgServer())  # noqa: PLW0108
+    merge_queue: CfgMergeQueue = Field(default_factory=lambda: CfgMergeQueue())  # noqa: PLW0108
 
     @staticmethod
     def config_from_env() -> AppConfig:
@@ -22,6 +34,64 @@ class AppConfig(BaseModel, extra='forbid'):
         payload['bind_to'] = os.environ.get('QRAM_BIND_TO', '127.0.0.1')
         payload['port'] = int(os.environ.get('QRAM_PORT', '7890'))
         payload['cors_origin'] = os.environ.get('QRAM_CORS_ORIGIN', '')
+        payload.update(_envvars_if_set(max_body_size='QRAM_MAX_BODY_SIZE'))
+        payload['http'] = _envvars_if_set(
+            http2='QRAM_HTTP2',
+            max_connections='QRAM_HTTP_MAX_CONNECTIONS',
+            max_keepalive_connections='QRAM_HTTP_MAX_KEEPALIVE_CONNECTIONS',
+            keepalive_expiry='QRAM_HTTP_KEEPALIVE_EXPIRY',
+            cache_max_bytes='QRAM_HTTP_CACHE_MAX_BYTES',
+            connect_timeout='QRAM_HTTP_CONNECT_TIMEOUT',
+            read_timeout='QRAM_HTTP_READ_TIMEOUT',
+            write_timeout='QRAM_HTTP_WRITE_TIMEOUT',
+            pool_timeout='QRAM_HTTP_POOL_TIMEOUT',
+            read_timeout_overrides='QRAM_HTTP_READ_TIMEOUT_OVERRIDES',
+        )
+        payload['retry'] = _envvars_if_set(
+            attempts='QRAM_RETRY_ATTEMPTS',
+            base_delay='QRAM_RETRY_BASE_DELAY',
+            max_delay='QRAM_RETRY_MAX_DELAY',
+            deadline='QRAM_RETRY_DEADLINE',
+            hedge_gets='QRAM_RETRY_HEDGE_GETS',
+            breaker_threshold='QRAM_RETRY_BREAKER_THRESHOLD',
+            breaker_reset_after='QRAM_RETRY_BREAKER_RESET_AFTER',
+        )
+        payload['queue'] = _envvars_if_set(
+            workers='QRAM_QUEUE_WORKERS',
+            max_size='QRAM_QUEUE_MAX_SIZE',
+            retry_after='QRAM_QUEUE_RETRY_AFTER',
+            drain_timeout='QRAM_QUEUE_DRAIN_TIMEOUT',
+        )
+        payload['spool'] = _envvars_if_set(
+            path='QRAM_SPOOL_PATH',
+            compact_every='QRAM_SPOOL_COMPACT_EVERY',
+        )
+        payload['dedup'] = _envvars_if_set(
+            max_size='QRAM_DEDUP_MAX_SIZE',
+            ttl='QRAM_DEDUP_TTL',
+        )
+        payload['coalesce'] = _envvars_if_set(
+            window='QRAM_COALESCE_WINDOW',
+            max_delay='QRAM_COALESCE_MAX_DELAY',
+        )
+        payload['server'] = _envvars_if_set(
+            workers='QRAM_SERVER_WORKERS',
+            loop='QRAM_SERVER_LOOP',
+            http='QRAM_SERVER_HTTP',
+            reuse_port='QRAM_SERVER_REUSE_PORT',
+            state_path='QRAM_SERVER_STATE_PATH',
+        )
+        payload['merge_queue'] = _envvars_if_set(
+            enabled='QRAM_MERGE_QUEUE_ENABLED',
+            label='QRAM_MERGE_QUEUE_LABEL',
+            batch_size='QRAM_MERGE_QUEUE_BATCH_SIZE',
+            max_batch_size='QRAM_MERGE_QUEUE_MAX_BATCH_SIZE',
+            target_failure_rate='QRAM_MERGE_QUEUE_TARGET_FAILURE_RATE',
+            failure_window='QRAM_MERGE_QUEUE_FAILURE_WINDOW',
+            depth='QRAM_MERGE_QUEUE_DEPTH',
+            required_checks='QRAM_MERGE_QUEUE_REQUIRED_CHECKS',
+            branch_prefix='QRAM_MERGE_QUEUE_BRANCH_PREFIX',
+        )
 
         provider = _envvar('QRAM_PROVIDER')
         if provider == 'github':
@@ -33,6 +103,7 @@ class AppConfig(BaseModel, extra='forbid'):
                 installation_id=_envvar('QRAM_GITHUB_INSTALLATION_ID'),
                 pem=pem,
                 hmac=hmac,
+                **_envvars_if_set(api_url='QRAM_GITHUB_API_URL'),
             )
         else:
             msg = f'unsupported provider: {provider}'
@@ -48,12 +119,153 @@ class AppConfig(BaseModel, extra='forbid'):
             raise ValueError(msg)
         return self
 
+    @model_validator(mode='after')
+    def ensure_single_merge_queue(self) -> AppConfig:
+        if self.merge_queue.enabled and self.server.workers > 1:
+            # each worker would see only some of the events and run a queue of its own
+            msg = 'merge queue keeps its state in memory and needs a single worker'
+            raise ValueError(msg)
+        return self
+
 
 class CfgGithub(BaseModel, extra='forbid'):
     app_id: StrictStr
     installation_id: StrictStr
     pem: StrictStr
     hmac: StrictStr
+    # e.g. https://ghe.example.com/api/v3/ for GitHub Enterprise, or a local fake for tests
+    api_url: StrictStr = 'https://api.github.com/'
+
+    @field_validator('api_url')
+    @classmethod
+    def ensure_trailing_slash(cls, v: str) -> str:
+        # API paths are appended to it as they are
+        return v if v.endswith('/') else f'{v}/'
+
+
+class CfgHttp(BaseModel, extra='forbid'):
+    """Settings for the shared outgoing HTTP client (connection pool to GitHub API)."""
+
+    http2: bool = True
+    max_connections: int = 100
+    max_keepalive_connections: int = 20
+    # seconds an idle connection is kept around before being closed
+    keepalive_expiry: float = 30.0
+    # total size of GET response bodies kept for conditional requests; 0 disables the cache
+    cache_max_bytes: int = 32 * 1024 * 1024
+    # seconds; connect includes DNS, pool is waiting for a free connection
+    connect_timeout: float = 5.0
+    read_timeout: float = 30.0
+    write_timeout: float = 30.0
+    pool_timeout: float = 10.0
+    # route template -> read timeout, for endpoints known to be slow (or expected to be fast),
+    # e.g. {"repos/{owner}/{repo}/compare/{basehead}": 60}; JSON object in env var
+    read_timeout_overrides: dict[str, float] = Field(default_factory=dict)
+
+    @field_validator('read_timeout_overrides', mode='before')
+    @classmethod
+    def parse_json(cls, v: object) -> object:
+        return json.loads(v) if isinstance(v, str) else v
+
+
+class CfgRetry(BaseModel, extra='forbid'):
+    """Settings for retrying failed GitHub API calls."""
+
+    # total attempts of an idempotent request, including the first one
+    attempts: int = 4
+    # seconds; backoff doubles with every attempt, up to max_delay
+    base_delay: float = 0.5
+    max_delay: float = 8.0
+    # seconds since the first attempt after which no more retries are made, and the attempt
+    # still running is given up
+    deadline: float = 30.0
+    # send a second GET if the first one is slower than 95% of recent ones
+    hedge_gets: bool = False
+    # consecutive failures after which requests fail fast, and for how many seconds
+    breaker_threshold: int = 5
+    breaker_reset_after: float = 30.0
+
+
+class CfgQueue(BaseModel, extra='forbid'):
+    """Settings for the in-process queue between webhook acknowledgement and processing."""
+
+    workers: int = 4
+    max_size: int = 1000
+    # seconds suggested to the sender via Retry-After when the queue is full
+    retry_after: int = 5
+    # seconds to wait on shutdown for the queued jobs to finish
+    drain_timeout: float = 10.0
+
+
+class CfgSpool(BaseModel, extra='forbid'):
+    """Settings for the on-disk journal of accepted webhook deliveries."""
+
+    # sqlite database file; spool is disabled if not set
+    path: StrictStr | None = None
+    # compact the journal after this many deliveries are processed
+    compact_every: int = 1000
+
+
+class CfgDedup(BaseModel, extra='forbid'):
+    """Settings for skipping redelivered webhooks."""
+
+    max_size: int = 10000
+    # seconds a delivery id is remembered; persisted in spool, if it is enabled
+    ttl: float = 24 * 3600
+
+
+class CfgCoalesce(BaseModel, extra='forbid'):
+    """Settings for processing bursts of events about one pull request or commit at once."""
+
+    # seconds without new events about a pull request or commit before its events are
+    # processed; 0 processes every event as soon as it arrives
+    window: float = 1.0
+    # seconds an event is held back at most, however busy its pull request or commit stays
+    max_delay: float = 5.0
+
+
+class CfgServer(BaseModel, extra='forbid'):
+    """Settings for serving incoming webhooks."""
+
+    # worker processes; more than one share dedup, github token and spool via `state_path`
+    workers: int = 1
+    # uvloop and httptools are used by 'auto' if installed
+    loop: Literal['auto', 'asyncio', 'uvloop'] = 'auto'
+    http: Literal['auto', 'h11', 'httptools'] = 'auto'
+    # each worker binds its own socket and kernel spreads connections between them;
+    # otherwise workers accept from a single socket bound by the supervisor
+    reuse_port: bool = True
+    # sqlite database file with state shared by workers; defaults to one in temp dir
+    state_path: StrictStr | None = None
+
+
+class CfgMergeQueue(BaseModel, extra='forbid'):
+    """Settings for merging queued pull requests in speculative batches."""
+
+    # off by default: when on, qram pushes candidate branches and updates base branches
+    enabled: bool = False
+    # pull requests carrying this label are queued for merging
+    label: StrictStr = 'merge-queue'
+    # pull requests tested together by one candidate, to begin with; then it is adjusted per
+    # repository between 1 and max_batch_size, by the failure rate of its last candidates
+    batch_size: int = 4
+    max_batch_size: int = 16
+    # batches grow while at most this share of the last failure_window candidates failed,
+    # and shrink when more did
+    target_failure_rate: float = 0.2
+    failure_window: int = 20
+    # candidates under test at a time per base branch, each one including all before it
+    depth: int = 3
+    # checks that must pass on a candidate; taken from branch protection if empty;
+    # JSON list in env var
+    required_checks: list[str] = Field(default_factory=list)
+    # candidate branches are named <prefix><base branch>/<n>
+    branch_prefix: StrictStr = 'qram/merge-queue/'
+
+    @field_validator('required_checks', mode='before')
+    @classmethod
+    def parse_json(cls, v: object) -> object:
+        return json.loads(v) if isinstance(v, str) else v
 
 
 def _envvar(var: str) -> str:
@@ -64,6 +276,14 @@ def _envvar(var: str) -> str:
     return v
 
 
+def _envvars_if_set(**fields: str) -> dict[str, str]:
+    """Map field names to values of their env vars, skipping unset ones.
+
+    Leaves defaults to the model and string coercion to pydantic.
+    """
+    return {field: os.environ[var] for field, var in fields.items() if var in os.environ}
+
+
 def _file_fallback(value_env: str, file_env: str) -> str:
     value = os.environ.get(value_env)
     if value:
@@ -0,0 +1,256 @@
+import threading
+from bisect import bisect_left
+from collections.abc import Callable, Iterable, Mapping, Sequence
+from dataclasses import dataclass
+
+# In-process metrics, exposed in Prometheus text format.
+# Recording is a dict lookup and a few increments: cheap enough for every request, unlike
+# logging. Each thread records into its own shard, so there is no lock on the hot path, and
+# no lost updates if something ever records from a worker thread; shards are only summed up
+# when metrics are collected.
+#
+# Metrics are per process. Worker processes of one server each render theirs with a `worker`
+# label and keep them in shared state, so that whichever of them is scraped can `merge` them
+# all into one view; the others' are then as old as their latest publishing.
+
+# seconds; from a fast keep-alive call to github up to the default read timeout
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# seconds; for work done in-process, like hashing or decoding a payload
+FAST_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1)
+
+type Labels = tuple[str, ...]
+# (name, value) of labels every series gets
+type ConstLabels = tuple[tuple[str, str], ...]
+# label values -> value, for metrics computed at collection time
+type Collect = Callable[[], Iterable[tuple[Labels, float]]]
+
+
+class _Sharded[T]:
+    """Per-thread dicts of label values -> T."""
+
+    _local: threading.local
+    _shards: list[dict[Labels, T]]
+    _lock: threading.Lock
+
+    def __init__(self) -> None:
+        self._local = threading.local()
+        self._shards = []
+        self._lock = threading.Lock()
+
+    def _shard(self) -> dict[Labels, T]:
+        try:
+            shard: dict[Labels, T] = self._local.shard
+        except AttributeError:
+            # once per thread
+            shard = self._local.shard = {}
+            with self._lock:
+                self._shards.append(shard)
+        return shard
+
+    def _all_shards(self) -> list[dict[Labels, T]]:
+        with self._lock:
+            return list(self._shards)
+
+
+class Counter(_Sharded[float]):
+    name: str
+    help: str
+    label_names: Labels
+
+    def __init__(self, name: str, help: str, label_names: Sequence[str]) -> None:  # noqa: A002
+        super().__init__()
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+
+    def inc(self, *labels: str, value: float = 1) -> None:
+        shard = self._shard()
+        shard[labels] = shard.get(labels, 0) + value
+
+    def collect(self) -> dict[Labels, float]:
+        total: dict[Labels, float] = {}
+        for shard in self._all_shards():
+            # copy first: owning thread may be adding keys meanwhile
+            for labels, value in list(shard.items()):
+                total[labels] = total.get(labels, 0) + value
+        return total
+
+
+@dataclass(slots=True)
+class HistogramSeries:
+    # counts[i] is the number of observations <= buckets[i]; last one is for the rest (+Inf)
+    counts: list[int]
+    total: float = 0.0
+    count: int = 0
+
+    def cumulative(self) -> list[int]:
+        out, running = [], 0
+        for c in self.counts:
+            running += c
+            out.append(running)
+        return out
+
+    def merge(self, other: HistogramSeries) -> None:
+        self.counts = [a + b for a, b in zip(self.counts, other.counts, strict=True)]
+        self.total += other.total
+        self.count += other.count
+
+
+class Histogram(_Sharded[HistogramSeries]):
+    name: str
+    help: str
+    label_names: Labels
+    buckets: tuple[float, ...]
+
+    def __init__(
+        self,
+        name: str,
+        help: str,  # noqa: A002
+        label_names: Sequence[str],
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ) -> None:
+        super().__init__()
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, *labels: str) -> None:
+        shard = self._shard()
+        s = shard.get(labels)
+        if s is None:
+            assert len(labels) == len(self.label_names), f'{self.name} expects {self.label_names}'
+            s = shard[labels] = HistogramSeries([0] * (len(self.buckets) + 1))
+        s.counts[bisect_left(self.buckets, value)] += 1
+        s.total += value
+        s.count += 1
+
+    @property
+    def series(self) -> dict[Labels, HistogramSeries]:
+        merged: dict[Labels, HistogramSeries] = {}
+        for shard in self._all_shards():
+            for labels, s in list(shard.items()):
+                if labels not in merged:
+                    merged[labels] = HistogramSeries([0] * len(s.counts))
+                merged[labels].merge(s)
+        return merged
+
+
+@dataclass(frozen=True, slots=True)
+class Collector:
+    """Metric whose values are read from somewhere else when metrics are collected.
+
+    For what is already counted or known elsewhere (queue depth, rate limit budget), so that
+    keeping it costs nothing until somebody asks.
+    """
+
+    name: str
+    help: str
+    # 'gauge' or 'counter'
+    type: str
+    label_names: Labels
+    collect: Collect
+
+
+class Registry:
+    metrics: dict[str, Counter | Histogram | Collector]
+
+    def __init__(self) -> None:
+        self.metrics = {}
+
+    def counter(self, name: str, help: str, label_names: Sequence[str] = ()) -> Counter:  # noqa: A002
+        """Register a counter; registering the same name again returns the existing one."""
+        if not isinstance(c := self.metrics.get(name), Counter):
+            c = self.metrics[name] = Counter(name, help, label_names)
+        return c
+
+    def histogram(
+        self,
+        name: str,
+        help: str,  # noqa: A002
+        label_names: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ) -> Histogram:
+        """Register a histogram; registering the same name again returns the existing one."""
+        if not isinstance(h := self.metrics.get(name), Histogram):
+            h = self.metrics[name] = Histogram(name, help, label_names, buckets)
+        return h
+
+    def register(self, collector: Collector) -> None:
+        """Add or replace a collector; it usually refers to objects of a running app."""
+        self.metrics[collector.name] = collector
+
+    def unregister(self, name: str) -> None:
+        _ = self.metrics.pop(name, None)
+
+    def render(self, const_labels: Mapping[str, str] | None = None) -> str:
+        """All metrics in Prometheus text exposition format, with `const_labels` on every series."""
+        const = tuple((const_labels or {}).items())
+        lines: list[str] = []
+        for m in list(self.metrics.values()):
+            match m:
+                case Counter():
+                    lines += _header(m.name, m.help, 'counter')
+                    for labels, value in m.collect().items():
+                        lines.append(f'{m.name}{_labels(m.label_names, labels, const)} {value}')
+                case Histogram():
+                    lines += _header(m.name, m.help, 'histogram')
+                    for labels, s in m.series.items():
+                        lines += _histogram_lines(m, labels, s, const)
+                case Collector():
+                    lines += _header(m.name, m.help, m.type)
+                    for labels, value in m.collect():
+                        lines.append(f'{m.name}{_labels(m.label_names, labels, const)} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+def merge(expositions: Iterable[str]) -> str:
+    """Expositions of several processes in one, their series told apart by a constant label.
+
+    The format wants all series of a metric under its one header, so they are grouped by metric.
+    """
+    families: dict[str, list[str]] = {}
+    for text in expositions:
+        lines: list[str] = []
+        fresh = False
+        for line in text.splitlines():
+            if line.startswith('# HELP '):
+                name = line.split(' ', 3)[2]
+                fresh = name not in families
+                lines = families.setdefault(name, [])
+            if fresh or not line.startswith('# '):
+                lines.append(line)
+    return '\n'.join(line for lines in families.values() for line in lines) + '\n'
+
+
+def _header(name: str, help: str, kind: str) -> list[str]:  # noqa: A002
+    return [f'# HELP {name} {help}', f'# TYPE {name} {kind}']
+
+
+def _histogram_lines(
+    h: Histogram, labels: Labels, s: HistogramSeries, const: ConstLabels
+) -> list[str]:
+    names = (*h.label_names, 'le')
+    bounds = [*(repr(b) for b in h.buckets), '+Inf']
+    return [
+        *(
+            f'{h.name}_bucket{_labels(names, (*labels, le), const)} {n}'
+            for le, n in zip(bounds, s.cumulative(), strict=True)
+        ),
+        f'{h.name}_sum{_labels(h.label_names, labels, const)} {s.total}',
+        f'{h.name}_count{_labels(h.label_names, labels, const)} {s.count}',
+    ]
+
+
+def _labels(names: Labels, values: Labels, const: ConstLabels) -> str:
+    if not names and not const:
+        return ''
+    pairs = ','.join(f'{k}="{_escape(v)}"' for k, v in (*const, *zip(names, values, strict=True)))
+    return f'{{{pairs}}}'
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+REGISTRY = Registry()
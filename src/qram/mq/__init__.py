@@ -0,0 +1,3 @@
+from .engine import MergeQueue as MergeQueue
+from .github import GithubMergeBackend as GithubMergeBackend
+from .index import PullIndex as PullIndex
@@ -0,0 +1,114 @@
+from collections.abc import Awaitable, Callable
+from typing import Literal
+
+from qram.web.github.events import CheckRunEvent, StatusEvent
+
+# Outcome of the required checks of a sha, decided as check runs and statuses report in.
+# Large repositories run a hundred or more checks per sha, and each one reports several times
+# (queued, in progress, completed), so every report updates counts in constant time instead of
+# going over the whole required set; the first failure decides, without waiting for the rest.
+
+type Outcome = Literal['pending', 'passed', 'failed']
+type CheckState = Literal['pending', 'success', 'failure']
+type Decided = Callable[[Outcome], Awaitable[None]]
+
+# check run conclusions that do not block merging
+PASSING_CONCLUSIONS = frozenset({'success', 'neutral', 'skipped'})
+
+
+class RequiredChecks:
+    """Required checks of one sha: how many passed and failed so far, and what that means."""
+
+    required: frozenset[str]
+    # required check name -> latest state reported
+    states: dict[str, CheckState]
+    success: int
+    failure: int
+    outcome: Outcome
+
+    def __init__(self, required: frozenset[str]) -> None:
+        assert required, 'nothing to decide on without required checks'
+        self.required = required
+        self.states = {}
+        self.success = 0
+        self.failure = 0
+        self.outcome = 'pending'
+
+    @property
+    def pending(self) -> int:
+        """Required checks that did not report, or not a result yet."""
+        return len(self.required) - self.success - self.failure
+
+    def update(self, name: str, state: CheckState) -> bool:
+        """Take a report in; True if it is the one that decided the outcome."""
+        if self.outcome != 'pending' or name not in self.required:
+            return False
+        old = self.states.get(name)
+        if old == state:
+            return False
+        self.states[name] = state
+        if old == 'success':
+            self.success -= 1
+        elif old == 'failure':
+            self.failure -= 1
+        if state == 'success':
+            self.success += 1
+        elif state == 'failure':
+            self.failure += 1
+        if self.failure:
+            self.outcome = 'failed'
+        elif not self.pending:
+            self.outcome = 'passed'
+        return self.outcome != 'pending'
+
+    def failing(self) -> list[str]:
+        return sorted(name for name, state in self.states.items() if state == 'failure')
+
+
+class CheckAggregator:
+    """Required checks of shas under test, each with a callback awaited once it is decided.
+
+    A sha is watched until it is forgotten, decided or not; reports for anything else, such as
+    checks of pull request heads or of candidates that were dropped, cost a dict lookup.
+    """
+
+    # (repo, sha) -> checks and what to call once they decide
+    watched: dict[tuple[str, str], tuple[RequiredChecks, Decided]]
+
+    def __init__(self) -> None:
+        self.watched = {}
+
+    def watch(
+        self, repo: str, sha: str, required: frozenset[str], on_decided: Decided
+    ) -> RequiredChecks:
+        checks = RequiredChecks(required)
+        self.watched[repo, sha] = (checks, on_decided)
+        return checks
+
+    def forget(self, repo: str, sha: str) -> bool:
+        """Stop watching a sha; False if it was not watched."""
+        return self.watched.pop((repo, sha), None) is not None
+
+    async def report(self, repo: str, sha: str, name: str, state: CheckState) -> None:
+        w = self.watched.get((repo, sha))
+        if w is None:
+            return
+        checks, on_decided = w
+        if checks.update(name, state):
+            await on_decided(checks.outcome)
+
+
+def check_run_state(event: CheckRunEvent) -> CheckState:
+    if event.status != 'completed':
+        return 'pending'
+    return 'success' if event.conclusion in PASSING_CONCLUSIONS else 'failure'
+
+
+def status_state(event: StatusEvent) -> CheckState:
+    match event.state:
+        case 'success':
+            return 'success'
+        case 'pending':
+            return 'pending'
+        case _:
+            return 'failure'
@@ -0,0 +1,610 @@
+import asyncio
+import logging
+from collections import deque
+from collections.abc import Sequence
+from dataclasses import dataclass
+from functools import partial
+from typing import Literal, Protocol
+
+from qram.config import CfgMergeQueue
+from qram.metrics import REGISTRY
+from qram.mq.checks import (
+    CheckAggregator,
+    Outcome,
+    RequiredChecks,
+    check_run_state,
+    status_state,
+)
+from qram.mq.index import PullIndex
+from qram.mq.sizing import BatchSizer
+from qram.web.github.events import (
+    CheckRunEvent,
+    GithubEvent,
+    PullRequestEvent,
+    PullRequestReviewEvent,
+    PushEvent,
+    StatusEvent,
+)
+
+logger = logging.getLogger(__name__)
+
+# Merge queue: pull requests labeled for merging are merged in batches, each batch tested on top
+# of everything queued before it. Several candidates are under test at once: while CI runs on
+# base+A, it also runs on base+A+B and base+A+B+C, so that once A passes the next ones are well
+# on their way, and merged pull requests per hour grow with CI parallelism instead of being
+# bound by how long one CI run takes. A candidate that passes is merged along with everything
+# under it by fast-forwarding the base branch to it.
+#
+# A batch that fails is bisected: both halves are tested at once on their own, and halves that
+# fail are split again until single culprits are left, in about log2(n) rounds of CI. Batch size
+# of each repository follows its recent failure rate (see BatchSizer).
+#
+# Nothing polls: every state change is a reaction to a webhook (label added, check finished,
+# base branch pushed to), and whatever github must do is done through a MergeBackend. State is
+# in memory only; after a restart, pull requests are queued again by their next event.
+
+# how building a candidate went: 'dropped' if it no longer belongs in the queue,
+# 'failed' if github could not be asked to
+type Built = Literal['built', 'dropped', 'failed']
+
+# shas base branch was fast-forwarded to, kept to tell our own pushes from someone else's
+MERGED_SHAS_KEPT = 32
+
+MERGED = REGISTRY.counter('qram_merge_queue_merged_total', 'Pull requests merged by merge queue.')
+REJECTED = REGISTRY.counter(
+    'qram_merge_queue_rejected_total',
+    'Pull requests taken out of merge queue, by reason.',
+    ('reason',),
+)
+CANDIDATES = REGISTRY.counter(
+    'qram_merge_queue_candidates_total',
+    'Speculative merge candidates, by how they ended.',
+    ('outcome',),
+)
+
+
+class MergeConflictError(Exception):
+    number: int
+
+    def __init__(self, number: int) -> None:
+        super().__init__(f'#{number} does not merge cleanly')
+        self.number = number
+
+
+@dataclass(slots=True)
+class Entry:
+    number: int
+    head_sha: str
+    # tested in a batch of its own: it was in a failed batch that bisection found no culprit in
+    solo: bool = False
+
+
+@dataclass(eq=False, slots=True)
+class Candidate:
+    branch: str
+    # pull requests it adds on top of `parent`
+    batch: list[Entry]
+    # candidate it is built on; None if it is built on the base branch
+    parent: Candidate | None
+    # None while it is being built
+    sha: str | None = None
+    outcome: Outcome = 'pending'
+    # required checks of `sha`, once it is built
+    checks: RequiredChecks | None = None
+    # for halves of a bisected batch: the other half
+    sibling: Candidate | None = None
+
+
+class MergeBackend(Protocol):
+    """What merge queue needs done in a repository; implemented on top of github API."""
+
+    async def required_checks(self, repo: str, base: str) -> frozenset[str]: ...
+
+    async def build(
+        self, repo: str, branch: str, base: str, onto: str | None, entries: Sequence[Entry]
+    ) -> str:
+        """Point `branch` at `onto` (head of `base` if None), merge `entries` into it in order.
+
+        Returns sha of the result; raises MergeConflictError naming the first one that does not
+        merge cleanly.
+        """
+        ...
+
+    async def fast_forward(self, repo: str, base: str, sha: str) -> bool:
+        """Move `base` to `sha`; False if `sha` is not a descendant of its head."""
+        ...
+
+    async def delete_branch(self, repo: str, branch: str) -> None: ...
+
+    async def reject(self, repo: str, number: int, reason: str) -> None:
+        """Tell the pull request author why it was taken out of the queue, and unlabel it."""
+        ...
+
+
+class BranchQueue:
+    """Pull requests queued for merging into one branch of one repository.
+
+    `candidates` are in queue order, each built on the last one before it that has not failed.
+    A failed candidate stays until its parent is known to be good, as only then its own batch
+    is to blame; candidates after it are rebuilt without it meanwhile. `probes` test halves of
+    blamed batches on top of the base branch; they are not merged, only tell which pull
+    requests go back to the queue and which are rejected.
+
+    State changes under `_lock`, github calls that decide state included. Building candidates,
+    a merge call per pull request, is done outside of it by one coroutine at a time. Deleting
+    branches and telling authors why their pull requests were rejected is best effort: it never
+    stops a state change halfway.
+    """
+
+    repo: str
+    base: str
+    cfg: CfgMergeQueue
+    backend: MergeBackend
+    # number -> every queued pull request, in a candidate or not
+    entries: dict[int, Entry]
+    # queued pull requests that are not in any candidate yet, in order
+    waiting: list[Entry]
+    candidates: list[Candidate]
+    probes: list[Candidate]
+    # watches candidates under test, and calls back as soon as one passes or fails
+    checks: CheckAggregator
+    sizer: BatchSizer
+    # None until first needed; changes to branch protection are picked up on restart
+    required: frozenset[str] | None
+    merged_shas: deque[str]
+    _lock: asyncio.Lock
+    _building: bool
+    # probes waiting to be built
+    _unbuilt: list[Candidate]
+    _seq: int
+
+    def __init__(  # noqa: PLR0913
+        self,
+        repo: str,
+        base: str,
+        cfg: CfgMergeQueue,
+        backend: MergeBackend,
+        *,
+        sizer: BatchSizer | None = None,
+        checks: CheckAggregator | None = None,
+    ) -> None:
+        self.repo = repo
+        self.base = base
+        self.cfg = cfg
+        self.backend = backend
+        self.entries = {}
+        self.waiting = []
+        self.candidates = []
+        self.probes = []
+        self.checks = checks or CheckAggregator()
+        self.sizer = sizer or BatchSizer(cfg)
+        self.required = None
+        self.merged_shas = deque(maxlen=MERGED_SHAS_KEPT)
+        self._lock = asyncio.Lock()
+        self._building = False
+        self._unbuilt = []
+        self._seq = 0
+
+    def __repr__(self) -> str:
+        return f'{self.repo}:{self.base}'
+
+    async def enqueue(self, number: int, head_sha: str) -> None:
+        async with self._lock:
+            e = self.entries.get(number)
+            if e is not None and e.head_sha == head_sha:
+                return
+            if e is not None:
+                await self._remove(number)
+            e = self.entries[number] = Entry(number, head_sha)
+            self.waiting.append(e)
+            logger.info(f'{self}: #{number} queued')
+        await self._advance()
+
+    async def dequeue(self, number: int, reason: str | None = None, message: str = '') -> None:
+        """Take pull request out of the queue; with `reason`, it is rejected with `message`."""
+        async with self._lock:
+            if not await self._remove(number):
+                return
+            logger.info(f'{self}: #{number} dequeued ({reason or "by user"})')
+            if reason:
+                REJECTED.inc(reason)
+                await self._reject(number, message)
+        await self._advance()
+
+    async def _decided(self, c: Candidate, outcome: Outcome) -> None:
+        async with self._lock:
+            if c not in self.candidates and c not in self.probes:
+                return
+            c.outcome = outcome
+            if c in self.probes:
+                await self._settle_probe(c)
+            elif outcome == 'passed':
+                await self._merge(c)
+            else:
+                await self._fail(c)
+            if outcome == 'failed':
+                # cancelled right away rather than left to finish the checks that remain
+                await self._retire(c)
+        await self._advance()
+
+    async def on_base_push(self, sha: str) -> None:
+        async with self._lock:
+            if sha in self.merged_shas or not self.candidates:
+                return
+            # pushed by somebody else: candidates no longer include the head of base branch
+            logger.info(f'{self}: base branch moved to {sha}; rebuilding candidates')
+            await self._discard_from(self.candidates[0])
+        await self._advance()
+
+    async def _merge(self, c: Candidate) -> None:
+        assert c.sha is not None
+        try:
+            moved = await self.backend.fast_forward(self.repo, self.base, c.sha)
+        except Exception:
+            # checks that passed do not report again; the candidates have to be tested anew
+            logger.exception(f'{self}: merging {c.branch} failed; rebuilding candidates')
+            await self._discard_from(self.candidates[0])
+            return
+        if not moved:
+            logger.info(f'{self}: base branch moved under {c.branch}; rebuilding candidates')
+            await self._discard_from(self.candidates[0])
+            return
+        self.merged_shas.append(c.sha)
+        i = self.candidates.index(c)
+        done = self.candidates[: i + 1]
+        del self.candidates[: i + 1]
+        for d in done:
+            if d.outcome == 'failed':
+                # built on what has just passed as part of `c`, so its own batch is to blame
+                await self._blame(d)
+                continue
+            CANDIDATES.inc('passed')
+            self.sizer.record(failed=False)
+            for e in d.batch:
+                del self.entries[e.number]
+                MERGED.inc()
+            await self._retire(d)
+        logger.info(f'{self}: merged {c.branch} at {c.sha}')
+        for d in list(self.candidates):
+            if d.parent in done:
+                d.parent = None
+                if d.outcome == 'failed':
+                    self.candidates.remove(d)
+                    await self._blame(d)
+
+    async def _fail(self, c: Candidate) -> None:
+        i = self.candidates.index(c)
+        if i + 1 < len(self.candidates):
+            # they include `c`; new ones are built without it
+            await self._discard_from(self.candidates[i + 1])
+        logger.info(f'{self}: {c.branch} failed')
+        if c.parent is None:
+            self.candidates.remove(c)
+            await self._blame(c)
+
+    async def _blame(self, c: Candidate) -> None:
+        """Deal with a candidate that failed on top of a good parent: its batch is at fault."""
+        CANDIDATES.inc('failed')
+        self.sizer.record(failed=True)
+        await self._retire(c)
+        live = self._live(c.batch)
+        if len(live) > 1:
+            self._bisect(live)
+        elif live:
+            await self._reject_failed(c, live[0])
+
+    def _bisect(self, entries: list[Entry]) -> None:
+        mid = len(entries) // 2
+        left = self._new_candidate(entries[:mid], parent=None)
+        right = self._new_candidate(entries[mid:], parent=None)
+        left.sibling, right.sibling = right, left
+        self.probes += [left, right]
+        self._unbuilt += [left, right]
+        logger.info(
+            f'{self}: bisecting {[e.number for e in entries[:mid]]}'
+            f' and {[e.number for e in entries[mid:]]}'
+        )
+
+    async def _settle_probe(self, p: Candidate) -> None:
+        s = p.sibling
+        if s is not None and s in self.probes and s.outcome == 'pending':
+            # halves are judged together, once both are done
+            return
+        # in queue order
+        halves = [q for q in self.probes if q in (p, s)]
+        culprit_found = any(q.outcome == 'failed' for q in halves)
+        innocent: list[Entry] = []
+        for q in halves:
+            CANDIDATES.inc('probe')
+            self.probes.remove(q)
+            await self._retire(q)
+            live = self._live(q.batch)
+            if q.outcome == 'passed':
+                innocent += live
+            elif len(live) > 1:
+                self._bisect(live)
+            elif live:
+                await self._reject_failed(q, live[0])
+        if not culprit_found:
+            # each half passes on its own: a flaky check, or they break only together;
+            # one at a time, the one that breaks it is the one that fails
+            for e in innocent:
+                e.solo = True
+        # they have waited long enough
+        self.waiting[:0] = innocent
+
+    async def _reject_failed(self, c: Candidate, e: Entry) -> None:
+        failed = c.checks.failing() if c.checks else []
+        del self.entries[e.number]
+        REJECTED.inc('failed')
+        await self._reject(
+            e.number,
+            f'Required checks failed when merged into `{self.base}`: {", ".join(failed)}.',
+        )
+
+    async def _remove(self, number: int) -> bool:
+        e = self.entries.pop(number, None)
+        if e is None:
+            return False
+        if e in self.waiting:
+            self.waiting.remove(e)
+            return True
+        if p := next((p for p in self.probes if e in p.batch), None):
+            await self._drop_probe(p)
+            return True
+        c = next(c for c in self.candidates if e in c.batch)
+        await self._discard_from(c)
+        return True
+
+    async def _drop_probe(self, p: Candidate) -> None:
+        self.probes.remove(p)
+        if p in self._unbuilt:
+            self._unbuilt.remove(p)
+        self.waiting[:0] = self._live(p.batch)
+        await self._retire(p)
+
+    async def _discard_from(self, c: Candidate) -> None:
+        """Drop `c` and every candidate after it; their pull requests go back to the front."""
+        i = self.candidates.index(c)
+        dropped = self.candidates[i:]
+        del self.candidates[i:]
+        self.waiting[:0] = [e for d in dropped for e in self._live(d.batch)]
+        for d in dropped:
+            CANDIDATES.inc('discarded')
+            await self._retire(d)
+
+    async def _retire(self, c: Candidate) -> None:
+        """Stop watching checks of `c` and delete its branch, unless that is done already."""
+        # one that is still being built is deleted by its builder
+        if c.sha is not None and self.checks.forget(self.repo, c.sha):
+            await self._delete_branch(c.branch)
+
+    async def _delete_branch(self, branch: str) -> None:
+        try:
+            await self.backend.delete_branch(self.repo, branch)
+        except Exception:
+            # left behind, but never reused: candidates get branches of their own
+            logger.exception(f'{self}: deleting {branch} failed')
+
+    async def _reject(self, number: int, message: str) -> None:
+        try:
+            await self.backend.reject(self.repo, number, message)
+        except Exception:
+            # out of the queue all the same
+            logger.exception(f'{self}: telling #{number} why it was rejected failed')
+
+    def _live(self, entries: list[Entry]) -> list[Entry]:
+        """Those of `entries` that are still queued."""
+        return [e for e in entries if self.entries.get(e.number) is e]
+
+    def _new_candidate(self, batch: list[Entry], parent: Candidate | None) -> Candidate:
+        self._seq += 1
+        return Candidate(f'{self.cfg.branch_prefix}{self.base}/{self._seq}', batch, parent)
+
+    def _plan(self) -> list[Candidate]:
+        """Probes to build, then new candidates from waiting pull requests, up to `depth`."""
+        new, self._unbuilt = self._unbuilt, []
+        while self.waiting and self._pending() < self.cfg.depth:
+            c = self._new_candidate(self._take_batch(), parent=self._tip())
+            self.candidates.append(c)
+            new.append(c)
+        return new
+
+    def _take_batch(self) -> list[Entry]:
+        batch = [self.waiting[0]]
+        for e in self.waiting[1 : self.sizer.batch_size]:
+            if e.solo or batch[0].solo:
+                break
+            batch.append(e)
+        del self.waiting[: len(batch)]
+        return batch
+
+    def _pending(self) -> int:
+        # probes take up CI as well
+        return sum(c.outcome == 'pending' for c in (*self.candidates, *self.probes))
+
+    def _tip(self) -> Candidate | None:
+        return next((c for c in reversed(self.candidates) if c.outcome != 'failed'), None)
+
+    async def _advance(self) -> None:
+        """Build candidates until there is nothing to build or no room for more."""
+        async with self._lock:
+            if self._building:
+                # whoever is building plans again once done, and picks this change up
+                return
+            if self.required is None:
+                self.required = frozenset(
+                    self.cfg.required_checks
+                ) or await self.backend.required_checks(self.repo, self.base)
+            if not self.required:
+                logger.error(f'{self}: no required checks to test candidates with; not merging')
+                return
+            self._building = True
+        try:
+            while True:
+                async with self._lock:
+                    new = self._plan()
+                    if not new:
+                        self._building = False
+                        return
+                for i, c in enumerate(new):
+                    if c not in self.candidates and c not in self.probes:
+                        # dropped along with one built before it
+                        continue
+                    built: Built = 'failed'
+                    try:
+                        built = await self._build(c)
+                    finally:
+                        if built == 'failed':
+                            # github is having trouble, or we are cancelled: retried on the
+                            # next event, not right away; unbuilt ones must not stay as parents
+                            async with self._lock:
+                                await self._unplan([d for d in new[i:] if d.sha is None])
+                    if built == 'failed':
+                        return
+        finally:
+            self._building = False
+
+    async def _unplan(self, planned: list[Candidate]) -> None:
+        """Give up on building `planned` for now; probes stay to be built, the rest waits."""
+        self._unbuilt[:0] = [c for c in planned if c in self.probes]
+        if first := next((c for c in planned if c in self.candidates), None):
+            await self._discard_from(first)
+
+    async def _build(self, c: Candidate) -> Built:
+        """Build a planned candidate; unless 'built', it did not make it into the queue."""
+        if c.parent is not None and c.parent.sha is None:
+            # built on the base branch instead, it would be merged without its parent
+            async with self._lock:
+                await self._drop(c)
+            return 'dropped'
+        onto = c.parent.sha if c.parent else None
+        try:
+            sha = await self.backend.build(self.repo, c.branch, self.base, onto, c.batch)
+        except MergeConflictError as e:
+            async with self._lock:
+                await self._drop(c)
+                if (entry := self.entries.pop(e.number, None)) in self.waiting:
+                    self.waiting.remove(entry)
+                    REJECTED.inc('conflict')
+                    await self._reject(
+                        e.number,
+                        f'Does not merge cleanly into `{self.base}` together with pull requests '
+                        'queued before it.',
+                    )
+            await self._delete_branch(c.branch)
+            return 'dropped'
+        except Exception:
+            # left to be retried on the next event
+            logger.exception(f'{self}: building {c.branch} failed')
+            async with self._lock:
+                await self._drop(c)
+            await self._delete_branch(c.branch)
+            return 'failed'
+        async with self._lock:
+            if c not in self.candidates and c not in self.probes:
+                await self._delete_branch(c.branch)
+                return 'dropped'
+            assert self.required
+            c.sha = sha
+            c.checks = self.checks.watch(self.repo, sha, self.required, partial(self._decided, c))
+        logger.info(f'{self}: testing {c.branch} at {sha}: {[e.number for e in c.batch]}')
+        return 'built'
+
+    async def _drop(self, c: Candidate) -> None:
+        if c in self.candidates:
+            await self._discard_from(c)
+        elif c in self.probes:
+            await self._drop_probe(c)
+
+
+class MergeQueue:
+    """Merge queues of all repositories and branches, fed with webhook events."""
+
+    cfg: CfgMergeQueue
+    backend: MergeBackend
+    # (repo, base branch) -> queue
+    queues: dict[tuple[str, str], BranchQueue]
+    # repo -> batch size, shared by its branches: flakiness is a trait of the repository
+    sizers: dict[str, BatchSizer]
+    # what is known about pull requests beyond the event at hand; fed by the webhook handler
+    index: PullIndex | None
+    # checks of candidates of all queues
+    checks: CheckAggregator
+
+    def __init__(
+        self, cfg: CfgMergeQueue, backend: MergeBackend, index: PullIndex | None = None
+    ) -> None:
+        self.cfg = cfg
+        self.backend = backend
+        self.queues = {}
+        self.sizers = {}
+        self.index = index
+        self.checks = CheckAggregator()
+
+    async def handle(self, event: GithubEvent) -> None:
+        match event:
+            case PullRequestEvent(repo=str(repo)):
+                await self.on_pull_request(repo, event)
+            case PullRequestReviewEvent(repo=str(repo)):
+                await self.on_review(repo, event.number)
+            case CheckRunEvent(repo=str(repo)):
+                await self.checks.report(repo, event.head_sha, event.name, check_run_state(event))
+            case StatusEvent(repo=str(repo)):
+                await self.checks.report(repo, event.sha, event.context, status_state(event))
+            case PushEvent(repo=str(repo)) if event.ref.startswith('refs/heads/'):
+                q = self.queues.get((repo, event.ref.removeprefix('refs/heads/')))
+                if q is not None:
+                    await q.on_base_push(event.after)
+            case _:
+                pass
+
+    async def on_pull_request(self, repo: str, event: PullRequestEvent) -> None:
+        key = (repo, event.base_ref)
+        q = self.queues.get(key)
+        queued = q is not None and event.number in q.entries
+        # by head rather than by action: a push may be told by a later event, e.g. `labeled`
+        if q is not None and queued and q.entries[event.number].head_sha != event.head_sha:
+            await q.dequeue(
+                event.number,
+                'updated',
+                'New commits were pushed while it was queued; label it again to requeue.',
+            )
+        elif self._wants_merge(repo, event):
+            await self._queue(repo, event.base_ref).enqueue(event.number, event.head_sha)
+        elif q is not None and queued:
+            await q.dequeue(event.number)
+
+    async def on_review(self, repo: str, number: int) -> None:
+        pull = self.index.snapshot(repo, number) if self.index else None
+        if pull is None:
+            return
+        q = self.queues.get((repo, pull.pull.base_ref))
+        queued = q is not None and number in q.entries
+        wants_merge = pull.queueable(self.cfg.label)
+        if q is not None and queued and not wants_merge:
+            await q.dequeue(
+                number,
+                'changes_requested',
+                'Changes were requested while it was queued; label it again to requeue.',
+            )
+        elif not queued and wants_merge:
+            await self._queue(repo, pull.pull.base_ref).enqueue(number, pull.pull.head_sha)
+
+    def _queue(self, repo: str, base: str) -> BranchQueue:
+        q = self.queues.get((repo, base))
+        if q is None:
+            if (sizer := self.sizers.get(repo)) is None:
+                sizer = self.sizers[repo] = BatchSizer(self.cfg)
+            q = self.queues[repo, base] = BranchQueue(
+                repo, base, self.cfg, self.backend, sizer=sizer, checks=self.checks
+            )
+        return q
+
+    def _wants_merge(self, repo: str, event: PullRequestEvent) -> bool:
+        if event.state != 'open' or event.merged:
+            return False
+        # index knows about reviews too, which the event does not tell
+        if self.index is not None and (pull := self.index.snapshot(repo, event.number)):
+            return pull.queueable(self.cfg.label)
+        return self.cfg.label in event.labels and not event.draft
@@ -0,0 +1,107 @@
+import logging
+from collections.abc import Sequence
+from urllib.parse import quote
+
+import httpx
+
+from qram.mq.engine import Entry, MergeConflictError
+from qram.web import codec
+from qram.web.github.api import AsyncGithubApi
+
+logger = logging.getLogger(__name__)
+
+# Candidates are plain branches built with the merges API, so that CI runs on them like on any
+# other push; CI has to be set up to run on pushes to branches under the configured prefix.
+# https://docs.github.com/en/rest/branches/branches#merge-a-branch
+# https://docs.github.com/en/rest/git/refs
+
+
+class GithubMergeBackend:
+    """MergeBackend on top of github REST API."""
+
+    api: AsyncGithubApi
+    label: str
+
+    def __init__(self, api: AsyncGithubApi, label: str) -> None:
+        self.api = api
+        self.label = label
+
+    async def required_checks(self, repo: str, base: str) -> frozenset[str]:
+        r = await self.api.http_get(
+            f'repos/{repo}/branches/{quote(base, safe="")}/protection/required_status_checks'
+        )
+        if r.status_code == httpx.codes.NOT_FOUND:
+            return frozenset()
+        _ = r.raise_for_status()
+        j = codec.loads(r.content)
+        # `checks` supersedes `contexts`, but older setups may only have the latter
+        return frozenset(c['context'] for c in j.get('checks') or ()) or frozenset(
+            j.get('contexts') or ()
+        )
+
+    async def build(
+        self, repo: str, branch: str, base: str, onto: str | None, entries: Sequence[Entry]
+    ) -> str:
+        sha = onto or await self.head(repo, base)
+        await self.point(repo, branch, sha)
+        for e in entries:
+            r = await self.api.http_post(
+                f'repos/{repo}/merges',
+                json=dict(
+                    base=branch,
+                    head=e.head_sha,
+                    commit_message=f'Merge #{e.number} into {base} (merge queue)',
+                ),
+            )
+            if r.status_code == httpx.codes.CONFLICT:
+                raise MergeConflictError(e.number)
+            _ = r.raise_for_status()
+            if r.status_code == httpx.codes.CREATED:
+                sha = codec.loads(r.content)['sha']
+            # 204: already in the branch, nothing to merge
+        return sha
+
+    async def fast_forward(self, repo: str, base: str, sha: str) -> bool:
+        r = await self.api.http_patch(
+            f'repos/{repo}/git/refs/heads/{base}', json=dict(sha=sha, force=False)
+        )
+        if r.status_code == httpx.codes.UNPROCESSABLE_ENTITY:
+            return False
+        _ = r.raise_for_status()
+        return True
+
+    async def delete_branch(self, repo: str, branch: str) -> None:
+        r = await self.api.http_delete(f'repos/{repo}/git/refs/heads/{branch}')
+        # 422: already gone
+        if r.status_code != httpx.codes.UNPROCESSABLE_ENTITY:
+            _ = r.raise_for_status()
+
+    async def reject(self, repo: str, number: int, reason: str) -> None:
+        r = await self.api.http_post(
+            f'repos/{repo}/issues/{number}/comments',
+            json=dict(body=f'Removed from merge queue. {reason}'),
+        )
+        _ = r.raise_for_status()
+        r = await self.api.http_delete(
+            f'repos/{repo}/issues/{number}/labels/{quote(self.label, safe="")}'
+        )
+        # 404: somebody removed it already
+        if r.status_code != httpx.codes.NOT_FOUND:
+            _ = r.raise_for_status()
+
+    async def head(self, repo: str, branch: str) -> str:
+        r = await self.api.http_get(f'repos/{repo}/git/ref/heads/{branch}')
+        _ = r.raise_for_status()
+        sha: str = codec.loads(r.content)['object']['sha']
+        return sha
+
+    async def point(self, repo: str, branch: str, sha: str) -> None:
+        """Create `branch` at `sha`, or move it there if it exists."""
+        r = await self.api.http_post(
+            f'repos/{repo}/git/refs', json=dict(ref=f'refs/heads/{branch}', sha=sha)
+        )
+        if r.status_code == httpx.codes.UNPROCESSABLE_ENTITY:
+            r = await self.api.http_patch(
+                f'repos/{repo}/git/refs/heads/{branch}', json=dict(sha=sha, force=True)
+            )
+        _ = r.raise_for_status()
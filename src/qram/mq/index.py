@@ -0,0 +1,230 @@
+import time
+from collections.abc import Mapping
+from dataclasses import dataclass, replace
+
+from qram.mq.checks import PASSING_CONCLUSIONS, CheckState, check_run_state, status_state
+from qram.web.github.events import (
+    CheckRunEvent,
+    CheckSuiteEvent,
+    GithubEvent,
+    PullRequestEvent,
+    PullRequestReviewEvent,
+    StatusEvent,
+)
+
+# What is known about open pull requests, kept up to date from webhooks alone, so that deciding
+# whether one is ready takes a dict lookup instead of a round of github API calls for reviews,
+# checks and labels. It starts empty and learns about a pull request from its next event; until
+# then, lookups return None and callers fall back to the event at hand, or to github.
+#
+# Only the webhook path writes, one event at a time. Published records are immutable and
+# replaced rather than changed, and `version` is odd while an event is being applied, so
+# readers, even in other threads, get a consistent snapshot without taking any lock.
+
+# checks of shas no open pull request points at, e.g. those that arrive before the
+# pull_request event of a push, or of pushes to branches without pull requests
+ORPHAN_SHAS_KEPT = 1024
+
+type Key = tuple[str, int]
+type ShaKey = tuple[str, str]
+
+
+@dataclass(frozen=True, slots=True)
+class PullState:
+    number: int
+    head_sha: str
+    base_ref: str
+    draft: bool
+    labels: frozenset[str]
+    # None until github has computed it
+    mergeable: bool | None
+    # author -> latest review that approved or requested changes; never changed once published
+    reviews: Mapping[str, str]
+    approvals: int = 0
+    changes_requested: int = 0
+
+
+@dataclass(frozen=True, slots=True)
+class CheckCounts:
+    """Checks reported for a sha, by latest state of each."""
+
+    pending: int = 0
+    success: int = 0
+    failure: int = 0
+
+    @property
+    def green(self) -> bool:
+        return self.success > 0 and not self.pending and not self.failure
+
+    def moved(self, old: CheckState | None, new: CheckState) -> CheckCounts:
+        counts = {'pending': self.pending, 'success': self.success, 'failure': self.failure}
+        if old is not None:
+            counts[old] -= 1
+        counts[new] += 1
+        return CheckCounts(**counts)
+
+
+NO_CHECKS = CheckCounts()
+
+
+@dataclass(frozen=True, slots=True)
+class PullSnapshot:
+    # index version it was taken at; equal versions mean nothing changed in between
+    version: int
+    pull: PullState
+    checks: CheckCounts
+
+    def queueable(self, label: str) -> bool:
+        """Whether it is labeled for merging and nothing on github itself holds it back."""
+        return (
+            label in self.pull.labels
+            and not self.pull.draft
+            and self.pull.mergeable is not False
+            and not self.pull.changes_requested
+        )
+
+
+class PullIndex:
+    """Open pull requests by (repo, number) and by head sha, updated from webhook events."""
+
+    pulls: dict[Key, PullState]
+    by_sha: dict[ShaKey, int]
+    checks: dict[ShaKey, CheckCounts]
+    # bumped twice per applied event: odd while applying, even once done
+    version: int
+    # name -> latest state of each check of a sha, behind `checks`; seen by the writer only
+    _states: dict[ShaKey, dict[str, CheckState]]
+    # shas with checks but no pull request, oldest first
+    _orphans: dict[ShaKey, None]
+
+    def __init__(self) -> None:
+        self.pulls = {}
+        self.by_sha = {}
+        self.checks = {}
+        self.version = 0
+        self._states = {}
+        self._orphans = {}
+
+    def apply(self, event: GithubEvent) -> None:
+        self.version += 1
+        try:
+            match event:
+                case PullRequestEvent(repo=str(repo)):
+                    self._on_pull_request(repo, event)
+                case PullRequestReviewEvent(repo=str(repo)):
+                    self._on_review(repo, event)
+                case CheckRunEvent(repo=str(repo)):
+                    self._on_check(repo, event.head_sha, event.name, check_run_state(event))
+                case StatusEvent(repo=str(repo)):
+                    self._on_check(repo, event.sha, event.context, status_state(event))
+                case CheckSuiteEvent(repo=str(repo), status='completed', app=str(app)):
+                    # suites that are not completed are not counted as pending: github creates
+                    # one for every installed checks app, including those that never run any
+                    state: CheckState = (
+                        'success' if event.conclusion in PASSING_CONCLUSIONS else 'failure'
+                    )
+                    self._on_check(repo, event.head_sha, f'{app} (suite)', state)
+                case _:
+                    pass
+        finally:
+            self.version += 1
+
+    def get(self, repo: str, number: int) -> PullState | None:
+        return self.pulls.get((repo, number))
+
+    def at_sha(self, repo: str, sha: str) -> PullState | None:
+        number = self.by_sha.get((repo, sha))
+        return None if number is None else self.pulls.get((repo, number))
+
+    def snapshot(self, repo: str, number: int) -> PullSnapshot | None:
+        """Pull request and checks of its head, as of a single version of the index."""
+        while True:
+            version = self.version
+            if version & 1:
+                # being written to from another thread; let it finish
+                time.sleep(0)
+                continue
+            pull = self.pulls.get((repo, number))
+            checks = self.checks.get((repo, pull.head_sha), NO_CHECKS) if pull else NO_CHECKS
+            if self.version == version:
+                return None if pull is None else PullSnapshot(version, pull, checks)
+
+    def _on_pull_request(self, repo: str, event: PullRequestEvent) -> None:
+        key = (repo, event.number)
+        old = self.pulls.get(key)
+        if event.state != 'open' or event.merged:
+            if old is not None:
+                del self.pulls[key]
+                self._drop_head(repo, old)
+            return
+        reviews: Mapping[str, str] = {}
+        if old is not None:
+            reviews = old.reviews
+            if old.head_sha != event.head_sha:
+                self._drop_head(repo, old)
+        pull = PullState(
+            number=event.number,
+            head_sha=event.head_sha,
+            base_ref=event.base_ref,
+            draft=event.draft,
+            labels=frozenset(event.labels),
+            mergeable=event.mergeable,
+            reviews=reviews,
+        )
+        self.pulls[key] = _counted(pull)
+        self.by_sha[repo, event.head_sha] = event.number
+        _ = self._orphans.pop((repo, event.head_sha), None)
+
+    def _on_review(self, repo: str, event: PullRequestReviewEvent) -> None:
+        pull = self.pulls.get((repo, event.number))
+        if pull is None:
+            return
+        reviews = dict(pull.reviews)
+        if event.action == 'dismissed' or event.state == 'dismissed':
+            _ = reviews.pop(event.author, None)
+        elif event.state in {'approved', 'changes_requested'}:
+            reviews[event.author] = event.state
+        else:
+            # comments leave earlier verdict of the same reviewer standing
+            return
+        self.pulls[repo, event.number] = _counted(replace(pull, reviews=reviews))
+
+    def _on_check(self, repo: str, sha: str, name: str, state: CheckState) -> None:
+        key = (repo, sha)
+        states = self._states.get(key)
+        if states is None:
+            states = self._states[key] = {}
+            if key not in self.by_sha:
+                self._orphan(key)
+        old = states.get(name)
+        if old == state:
+            return
+        states[name] = state
+        self.checks[key] = self.checks.get(key, NO_CHECKS).moved(old, state)
+
+    def _orphan(self, key: ShaKey) -> None:
+        self._orphans[key] = None
+        if len(self._orphans) > ORPHAN_SHAS_KEPT:
+            oldest = next(iter(self._orphans))
+            del self._orphans[oldest]
+            self._forget_checks(oldest)
+
+    def _drop_head(self, repo: str, pull: PullState) -> None:
+        key = (repo, pull.head_sha)
+        # another pull request may have been opened from the same commit
+        if self.by_sha.get(key) == pull.number:
+            del self.by_sha[key]
+            self._forget_checks(key)
+
+    def _forget_checks(self, key: ShaKey) -> None:
+        _ = self._states.pop(key, None)
+        _ = self.checks.pop(key, None)
+
+
+def _counted(pull: PullState) -> PullState:
+    verdicts = list(pull.reviews.values())
+    return replace(
+        pull,
+        approvals=verdicts.count('approved'),
+        changes_requested=verdicts.count('changes_requested'),
+    )
@@ -0,0 +1,43 @@
+from collections import deque
+
+from qram.config import CfgMergeQueue
+
+
+class BatchSizer:
+    """Merge queue batch size of one repository, adjusted to how often its candidates fail.
+
+    Bigger batches merge more pull requests per CI run while they pass, but each failed one
+    costs a bisection, two concurrent CI runs per halving. So the size is additive-increase,
+    multiplicative-decrease: it grows by one with every candidate that passes while the failure
+    rate over the last `window` candidates is within target, and is halved whenever a failure
+    takes the rate above it. A flaky repository thus settles on small batches, and a healthy
+    one on big ones.
+    """
+
+    size: float
+    max_size: int
+    target_failure_rate: float
+    # True for each candidate that failed, oldest first
+    outcomes: deque[bool]
+
+    def __init__(self, cfg: CfgMergeQueue) -> None:
+        self.size = cfg.batch_size
+        self.max_size = cfg.max_batch_size
+        self.target_failure_rate = cfg.target_failure_rate
+        self.outcomes = deque(maxlen=cfg.failure_window)
+
+    @property
+    def batch_size(self) -> int:
+        return max(1, int(self.size))
+
+    @property
+    def failure_rate(self) -> float:
+        return sum(self.outcomes) / len(self.outcomes) if self.outcomes else 0.0
+
+    def record(self, *, failed: bool) -> None:
+        self.outcomes.append(failed)
+        healthy = self.failure_rate <= self.target_failure_rate
+        if failed and not healthy:
+            self.size = max(1.0, self.size / 2)
+        elif not failed and healthy:
+            self.size = min(self.max_size, self.size + 1)
@@ -3,6 +3,8 @@ from abc import ABC, abstractmethod
 from fastapi import Request
 from fastapi.responses import JSONResponse
 
+from qram.web.spool import SpoolEntry
+
 
 def get_cors_headers(cors_origin: str, additional_headers: list[str]) -> dict[str, str]:
     """Generate CORS headers from config.
@@ -27,8 +29,15 @@ def get_cors_headers(cors_origin: str, additional_headers: list[str]) -> dict[st
 
 
 class WebhookHandlerBase(ABC):
+    # shared between responses; callers must not modify it
     @abstractmethod
     def get_cors_headers(self) -> dict[str, str]: ...
 
     @abstractmethod
     async def handle(self, request: Request) -> JSONResponse: ...
+
+    @abstractmethod
+    async def replay(self, entries: list[SpoolEntry]) -> None: ...
+
+    async def flush(self) -> None:  # noqa: B027
+        """Hand whatever is held back over to the work queue; called on shutdown."""
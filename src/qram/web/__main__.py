@@ -1,36 +1,41 @@
-import logging
 from argparse import ArgumentParser
 from dataclasses import dataclass
 
 from dotenv import load_dotenv
 
 from qram.config import AppConfig
-from qram.web.app import create_app, run_app
+from qram.web.serve import configure_logging, serve
 
 
 @dataclass
 class Args:
     debug: bool
+    # override QRAM_SERVER_* settings if given
+    workers: int | None
+    loop: str | None
+    http: str | None
 
 
 def parse_args() -> Args:
     p = ArgumentParser()
     _ = p.add_argument('--debug', action='store_true')
+    _ = p.add_argument('--workers', type=int, help='number of worker processes')
+    _ = p.add_argument('--loop', choices=('auto', 'asyncio', 'uvloop'), help='event loop')
+    _ = p.add_argument('--http', choices=('auto', 'h11', 'httptools'), help='HTTP parser')
     return Args(**p.parse_args().__dict__)
 
 
 def main(args: Args) -> int:
-    # Initialize logging: time :: severity :: module :: msg
-    logging.basicConfig(
-        level=logging.DEBUG if args.debug else logging.INFO,
-        format='%(asctime)s :: %(levelname)s :: %(name)s :: %(message)s',
-        datefmt='%Y-%m-%d %H:%M:%S',
-        force=True,
-    )
+    configure_logging(debug=args.debug)
     _ = load_dotenv()
     cfg = AppConfig.config_from_env()
+    overrides = dict(workers=args.workers, loop=args.loop, http=args.http)
+    server = cfg.server.model_validate(
+        {**cfg.server.model_dump(), **{k: v for k, v in overrides.items() if v is not None}}
+    )
+    cfg = cfg.model_copy(update=dict(server=server))
 
-    run_app(create_app(cfg), cfg, debug=args.debug)
+    serve(cfg, debug=args.debug)
     return 0
 
 
@@ -1,53 +1,353 @@
+import asyncio
+import logging
+import sqlite3
+import tempfile
+import time
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+from pathlib import Path
+
 import uvicorn
 from fastapi import APIRouter, FastAPI, Request, Response
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse
 
 from qram.config import AppConfig
+from qram.metrics import REGISTRY, Collector, merge
+from qram.mq import GithubMergeBackend, MergeQueue, PullIndex
 from qram.web import WebhookHandlerBase
-from qram.web.github import GithubWebhookHandler
+from qram.web.codec import FastJSONResponse
+from qram.web.dedup import DeliveryDedup
+from qram.web.github import AsyncGithubApi, GithubWebhookHandler
+from qram.web.github.api import create_async_client
+from qram.web.github.cache import ResponseCache
+from qram.web.queue import WorkQueue
+from qram.web.shared import SharedState
+from qram.web.spool import WebhookSpool
+
+logger = logging.getLogger(__name__)
+
+# seconds between a worker's attempts to become the leader, and leader's scans of the spool
+# for deliveries of workers that are gone
+LEAD_POLL = 5
+# seconds between leader's prunings of expired delivery claims
+PRUNE_INTERVAL = 60
+# seconds between a worker's publishings of its metrics for other workers to show
+METRICS_PUBLISH_INTERVAL = 5
 
 router = APIRouter()
 
 
 @router.get('/ping')
 async def ping() -> JSONResponse:
-    return JSONResponse(status_code=200, content=dict(ping='pong'))
+    return FastJSONResponse(status_code=200, content=dict(ping='pong'))
+
+
+@router.get('/metrics')
+async def metrics(request: Request) -> PlainTextResponse:
+    shared: SharedState | None = request.app.state.shared
+    if shared is None:
+        text = REGISTRY.render()
+    else:
+        # scrapes reach a random worker, which speaks for all of them
+        await shared.publish_metrics(worker_metrics(shared))
+        text = merge(await shared.all_metrics())
+    return PlainTextResponse(text, media_type='text/plain; version=0.0.4')
 
 
 # respond to preflight CORS or other checks
 @router.options('/webhook')
 async def webhook_options(request: Request) -> Response:
-    cfg = request.app.state.config
-    handler = get_webhook_handler(cfg)
-    headers = handler.get_cors_headers()
-    return Response(status_code=200, headers=headers)
+    # nothing in it depends on the request, so it is rendered once in lifespan
+    response: Response = request.app.state.options_response
+    return response
 
 
 @router.post('/webhook')
 async def webhook(request: Request) -> JSONResponse:
-    handler = get_webhook_handler(request.app.state.config)
+    handler: WebhookHandlerBase = request.app.state.webhook_handler
     return await handler.handle(request)
 
 
-# TODO: should be stored in app.state?
-def get_webhook_handler(cfg: AppConfig) -> WebhookHandlerBase:
+def get_webhook_handler(  # noqa: PLR0913
+    cfg: AppConfig,
+    queue: WorkQueue,
+    spool: WebhookSpool | None,
+    dedup: DeliveryDedup | None,
+    cache: ResponseCache | None = None,
+    *,
+    merge_queue: MergeQueue | None = None,
+    index: PullIndex | None = None,
+) -> WebhookHandlerBase:
     if cfg.github:
-        return GithubWebhookHandler(cfg)
+        return GithubWebhookHandler(
+            cfg, queue, spool, dedup, cache, merge_queue=merge_queue, index=index
+        )
     msg = 'no known provider in config'
     raise NotImplementedError(msg)
 
 
+def app_collectors(
+    queue: WorkQueue,
+    github_api: AsyncGithubApi | None,
+    merge_queue: MergeQueue | None = None,
+    *,
+    dedup: DeliveryDedup | None = None,
+    cache: ResponseCache | None = None,
+) -> list[Collector]:
+    """Metrics read off objects of a running app; collected only when /metrics is scraped."""
+    collectors = [
+        Collector(
+            'qram_queue_depth',
+            'Jobs waiting in the work queue.',
+            'gauge',
+            (),
+            lambda: [((), queue.depth)],
+        ),
+    ]
+    if dedup is not None:
+        seen = dedup
+        collectors += [
+            Collector(
+                'qram_dedup_hits_total',
+                'Webhook deliveries skipped as seen before.',
+                'counter',
+                (),
+                lambda: [((), seen.hits)],
+            ),
+            Collector(
+                'qram_dedup_misses_total',
+                'Webhook deliveries seen for the first time.',
+                'counter',
+                (),
+                lambda: [((), seen.misses)],
+            ),
+        ]
+    if cache is not None:
+        responses = cache
+        collectors += [
+            Collector(
+                'qram_github_cache_hit_ratio',
+                'Share of cacheable github requests answered with 304 Not Modified.',
+                'gauge',
+                (),
+                lambda: [((), responses.stats()['hit_ratio'])],
+            ),
+            Collector(
+                'qram_github_cache_bytes_saved_total',
+                'Bytes of github responses served from cache instead of downloaded again.',
+                'counter',
+                (),
+                lambda: [((), responses.stats()['bytes_saved'])],
+            ),
+            Collector(
+                'qram_github_cache_bytes',
+                'Bytes of github responses held in cache.',
+                'gauge',
+                (),
+                lambda: [((), responses.stats()['bytes'])],
+            ),
+        ]
+    if github_api:
+        api = github_api
+        collectors += [
+            Collector(
+                'qram_github_token_refreshes_total',
+                'Installation access tokens acquired.',
+                'counter',
+                (),
+                lambda: [((), api.token_refreshes)],
+            ),
+            Collector(
+                'qram_github_ratelimit_remaining',
+                'Requests left in github rate limit budget, as of the last response.',
+                'gauge',
+                ('resource',),
+                lambda: [
+                    ((name,), b.remaining)
+                    for name, b in api.ratelimit.buckets.items()
+                    if b.remaining is not None
+                ],
+            ),
+            Collector(
+                'qram_github_ratelimit_limit',
+                'Size of github rate limit budget.',
+                'gauge',
+                ('resource',),
+                lambda: [
+                    ((name,), b.limit)
+                    for name, b in api.ratelimit.buckets.items()
+                    if b.limit is not None
+                ],
+            ),
+        ]
+    if merge_queue:
+        sizers = merge_queue.sizers
+        collectors += [
+            Collector(
+                'qram_merge_queue_batch_size',
+                'Pull requests merge queue tests together, adjusted to failure rate.',
+                'gauge',
+                ('repo',),
+                lambda: [((repo,), s.batch_size) for repo, s in sizers.items()],
+            ),
+            Collector(
+                'qram_merge_queue_failure_rate',
+                'Share of recent merge queue candidates that failed.',
+                'gauge',
+                ('repo',),
+                lambda: [((repo,), s.failure_rate) for repo, s in sizers.items()],
+            ),
+        ]
+    return collectors
+
+
+def shared_state_path(cfg: AppConfig) -> Path:
+    if cfg.server.state_path:
+        return Path(cfg.server.state_path)
+    return Path(tempfile.gettempdir()) / f'qram-{cfg.port}.sqlite'
+
+
+async def lead(
+    shared: SharedState,
+    github_api: AsyncGithubApi | None,
+    spool: WebhookSpool | None,
+    handler: WebhookHandlerBase,
+) -> None:
+    """Wait to become the leader among worker processes, then do what only one of them should."""
+    while not shared.try_lead():  # noqa: ASYNC110
+        await asyncio.sleep(LEAD_POLL)
+    logger.info(f'worker {shared.worker_id} is the leader')
+    if github_api:
+        github_api.start()
+    pruned = time.monotonic()
+    while True:
+        if spool and (orphans := await spool.adopt_orphans(shared.is_alive)):
+            await handler.replay(orphans)
+        if time.monotonic() - pruned >= PRUNE_INTERVAL:
+            await shared.prune()
+            pruned = time.monotonic()
+        await asyncio.sleep(LEAD_POLL)
+
+
+def worker_metrics(shared: SharedState) -> str:
+    return REGISTRY.render({'worker': shared.worker_id})
+
+
+async def publish_metrics(shared: SharedState) -> None:
+    """Keep metrics of this worker in shared state, for any worker that is scraped to show."""
+    while True:
+        try:
+            await shared.publish_metrics(worker_metrics(shared))
+        except sqlite3.Error as e:
+            logger.warning(f'could not publish metrics: {e}')
+        await asyncio.sleep(METRICS_PUBLISH_INTERVAL)
+
+
+def start_background(
+    shared: SharedState | None,
+    github_api: AsyncGithubApi | None,
+    spool: WebhookSpool | None,
+    handler: WebhookHandlerBase,
+) -> list[asyncio.Task[None]]:
+    """Start what runs alongside serving: token renewal and replay of spooled deliveries."""
+    if shared:
+        return [
+            asyncio.create_task(lead(shared, github_api, spool, handler)),
+            asyncio.create_task(publish_metrics(shared)),
+        ]
+    if github_api:
+        github_api.start()
+    if spool and (pending := spool.pending()):
+        # in background, so that new deliveries are accepted meanwhile
+        return [asyncio.create_task(handler.replay(pending))]
+    return []
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    cfg: AppConfig = app.state.config
+    # with several worker processes, whatever must not be done once per worker goes through
+    # shared state; a single process keeps it all in memory, as there is nobody to share with
+    shared = None
+    if cfg.server.workers > 1:
+        shared = SharedState(shared_state_path(cfg), ttl=cfg.dedup.ttl)
+        shared.open()
+    app.state.shared = shared
+    # one pooled client for the whole app lifetime: keep-alive connections to github are reused
+    # between webhooks instead of doing a TCP+TLS handshake per call
+    async with create_async_client(cfg.http, cfg.github.api_url if cfg.github else None) as client:
+        cache = ResponseCache(cfg.http.cache_max_bytes) if cfg.http.cache_max_bytes else None
+        github_api = AsyncGithubApi(cfg, client, cache, shared) if cfg.github else None
+        app.state.github_api = github_api
+        queue = WorkQueue(workers=cfg.queue.workers, max_size=cfg.queue.max_size)
+        app.state.work_queue = queue
+        dedup = DeliveryDedup(max_size=cfg.dedup.max_size, ttl=cfg.dedup.ttl, shared=shared)
+        app.state.dedup = dedup
+        spool = None
+        if cfg.spool.path:
+            spool = WebhookSpool(
+                Path(cfg.spool.path),
+                compact_every=cfg.spool.compact_every,
+                seen_ttl=cfg.dedup.ttl,
+                owner=shared.worker_id if shared else None,
+            )
+            spool.open()
+            _ = spool.compact()
+            dedup.load(spool.seen_since(time.time() - cfg.dedup.ttl))
+        app.state.spool = spool
+        merge_queue = index = None
+        if cfg.merge_queue.enabled and github_api:
+            index = PullIndex()
+            backend = GithubMergeBackend(github_api, cfg.merge_queue.label)
+            merge_queue = MergeQueue(cfg.merge_queue, backend, index)
+        app.state.merge_queue = merge_queue
+        app.state.pull_index = index
+        handler = get_webhook_handler(
+            cfg, queue, spool, dedup, cache, merge_queue=merge_queue, index=index
+        )
+        app.state.webhook_handler = handler
+        app.state.options_response = Response(status_code=200, headers=handler.get_cors_headers())
+        collectors = app_collectors(queue, github_api, merge_queue, dedup=dedup, cache=cache)
+        for c in collectors:
+            REGISTRY.register(c)
+        queue.start()
+        background = start_background(shared, github_api, spool, handler)
+        try:
+            yield
+        finally:
+            for c in collectors:
+                REGISTRY.unregister(c.name)
+            for task in background:
+                _ = task.cancel()
+            _ = await asyncio.gather(*background, return_exceptions=True)
+            # uvicorn runs this on shutdown, after it stops accepting new connections
+            await handler.flush()
+            await queue.stop(cfg.queue.drain_timeout)
+            if spool:
+                await spool.close()
+            if github_api:
+                await github_api.aclose()
+            if shared:
+                shared.close()
+
+
 def create_app(cfg: AppConfig) -> FastAPI:
-    app = FastAPI()
+    app = FastAPI(lifespan=lifespan, default_response_class=FastJSONResponse)
     app.state.config = cfg
     app.include_router(router)
     return app
 
 
-def run_app(app: FastAPI, config: AppConfig, *, debug: bool = False) -> None:
-    uvicorn.run(
+def uvicorn_config(app: FastAPI, config: AppConfig, *, debug: bool = False) -> uvicorn.Config:
+    return uvicorn.Config(
         app,
         host=config.bind_to,
         port=config.port,
+        loop=config.server.loop,
+        http=config.server.http,
         log_level='debug' if debug else None,
     )
+
+
+def run_app(app: FastAPI, config: AppConfig, *, debug: bool = False) -> None:
+    uvicorn.Server(uvicorn_config(app, config, debug=debug)).run()
@@ -0,0 +1,98 @@
+import asyncio
+import logging
+from collections.abc import Awaitable, Callable, Hashable
+from dataclasses import dataclass, field
+
+from qram.metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+COALESCED_IN = REGISTRY.counter(
+    'qram_coalesce_events_total', 'Events held back to be processed together with later ones.'
+)
+COALESCED_OUT = REGISTRY.counter(
+    'qram_coalesce_evaluations_total', 'Batches of held back events released for processing.'
+)
+
+
+@dataclass(slots=True)
+class _Held[T]:
+    # loop time the first of `items` came in
+    since: float
+    # sub-key -> latest item with it, in order of arrival
+    items: dict[Hashable, T] = field(default_factory=dict)
+    timer: asyncio.TimerHandle | None = None
+
+
+class Coalescer[T]:
+    """Holds items back until their key has been quiet for `window` seconds, then releases them.
+
+    Items with the same key and sub-key supersede each other: only the latest one is released,
+    and `superseded` is told about the rest. So a burst of events about one pull request or
+    commit is processed once, in its final state. No item is held for more than `max_delay`,
+    however long the burst goes on. Order of items with different keys is not kept.
+    """
+
+    window: float
+    max_delay: float
+    # called with items of a key once they are due
+    release: Callable[[list[T]], Awaitable[None]]
+    superseded: Callable[[T], None] | None
+    _held: dict[Hashable, _Held[T]]
+    # releases in progress
+    _tasks: set[asyncio.Task[None]]
+
+    def __init__(
+        self,
+        window: float,
+        max_delay: float,
+        release: Callable[[list[T]], Awaitable[None]],
+        superseded: Callable[[T], None] | None = None,
+    ) -> None:
+        self.window = window
+        self.max_delay = max_delay
+        self.release = release
+        self.superseded = superseded
+        self._held = {}
+        self._tasks = set()
+
+    def __len__(self) -> int:
+        return sum(len(h.items) for h in self._held.values())
+
+    def add(self, key: Hashable, sub_key: Hashable, item: T) -> None:
+        COALESCED_IN.inc()
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        held = self._held.get(key)
+        if held is None:
+            held = self._held[key] = _Held(now)
+        old = held.items.pop(sub_key, None)
+        if old is not None and self.superseded:
+            self.superseded(old)
+        held.items[sub_key] = item
+        if held.timer:
+            held.timer.cancel()
+        due = min(now + self.window, held.since + self.max_delay)
+        held.timer = loop.call_at(due, self._release, key)
+
+    async def flush(self) -> None:
+        """Release everything held right away, and wait for all releases to finish."""
+        for key in list(self._held):
+            self._release(key)
+        if self._tasks:
+            _ = await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def _release(self, key: Hashable) -> None:
+        held = self._held.pop(key)
+        if held.timer:
+            held.timer.cancel()
+        COALESCED_OUT.inc()
+        task = asyncio.create_task(self._run(list(held.items.values())))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, items: list[T]) -> None:
+        try:
+            await self.release(items)
+        except Exception:
+            logger.exception(f'releasing {len(items)} coalesced items failed')
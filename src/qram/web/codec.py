@@ -0,0 +1,63 @@
+import importlib
+import json
+from collections.abc import Callable, Sequence
+from dataclasses import dataclass
+from typing import Any, override
+
+from fastapi.responses import JSONResponse
+
+
+@dataclass(frozen=True)
+class JsonCodec:
+    name: str
+    # both raise some subclass of Exception on invalid input; which one depends on library
+    loads: Callable[[bytes], Any]
+    dumps: Callable[[Any], bytes]
+
+
+def get_codec(preference: Sequence[str] = ('orjson', 'msgspec', 'json')) -> JsonCodec:
+    """Return first available JSON library out of `preference`; stdlib `json` is always there.
+
+    orjson and msgspec are optional: several times faster than stdlib on large payloads, but
+    not required.
+    """
+    for name in preference:
+        if codec := _load_codec(name):
+            return codec
+    return _stdlib_codec()
+
+
+def _load_codec(name: str) -> JsonCodec | None:
+    if name == 'json':
+        return _stdlib_codec()
+    if name not in ('orjson', 'msgspec'):
+        msg = f'unknown JSON library: {name}'
+        raise ValueError(msg)
+    try:
+        lib = importlib.import_module(name)
+    except ImportError:
+        return None
+    if name == 'orjson':
+        return JsonCodec(name, loads=lib.loads, dumps=lib.dumps)
+    return JsonCodec(name, loads=lib.json.decode, dumps=lib.json.encode)
+
+
+def _stdlib_codec() -> JsonCodec:
+    def dumps(obj: Any) -> bytes:  # noqa: ANN401
+        # same compact form as starlette's JSONResponse
+        return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+    return JsonCodec('json', loads=json.loads, dumps=dumps)
+
+
+CODEC = get_codec()
+loads = CODEC.loads
+dumps = CODEC.dumps
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse rendered through the same JSON library used for decoding."""
+
+    @override
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
@@ -0,0 +1,73 @@
+import time
+from collections import OrderedDict
+from collections.abc import Iterable
+
+from qram.web.shared import SharedState
+
+
+class DeliveryDedup:
+    """Bounded set of recently seen webhook delivery ids, each remembered for `ttl` seconds.
+
+    Kept in LRU order by time of first sighting, so both size and age eviction only ever touch
+    the oldest end.
+
+    With several worker processes, deliveries not seen locally are also claimed in `shared`
+    state, since a redelivery may well arrive at another worker than the original did.
+    """
+
+    max_size: int
+    ttl: float
+    hits: int
+    misses: int
+    shared: SharedState | None
+    # delivery id -> wall-clock time it was first seen
+    _seen: OrderedDict[str, float]
+
+    def __init__(self, max_size: int, ttl: float, shared: SharedState | None = None) -> None:
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.shared = shared
+        self._seen = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._seen)
+
+    def check(self, delivery_id: str, now: float | None = None) -> bool:
+        """Return True if delivery was already seen; otherwise remember it and return False."""
+        now = time.time() if now is None else now
+        self._evict(now)
+        if delivery_id in self._seen:
+            self.hits += 1
+            return True
+        if self.shared and not self.shared.claim(delivery_id, now):
+            # not remembered here: the worker that has it may forget it yet
+            self.hits += 1
+            return True
+        self.misses += 1
+        self._seen[delivery_id] = now
+        if len(self._seen) > self.max_size:
+            _ = self._seen.popitem(last=False)
+        return False
+
+    def forget(self, delivery_id: str) -> None:
+        """Drop a delivery, so that its redelivery gets processed."""
+        _ = self._seen.pop(delivery_id, None)
+        if self.shared:
+            self.shared.release(delivery_id)
+
+    def load(self, seen: Iterable[tuple[str, float]]) -> None:
+        """Restore (delivery id, first seen time) pairs, e.g. persisted by a previous run."""
+        merged = {**self._seen, **dict(seen)}
+        self._seen = OrderedDict(sorted(merged.items(), key=lambda x: x[1]))
+        while len(self._seen) > self.max_size:
+            _ = self._seen.popitem(last=False)
+
+    def _evict(self, now: float) -> None:
+        deadline = now - self.ttl
+        while self._seen:
+            oldest, at = next(iter(self._seen.items()))
+            if at >= deadline:
+                break
+            del self._seen[oldest]
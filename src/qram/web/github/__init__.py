@@ -1,2 +1,3 @@
+from .api import AsyncGithubApi as AsyncGithubApi
 from .api import GithubApi as GithubApi
 from .handler import GithubWebhookHandler as GithubWebhookHandler
@@ -1,19 +1,44 @@
+import asyncio
+import random
 import time
+from collections.abc import AsyncIterator
 from datetime import UTC, datetime, timedelta
+from functools import partial
 from logging import getLogger
 from typing import Any
 
 import httpx
 import jwt
+from cryptography.hazmat.primitives.asymmetric.rsa import RSAPrivateKey
+from cryptography.hazmat.primitives.serialization import load_pem_private_key
 from httpx import Response
 
-from qram.config import AppConfig
+from qram.config import AppConfig, CfgHttp
+from qram.web import codec
+from qram.web.github.cache import CacheKey, ResponseCache
+from qram.web.github.graphql import GraphQLError, PullRequestLoader, is_read_only
+from qram.web.github.ratelimit import RateLimitScheduler, is_mutation, resource_for
+from qram.web.github.retry import RetryingSender
+from qram.web.github.timing import observe_phases, route_template, start_timer
+from qram.web.shared import SharedState
 
 logger = getLogger(__name__)
 
-# TODO: make it configurable?
+# for the sync GithubApi; AsyncGithubApi takes timeouts from CfgHttp
 REQUESTS_TIMEOUT = 30
 
+# background renewal starts up to this many seconds before token expiry (which is itself set
+# 5 minutes ahead of the real one), so that several app instances do not renew in lockstep
+TOKEN_RENEW_JITTER = 60
+# pause before retrying a failed background renewal
+TOKEN_RENEW_RETRY = 10
+
+# JWT lifetime, backdated by a minute as github recommends; 10 minutes is the maximum allowed
+JWT_BACKDATE = 60
+JWT_LIFETIME = 600
+# cached JWT is re-signed once it has less than this many seconds left
+JWT_REUSE_MARGIN = 60
+
 # Github API is weird.
 # Some endpoints require you to generate JWT from private PEM and App id.
 # For others you need to first acquire separate access token from API using said JWT.
@@ -22,12 +47,54 @@ REQUESTS_TIMEOUT = 30
 # https://docs.github.com/en/apps/creating-github-apps/authenticating-with-a-github-app/generating-a-json-web-token-jwt-for-a-github-app
 
 
+class JwtSigner:
+    """Signs app JWTs, reusing each one for most of its lifetime.
+
+    RS256 signing is about a millisecond of CPU, and PEM parsing on top of that. Key is loaded
+    on first use, so that a bogus PEM only fails whatever actually needs a JWT.
+    """
+
+    app_id: str
+    pem: str
+    signed: int
+    _key: RSAPrivateKey | None
+    _jwt: str | None
+    _jwt_exp: float
+
+    def __init__(self, app_id: str, pem: str) -> None:
+        self.app_id = app_id
+        self.pem = pem
+        self.signed = 0
+        self._key = None
+        self._jwt = None
+        self._jwt_exp = 0
+
+    def get(self) -> str:
+        now = time.time()
+        if self._jwt is None or now > self._jwt_exp - JWT_REUSE_MARGIN:
+            self._jwt, self._jwt_exp = self.sign(now)
+        return self._jwt
+
+    def sign(self, now: float) -> tuple[str, float]:
+        if self._key is None:
+            key = load_pem_private_key(self.pem.encode(), password=None)
+            if not isinstance(key, RSAPrivateKey):
+                msg = 'github app private key must be an RSA key'
+                raise TypeError(msg)
+            self._key = key
+        self.signed += 1
+        t = int(now) - JWT_BACKDATE
+        return make_jwt(self.app_id, self._key, t), t + JWT_LIFETIME
+
+
 class GithubApi:
     app_id: str
     pem: str
+    api_url: str
     installation_tokens_url: str
     token: str
     expires_at: datetime
+    signer: JwtSigner
 
     def __init__(self, cfg: AppConfig) -> None:
         github = cfg.github
@@ -35,23 +102,13 @@ class GithubApi:
 
         self.app_id = github.app_id
         self.pem = github.pem
-        self.installation_tokens_url = (
-            f'https://api.github.com/app/installations/{github.installation_id}/access_tokens'
-        )
+        self.api_url = github.api_url
+        self.installation_tokens_url = installation_tokens_url(self.api_url, github.installation_id)
+        self.signer = JwtSigner(self.app_id, self.pem)
         self.token, self.expires_at = self.get_token()
 
     def rejwt(self) -> str:
-        # ""we recommend that you set this 60 seconds in the past""
-        t = int(time.time()) - 60
-        jwt_payload: dict[str, Any] = {
-            # issued at ...
-            'iat': t,
-            # JWT expiration time (10 minutes maximum)
-            'exp': t + 600,
-            # github app identifier
-            'iss': self.app_id,
-        }
-        return jwt.encode(jwt_payload, self.pem, algorithm='RS256')
+        return self.signer.get()
 
     def get_token(self) -> tuple[str, datetime]:
         encoded_jwt = self.rejwt()
@@ -59,26 +116,10 @@ class GithubApi:
         r = httpx.request(
             'POST',
             self.installation_tokens_url,
-            headers={
-                'Accept': 'application/vnd.github+json',
-                'Authorization': f'Bearer {encoded_jwt}',
-                'X-GitHub-Api-Version': '2022-11-28',
-            },
+            headers=api_headers(encoded_jwt),
             timeout=REQUESTS_TIMEOUT,
         )
-
-        # TODO: assuming this is a network hiccup: should pause and reattempt in a bit
-        if not r.is_success:
-            msg = f'github JWT authorization failed with {r.status_code}:\n{r.content.decode()}'
-            logger.error(msg)
-            raise RuntimeError(msg)
-        j = r.json()
-        expires = datetime.fromisoformat(j['expires_at'].rstrip('Z')).replace(
-            tzinfo=UTC
-        ) - timedelta(minutes=5)
-        token = j['token']
-        logger.debug(f'token acquired, expires at {expires}')
-        return (token, expires)
+        return parse_token_response(r)
 
     def _request(
         self,
@@ -95,14 +136,10 @@ class GithubApi:
             if now > self.expires_at:
                 self.token, self.expires_at = self.get_token()
             auth = self.token
-        headers = {
-            'Authorization': f'Bearer {auth}',
-            'Accept': 'application/vnd.github+json',
-            'X-GitHub-Api-Version': '2022-11-28',
-        }
+        headers = api_headers(auth)
 
         destination = destination.lstrip('/')
-        url = f'https://api.github.com/{destination}'
+        url = f'{self.api_url}{destination}'
         logger.debug(f'{method} -> {url}')
         # TODO: is it needed at all?..
         h = kwargs.get('headers', dict())
@@ -134,3 +171,393 @@ class GithubApi:
 
     def http_patch(self, destination: str, *, use_jwt: bool = False, **kwargs: object) -> Response:
         return self._request('PATCH', destination, use_jwt=use_jwt, **kwargs)
+
+
+class AsyncGithubApi:
+    """Async counterpart of GithubApi, running on a shared long-lived httpx.AsyncClient.
+
+    The client is owned by whoever created it (app lifespan), so connections and TLS sessions
+    to github API are reused between calls.
+
+    Access token is refreshed by at most one coroutine at a time; concurrent callers wait for
+    its result instead of each requesting their own. Once `start`ed, a background task renews
+    the token ahead of expiry, so that requests do not have to wait for it at all. With
+    `shared` state, the token is shared by worker processes as well: only the leader renews
+    it, others pick up whatever it stored.
+
+    Requests are paced by `ratelimit` to stay within the budget github reports back.
+    GET responses are kept in `cache`, if given, and revalidated with conditional requests.
+    Pull request lookups through `pull_requests` are batched into GraphQL queries.
+    Transient failures are retried by `sender`, which also fails fast during github outages.
+    """
+
+    app_id: str
+    pem: str
+    api_url: str
+    # path of api_url, which routes are relative to
+    api_path: str
+    installation_tokens_url: str
+    client: httpx.AsyncClient
+    token: str | None
+    expires_at: datetime
+    signer: JwtSigner
+    token_refreshes: int
+    renew_jitter: float
+    ratelimit: RateLimitScheduler
+    cache: ResponseCache | None
+    pull_requests: PullRequestLoader
+    sender: RetryingSender
+    # route template -> timeout to use instead of client's default
+    timeouts: dict[str, httpx.Timeout]
+    shared: SharedState | None
+    _token_lock: asyncio.Lock
+    _renewer: asyncio.Task[None] | None
+
+    def __init__(
+        self,
+        cfg: AppConfig,
+        client: httpx.AsyncClient,
+        cache: ResponseCache | None = None,
+        shared: SharedState | None = None,
+    ) -> None:
+        github = cfg.github
+        assert github is not None, 'config have to be setup for github'
+
+        self.app_id = github.app_id
+        self.pem = github.pem
+        self.api_url = github.api_url
+        self.api_path = httpx.URL(self.api_url).path
+        self.installation_tokens_url = installation_tokens_url(self.api_url, github.installation_id)
+        self.client = client
+        self.signer = JwtSigner(self.app_id, self.pem)
+        self.token = None
+        self.expires_at = datetime.min.replace(tzinfo=UTC)
+        self.token_refreshes = 0
+        self.renew_jitter = TOKEN_RENEW_JITTER
+        self.ratelimit = RateLimitScheduler()
+        self.cache = cache
+        self.pull_requests = PullRequestLoader(self.graphql)
+        self.sender = RetryingSender(cfg.retry)
+        t = client.timeout
+        self.timeouts = {
+            route: httpx.Timeout(connect=t.connect, read=read, write=t.write, pool=t.pool)
+            for route, read in cfg.http.read_timeout_overrides.items()
+        }
+        self.shared = shared
+        self._token_lock = asyncio.Lock()
+        self._renewer = None
+
+    def start(self) -> None:
+        """Start background token renewal."""
+        assert self._renewer is None, 'token renewal already started'
+        self._renewer = asyncio.create_task(self._renew_forever(), name='github-token-renewal')
+
+    async def aclose(self) -> None:
+        """Stop background token renewal; the http client is left to its owner."""
+        if self._renewer:
+            _ = self._renewer.cancel()
+            _ = await asyncio.gather(self._renewer, return_exceptions=True)
+            self._renewer = None
+
+    def rejwt(self) -> str:
+        return self.signer.get()
+
+    def token_is_valid(self) -> bool:
+        return self.token is not None and datetime.now(tz=UTC) < self.expires_at
+
+    async def get_valid_token(self) -> str:
+        if not self.token_is_valid():
+            async with self._token_lock:
+                # whoever held the lock before us might have refreshed it already
+                if not self.token_is_valid():
+                    await self._refresh_token()
+        assert self.token is not None
+        return self.token
+
+    async def _refresh_token(self) -> None:
+        if self.shared is None:
+            self.token, self.expires_at = await self.get_token()
+            self.token_refreshes += 1
+            return
+        name = self.installation_tokens_url
+        async with self.shared.token_lock():
+            # another worker might have got a new one while we waited for the lock
+            stored = await self.shared.load_token(name)
+            if stored and stored[0] != self.token and datetime.now(tz=UTC) < stored[1]:
+                self.token, self.expires_at = stored
+                return
+            self.token, self.expires_at = await self.get_token()
+            self.token_refreshes += 1
+            await self.shared.store_token(name, self.token, self.expires_at)
+
+    async def _renew_forever(self) -> None:
+        while True:
+            ahead = timedelta(seconds=random.uniform(0, self.renew_jitter))  # noqa: S311
+            delay = (self.expires_at - ahead - datetime.now(tz=UTC)).total_seconds()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            try:
+                async with self._token_lock:
+                    await self._refresh_token()
+            except Exception:
+                logger.exception('background github token renewal failed')
+                await asyncio.sleep(TOKEN_RENEW_RETRY)
+                continue
+            if not self.token_is_valid():
+                # e.g. clock skew; do not spin on tokens that are stale on arrival
+                logger.warning(f'renewed github token is already expired: {self.expires_at}')
+                await asyncio.sleep(TOKEN_RENEW_RETRY)
+
+    async def get_token(self) -> tuple[str, datetime]:
+        encoded_jwt = self.rejwt()
+        logger.debug('requesting new access token from github')
+
+        async def send() -> Response:
+            headers = api_headers(encoded_jwt)
+            return await self.client.request('POST', self.installation_tokens_url, headers=headers)
+
+        # safe to repeat: the worst case is an extra token nobody uses
+        r = await self.sender.send('POST', send, idempotent=True)
+        return parse_token_response(r)
+
+    async def _request(
+        self,
+        method: str,
+        destination: str,
+        *,
+        use_jwt: bool = False,
+        idempotent: bool | None = None,
+        **kwargs: Any,  # noqa: ANN401
+    ) -> Response:
+        """Send a request; `idempotent` overrides what its method says about retrying it."""
+        auth = self.rejwt() if use_jwt else await self.get_valid_token()
+        headers = api_headers(auth)
+
+        destination = destination.lstrip('/')
+        url = f'{self.api_url}{destination}'
+        logger.debug(f'{method} -> {url}')
+
+        cache_key: CacheKey | None = None
+        if self.cache is not None and method == 'GET':
+            # responses differ between app and installation, so they are cached separately
+            scope = 'app' if use_jwt else 'installation'
+            cache_key = (scope, str(httpx.URL(url, params=kwargs.get('params'))))
+            if entry := self.cache.get(cache_key):
+                headers.update(self.cache.conditional_headers(entry))
+        headers.update(kwargs.pop('headers', None) or dict())
+
+        resource = resource_for(destination)
+        if self.timeouts and (
+            timeout := self.timeouts.get(route_template(httpx.URL(url).path, self.api_path))
+        ):
+            _ = kwargs.setdefault('timeout', timeout)
+
+        async def send() -> Response:
+            # every attempt waits for its turn, and reports budget it got back
+            await self.ratelimit.acquire(resource, mutation=is_mutation(method))
+            r = await self.client.request(method=method, url=url, headers=headers, **kwargs)
+            self.ratelimit.update(resource, r)
+            return r
+
+        r = await self.sender.send(method, send, idempotent=idempotent)
+        logger.debug(f'{method} => {r.status_code}')
+        if self.cache is not None and cache_key is not None:
+            r = self.cache.resolve(cache_key, destination.partition('?')[0], r)
+        return r
+
+    async def http_get(
+        self,
+        destination: str,
+        *,
+        use_jwt: bool = False,
+        idempotent: bool | None = None,
+        **kwargs: object,
+    ) -> Response:
+        return await self._request(
+            'GET', destination, use_jwt=use_jwt, idempotent=idempotent, **kwargs
+        )
+
+    async def http_post(
+        self,
+        destination: str,
+        *,
+        use_jwt: bool = False,
+        idempotent: bool | None = None,
+        **kwargs: object,
+    ) -> Response:
+        return await self._request(
+            'POST', destination, use_jwt=use_jwt, idempotent=idempotent, **kwargs
+        )
+
+    async def http_delete(
+        self,
+        destination: str,
+        *,
+        use_jwt: bool = False,
+        idempotent: bool | None = None,
+        **kwargs: object,
+    ) -> Response:
+        return await self._request(
+            'DELETE', destination, use_jwt=use_jwt, idempotent=idempotent, **kwargs
+        )
+
+    async def http_put(
+        self,
+        destination: str,
+        *,
+        use_jwt: bool = False,
+        idempotent: bool | None = None,
+        **kwargs: object,
+    ) -> Response:
+        return await self._request(
+            'PUT', destination, use_jwt=use_jwt, idempotent=idempotent, **kwargs
+        )
+
+    async def http_patch(
+        self,
+        destination: str,
+        *,
+        use_jwt: bool = False,
+        idempotent: bool | None = None,
+        **kwargs: object,
+    ) -> Response:
+        return await self._request(
+            'PATCH', destination, use_jwt=use_jwt, idempotent=idempotent, **kwargs
+        )
+
+    async def graphql(self, query: str, variables: dict[str, Any] | None = None) -> dict[str, Any]:
+        """Run GraphQL query and return its data; partial errors are only logged."""
+        # queries are sent as POST too, but are as safe to retry as GETs
+        r = await self.http_post(
+            'graphql',
+            idempotent=is_read_only(query),
+            json=dict(query=query, variables=variables or {}),
+        )
+        if not r.is_success:
+            msg = f'github graphql query failed with {r.status_code}:\n{r.content.decode()}'
+            raise GraphQLError(msg)
+        j = codec.loads(r.content)
+        if errors := j.get('errors'):
+            # e.g. one of the batched pull requests does not exist; the rest is still there
+            logger.warning(f'github graphql query returned errors: {errors}')
+        if j.get('data') is None:
+            msg = f'github graphql query returned no data: {errors}'
+            raise GraphQLError(msg)
+        data: dict[str, Any] = j['data']
+        return data
+
+    async def paginate(
+        self,
+        destination: str,
+        *,
+        per_page: int = 100,
+        max_items: int | None = None,
+        items_key: str | None = None,
+        use_jwt: bool = False,
+        **kwargs: Any,  # noqa: ANN401
+    ) -> AsyncIterator[Any]:
+        """Yield items of a list endpoint one by one, following `Link: rel="next"` headers.
+
+        Next page is requested while the caller goes through the current one; no more than two
+        pages are held at a time. `items_key` is for endpoints that wrap the list into an object,
+        e.g. 'check_runs'. Stops after `max_items`, if given, without fetching further pages.
+        """
+        if max_items is not None:
+            if max_items <= 0:
+                return
+            per_page = min(per_page, max_items)
+        params = {**(kwargs.pop('params', None) or {}), 'per_page': per_page}
+        page: asyncio.Task[Response] | None = asyncio.create_task(
+            self.http_get(destination, use_jwt=use_jwt, params=params, **kwargs)
+        )
+        yielded = 0
+        try:
+            while page is not None:
+                r = await page
+                page = None
+                _ = r.raise_for_status()
+                content = codec.loads(r.content)
+                items = content[items_key] if items_key else content
+                next_url = r.links.get('next', {}).get('url')
+                if next_url is not None and (max_items is None or yielded + len(items) < max_items):
+                    # query of next url already carries per_page and the rest of params
+                    page = asyncio.create_task(
+                        self.http_get(
+                            next_url.removeprefix(self.api_url), use_jwt=use_jwt, **kwargs
+                        )
+                    )
+                for item in items:
+                    if max_items is not None and yielded >= max_items:
+                        return
+                    yield item
+                    yielded += 1
+        finally:
+            if page is not None:
+                _ = page.cancel()
+
+
+def create_async_client(cfg: CfgHttp, api_url: str | None = None) -> httpx.AsyncClient:
+    """Create the pooled client to be shared by everything talking to GitHub API.
+
+    Its event hooks record per-phase latency of every call into qram.metrics, by route under
+    `api_url`.
+    """
+    api_path = httpx.URL(api_url).path if api_url else '/'
+    return httpx.AsyncClient(
+        http2=cfg.http2,
+        limits=httpx.Limits(
+            max_connections=cfg.max_connections,
+            max_keepalive_connections=cfg.max_keepalive_connections,
+            keepalive_expiry=cfg.keepalive_expiry,
+        ),
+        timeout=httpx.Timeout(
+            connect=cfg.connect_timeout,
+            read=cfg.read_timeout,
+            write=cfg.write_timeout,
+            pool=cfg.pool_timeout,
+        ),
+        event_hooks=dict(
+            request=[start_timer], response=[partial(observe_phases, api_path=api_path)]
+        ),
+    )
+
+
+def installation_tokens_url(api_url: str, installation_id: str) -> str:
+    return f'{api_url}app/installations/{installation_id}/access_tokens'
+
+
+def api_headers(auth: str) -> dict[str, str]:
+    return {
+        'Authorization': f'Bearer {auth}',
+        'Accept': 'application/vnd.github+json',
+        'X-GitHub-Api-Version': '2022-11-28',
+    }
+
+
+def make_jwt(app_id: str, key: str | RSAPrivateKey, issued_at: int | None = None) -> str:
+    # ""we recommend that you set this 60 seconds in the past""
+    t = int(time.time()) - JWT_BACKDATE if issued_at is None else issued_at
+    jwt_payload: dict[str, Any] = {
+        # issued at ...
+        'iat': t,
+        # JWT expiration time (10 minutes maximum)
+        'exp': t + JWT_LIFETIME,
+        # github app identifier
+        'iss': app_id,
+    }
+    return jwt.encode(jwt_payload, key, algorithm='RS256')
+
+
+def parse_token_response(r: Response) -> tuple[str, datetime]:
+    # TODO: GithubApi should retry like AsyncGithubApi does before it gets here
+    if not r.is_success:
+        msg = f'github JWT authorization failed with {r.status_code}:\n{r.content.decode()}'
+        logger.error(msg)
+        raise RuntimeError(msg)
+    j = r.json()
+    expires = datetime.fromisoformat(j['expires_at'].rstrip('Z')).replace(tzinfo=UTC) - timedelta(
+        minutes=5
+    )
+    token = j['token']
+    logger.debug(f'token acquired, expires at {expires}')
+    return (token, expires)
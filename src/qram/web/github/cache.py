@@ -0,0 +1,202 @@
+import logging
+from collections import OrderedDict
+from collections.abc import Collection
+from dataclasses import dataclass
+
+import httpx
+
+from qram.web.github.events import (
+    CheckRunEvent,
+    CheckSuiteEvent,
+    GithubEvent,
+    IssueCommentEvent,
+    PullRequestEvent,
+    PullRequestReviewEvent,
+    PushEvent,
+    StatusEvent,
+)
+
+logger = logging.getLogger(__name__)
+
+# Conditional requests are free: github does not count 304 responses against the rate limit.
+# https://docs.github.com/en/rest/using-the-rest-api/best-practices-for-using-the-rest-api#use-conditional-requests-if-appropriate
+
+# (auth scope, url)
+type CacheKey = tuple[str, str]
+
+# response headers worth keeping along with the body
+KEPT_HEADERS = ('content-type', 'link', 'etag', 'last-modified')
+# headers of 304 that describe its own (empty) body, not the cached one
+BODY_HEADERS = frozenset(('content-length', 'content-encoding', 'transfer-encoding'))
+
+
+@dataclass(frozen=True, slots=True)
+class CachedResponse:
+    # api path without query, e.g. 'repos/o/r/pulls/1'; what invalidation matches against
+    path: str
+    etag: str | None
+    last_modified: str | None
+    headers: dict[str, str]
+    content: bytes
+
+    @property
+    def size(self) -> int:
+        return len(self.content)
+
+
+class ResponseCache:
+    """LRU of GET responses validated with ETag / Last-Modified, bounded by total body size.
+
+    Keys include the auth scope, since what github returns depends on who is asking.
+    Webhook events drop entries for resources they are known to change, so that whoever handles
+    the event does not have to spend a round trip on revalidation only to get a 200 anyway.
+    """
+
+    max_bytes: int
+    size: int
+    hits: int
+    misses: int
+    bytes_saved: int
+    _entries: OrderedDict[CacheKey, CachedResponse]
+    # 'owner/name' -> keys of entries under repos/owner/name/
+    _by_repo: dict[str, set[CacheKey]]
+
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self._entries = OrderedDict()
+        self._by_repo = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def hit_ratio(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def get(self, key: CacheKey) -> CachedResponse | None:
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+
+    def conditional_headers(self, entry: CachedResponse) -> dict[str, str]:
+        headers: dict[str, str] = {}
+        if entry.etag:
+            headers['If-None-Match'] = entry.etag
+        if entry.last_modified:
+            headers['If-Modified-Since'] = entry.last_modified
+        return headers
+
+    def resolve(self, key: CacheKey, path: str, r: httpx.Response) -> httpx.Response:
+        """Account for response to a (possibly conditional) GET; 304 is turned into cached 200."""
+        entry = self._entries.get(key)
+        if r.status_code == httpx.codes.NOT_MODIFIED and entry is not None:
+            self.hits += 1
+            self.bytes_saved += entry.size
+            fresh = {k: v for k, v in r.headers.items() if k not in BODY_HEADERS}
+            return httpx.Response(
+                httpx.codes.OK,
+                headers={**entry.headers, **fresh},
+                content=entry.content,
+                request=r.request,
+            )
+        self.misses += 1
+        if r.status_code == httpx.codes.OK:
+            self._store(key, path, r)
+        elif entry is not None:
+            self._drop(key)
+        return r
+
+    def invalidate(self, repo: str, paths: Collection[str]) -> int:
+        """Drop entries of `repo` under any of `paths`, given relative to repos/owner/name.
+
+        Paths starting with '=' match only themselves, not what is under them.
+        """
+        keys = self._by_repo.get(repo)
+        if not keys:
+            return 0
+        exact = {f'repos/{repo}/{p[1:]}' for p in paths if p.startswith('=')}
+        prefixes = [f'repos/{repo}/{p}' for p in paths if not p.startswith('=')]
+        stale = [
+            key
+            for key in keys
+            if (path := self._entries[key].path) in exact
+            or any(path == prefix or path.startswith(f'{prefix}/') for prefix in prefixes)
+        ]
+        for key in stale:
+            self._drop(key)
+        return len(stale)
+
+    def invalidate_event(self, event: GithubEvent) -> int:
+        if not event.repo:
+            return 0
+        dropped = self.invalidate(event.repo, stale_paths(event))
+        if dropped:
+            logger.debug(f'{type(event).__name__} invalidated {dropped} cached responses')
+        return dropped
+
+    def stats(self) -> dict[str, float]:
+        return dict(
+            entries=len(self._entries),
+            bytes=self.size,
+            hits=self.hits,
+            misses=self.misses,
+            hit_ratio=self.hit_ratio,
+            bytes_saved=self.bytes_saved,
+        )
+
+    def _store(self, key: CacheKey, path: str, r: httpx.Response) -> None:
+        etag = r.headers.get('etag')
+        last_modified = r.headers.get('last-modified')
+        if key in self._entries:
+            self._drop(key)
+        if not (etag or last_modified) or len(r.content) > self.max_bytes:
+            return
+        headers = {h: r.headers[h] for h in KEPT_HEADERS if h in r.headers}
+        entry = CachedResponse(path, etag, last_modified, headers, r.content)
+        self._entries[key] = entry
+        self.size += entry.size
+        if repo := _repo_of(path):
+            self._by_repo.setdefault(repo, set()).add(key)
+        while self.size > self.max_bytes:
+            self._drop(next(iter(self._entries)))
+
+    def _drop(self, key: CacheKey) -> None:
+        entry = self._entries.pop(key)
+        self.size -= entry.size
+        if (repo := _repo_of(entry.path)) and (keys := self._by_repo.get(repo)):
+            keys.discard(key)
+            if not keys:
+                del self._by_repo[repo]
+
+
+def stale_paths(event: GithubEvent) -> list[str]:
+    """Resources (relative to repos/owner/name) that `event` tells have changed."""
+    match event:
+        case PullRequestEvent(number=n):
+            # lists are cached under bare path, whatever their query is
+            return [f'pulls/{n}', f'issues/{n}', '=pulls', '=issues']
+        case PullRequestReviewEvent(number=n):
+            return [f'pulls/{n}/reviews']
+        case IssueCommentEvent(number=n):
+            return [f'issues/{n}/comments']
+        case PushEvent(ref=ref):
+            branch = ref.removeprefix('refs/heads/')
+            return [f'branches/{branch}', f'git/ref/heads/{branch}', f'git/refs/heads/{branch}']
+        case CheckSuiteEvent(head_sha=sha) | CheckRunEvent(head_sha=sha) | StatusEvent(sha=sha):
+            # check-runs, check-suites, status, statuses
+            return [f'commits/{sha}']
+        case _:
+            return []
+
+
+def _repo_of(path: str) -> str | None:
+    parts = path.split('/', 3)
+    if len(parts) >= 3 and parts[0] == 'repos':  # noqa: PLR2004
+        return f'{parts[1]}/{parts[2]}'
+    return None
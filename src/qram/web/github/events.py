@@ -0,0 +1,232 @@
+from collections.abc import Callable, Hashable
+from dataclasses import dataclass
+from typing import Any, Self
+
+# Compact typed views of github webhook payloads.
+# Payloads are large (20-200KB is common) while only a handful of fields are ever used;
+# each event copies out what it declares, so the decoded dict can be dropped right after.
+# https://docs.github.com/en/webhooks/webhook-events-and-payloads
+
+
+@dataclass(frozen=True, slots=True)
+class GithubEvent:
+    action: str | None
+    # 'owner/name'; not every event is tied to a repository
+    repo: str | None
+
+    @classmethod
+    def from_payload(cls, payload: dict[str, Any]) -> Self:
+        return cls(**_common(payload))
+
+
+@dataclass(frozen=True, slots=True)
+class PingEvent(GithubEvent):
+    zen: str
+
+    @classmethod
+    def from_payload(cls, payload: dict[str, Any]) -> Self:
+        return cls(**_common(payload), zen=payload.get('zen', ''))
+
+
+@dataclass(frozen=True, slots=True)
+class PullRequestEvent(GithubEvent):
+    number: int
+    head_sha: str
+    head_ref: str
+    base_ref: str
+    state: str
+    merged: bool
+    draft: bool
+    labels: tuple[str, ...]
+    # label added or removed, for `labeled` and `unlabeled` actions
+    label: str | None
+    # None while github is still computing it, which webhooks are often sent before
+    mergeable: bool | None = None
+
+    @classmethod
+    def from_payload(cls, payload: dict[str, Any]) -> Self:
+        pr = payload['pull_request']
+        label = payload.get('label')
+        return cls(
+            **_common(payload),
+            number=pr['number'],
+            head_sha=pr['head']['sha'],
+            head_ref=pr['head']['ref'],
+            base_ref=pr['base']['ref'],
+            state=pr['state'],
+            merged=bool(pr.get('merged')),
+            draft=bool(pr.get('draft')),
+            labels=tuple(x['name'] for x in pr.get('labels', ())),
+            label=label['name'] if label else None,
+            mergeable=pr.get('mergeable'),
+        )
+
+
+@dataclass(frozen=True, slots=True)
+class PullRequestReviewEvent(GithubEvent):
+    number: int
+    # commit the review was left on
+    commit_id: str
+    # approved, changes_requested, commented, dismissed
+    state: str
+    author: str
+
+    @classmethod
+    def from_payload(cls, payload: dict[str, Any]) -> Self:
+        review = payload['review']
+        return cls(
+            **_common(payload),
+            number=payload['pull_request']['number'],
+            commit_id=review['commit_id'],
+            state=review['state'].lower(),
+            author=review['user']['login'],
+        )
+
+
+@dataclass(frozen=True, slots=True)
+class PushEvent(GithubEvent):
+    ref: str
+    before: str
+    after: str
+
+    @classmethod
+    def from_payload(cls, payload: dict[str, Any]) -> Self:
+        return cls(
+            **_common(payload),
+            ref=payload['ref'],
+            before=payload['before'],
+            after=payload['after'],
+        )
+
+
+@dataclass(frozen=True, slots=True)
+class CheckSuiteEvent(GithubEvent):
+    head_sha: str
+    head_branch: str | None
+    status: str | None
+    conclusion: str | None
+    app: str | None
+    pull_numbers: tuple[int, ...]
+
+    @classmethod
+    def from_payload(cls, payload: dict[str, Any]) -> Self:
+        suite = payload['check_suite']
+        return cls(
+            **_common(payload),
+            head_sha=suite['head_sha'],
+            head_branch=suite.get('head_branch'),
+            status=suite.get('status'),
+            conclusion=suite.get('conclusion'),
+            app=(suite.get('app') or {}).get('slug'),
+            pull_numbers=_pull_numbers(suite),
+        )
+
+
+@dataclass(frozen=True, slots=True)
+class CheckRunEvent(GithubEvent):
+    id: int
+    name: str
+    head_sha: str
+    status: str
+    conclusion: str | None
+    pull_numbers: tuple[int, ...]
+
+    @classmethod
+    def from_payload(cls, payload: dict[str, Any]) -> Self:
+        run = payload['check_run']
+        return cls(
+            **_common(payload),
+            id=run['id'],
+            name=run['name'],
+            head_sha=run['head_sha'],
+            status=run['status'],
+            conclusion=run.get('conclusion'),
+            pull_numbers=_pull_numbers(run),
+        )
+
+
+@dataclass(frozen=True, slots=True)
+class StatusEvent(GithubEvent):
+    sha: str
+    context: str
+    # error, failure, pending, success
+    state: str
+
+    @classmethod
+    def from_payload(cls, payload: dict[str, Any]) -> Self:
+        return cls(
+            **_common(payload),
+            sha=payload['sha'],
+            context=payload['context'],
+            state=payload['state'],
+        )
+
+
+@dataclass(frozen=True, slots=True)
+class IssueCommentEvent(GithubEvent):
+    # github uses issues both for actual issues and PRs
+    number: int
+    is_pull_request: bool
+    body: str
+    author: str
+
+    @classmethod
+    def from_payload(cls, payload: dict[str, Any]) -> Self:
+        issue = payload['issue']
+        comment = payload['comment']
+        return cls(
+            **_common(payload),
+            number=issue['number'],
+            is_pull_request='pull_request' in issue,
+            body=comment['body'],
+            author=comment['user']['login'],
+        )
+
+
+# X-GitHub-Event header value -> parser; deliveries of other events are not even decoded
+EVENT_TYPES: dict[str, Callable[[dict[str, Any]], GithubEvent]] = {
+    'ping': PingEvent.from_payload,
+    'pull_request': PullRequestEvent.from_payload,
+    'pull_request_review': PullRequestReviewEvent.from_payload,
+    'push': PushEvent.from_payload,
+    'check_suite': CheckSuiteEvent.from_payload,
+    'check_run': CheckRunEvent.from_payload,
+    'status': StatusEvent.from_payload,
+    'issue_comment': IssueCommentEvent.from_payload,
+}
+
+
+def parse_event(name: str, payload: dict[str, Any]) -> GithubEvent:
+    return EVENT_TYPES[name](payload)
+
+
+def coalescing_key(event: GithubEvent) -> tuple[Hashable, Hashable] | None:
+    """(key, sub-key) to coalesce event by; None for events that are processed one by one.
+
+    Key is the pull request or commit an event is about, so that events of a burst are
+    processed together; sub-key tells what state it reports, so that a later event with the
+    same one makes it obsolete.
+    """
+    match event:
+        case PullRequestEvent(repo=str(repo)):
+            # consumers may care what happened too, not only how it ended up (e.g. a push)
+            return (repo, event.number), ('pull_request', event.action)
+        case PullRequestReviewEvent(repo=str(repo)):
+            return (repo, event.number), ('review', event.author)
+        case CheckRunEvent(repo=str(repo)):
+            return (repo, event.head_sha), ('check_run', event.name)
+        case CheckSuiteEvent(repo=str(repo)):
+            return (repo, event.head_sha), ('check_suite', event.app)
+        case StatusEvent(repo=str(repo)):
+            return (repo, event.sha), ('status', event.context)
+        case _:
+            return None
+
+
+def _common(payload: dict[str, Any]) -> dict[str, Any]:
+    repo = payload.get('repository')
+    return dict(action=payload.get('action'), repo=repo['full_name'] if repo else None)
+
+
+def _pull_numbers(check: dict[str, Any]) -> tuple[int, ...]:
+    return tuple(pr['number'] for pr in check.get('pull_requests', ()))
@@ -0,0 +1,495 @@
+"""In-memory stand-in for the parts of GitHub API qram talks to.
+
+Runs in-process (`httpx.ASGITransport(fake.app)`) or as a server (`python -m
+qram.web.github.fake`), so that connection pooling, caching, retries and rate limit pacing
+can be tested and benchmarked without network access or a real GitHub App.
+
+Answers like github does where it matters to the client: installation tokens, pull requests,
+issue comments and labels, check runs, branches with their required checks, merges, and the
+GraphQL pull request queries of PullRequestLoader; lists
+are paginated with `Link` headers, GETs carry ETags and get 304 for a matching If-None-Match,
+every response reports rate limit budget. Latency, 5xx errors and rate limiting can be
+injected, deterministically for a given seed.
+"""
+
+import asyncio
+import hashlib
+import json
+import random
+import re
+import secrets
+import time
+from argparse import ArgumentParser
+from collections import Counter, deque
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass, field
+from datetime import UTC, datetime, timedelta
+from typing import Any
+
+import httpx
+import uvicorn
+from fastapi import FastAPI, Request, Response
+
+from qram.web.github.timing import route_template
+
+REPO_QUERY = re.compile(
+    r'(r\d+): repository\(owner: \$(o\d+), name: \$(n\d+)\) \{ ((?:\w+: pullRequest\(number: \d+\)'
+    r' \{ \.\.\.PullRequestStatus \} ?)+)\}'
+)
+PR_QUERY = re.compile(r'(\w+): pullRequest\(number: (\d+)\)')
+
+
+@dataclass
+class FakePull:
+    repo: str
+    number: int
+    head_sha: str
+    head_ref: str
+    base_ref: str = 'main'
+    state: str = 'open'
+    draft: bool = False
+    merged: bool = False
+    labels: list[str] = field(default_factory=list)
+    # reviewer login -> APPROVED, CHANGES_REQUESTED, ...
+    reviews: dict[str, str] = field(default_factory=dict)
+
+    def rest(self) -> dict[str, Any]:
+        return dict(
+            number=self.number,
+            state=self.state,
+            draft=self.draft,
+            merged=self.merged,
+            head=dict(sha=self.head_sha, ref=self.head_ref),
+            base=dict(ref=self.base_ref),
+            labels=[dict(name=x) for x in self.labels],
+        )
+
+
+@dataclass
+class RateLimitBudget:
+    limit: int
+    window: float
+    remaining: int = 0
+    reset: float = 0.0
+
+    def take(self, now: float) -> bool:
+        if now >= self.reset:
+            self.remaining, self.reset = self.limit, now + self.window
+        if self.remaining == 0:
+            return False
+        self.remaining -= 1
+        return True
+
+
+class FakeGithub:
+    """Github API double; state and counters are plain attributes, for tests to set and check.
+
+    `latency` (plus up to `jitter`) seconds are added to every response, `error_rate` of them
+    are 502s, and `fail_next` holds status codes to answer the next requests with, in order.
+    """
+
+    app: FastAPI
+    latency: float
+    jitter: float
+    error_rate: float
+    per_page: int
+    token_lifetime: float
+    fail_next: deque[int]
+    pulls: dict[tuple[str, int], FakePull]
+    comments: dict[tuple[str, int], list[dict[str, Any]]]
+    # (repo, head sha) -> check runs
+    check_runs: dict[tuple[str, str], list[dict[str, Any]]]
+    tokens: dict[str, datetime]
+    # (repo, branch) -> sha
+    refs: dict[tuple[str, str], str]
+    # sha -> parent shas, for commits made by merges; others are treated as root commits
+    commits: dict[str, tuple[str, ...]]
+    # (repo, head sha) of commits that do not merge cleanly into anything
+    conflicts: set[tuple[str, str]]
+    # (repo, branch) -> names of required checks, from branch protection
+    protection: dict[tuple[str, str], list[str]]
+    # 'METHOD route template' -> count, including failed and not modified ones
+    requests: Counter[str]
+    not_modified: int
+    ratelimit: dict[str, RateLimitBudget]
+    _rng: random.Random
+    _ids: int
+
+    def __init__(  # noqa: PLR0913
+        self,
+        *,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        error_rate: float = 0.0,
+        ratelimit: int = 5000,
+        ratelimit_window: float = 3600,
+        per_page: int = 30,
+        token_lifetime: float = 3600,
+        seed: int = 0,
+    ) -> None:
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.per_page = per_page
+        self.token_lifetime = token_lifetime
+        self.fail_next = deque()
+        self.pulls = {}
+        self.comments = {}
+        self.check_runs = {}
+        self.tokens = {}
+        self.refs = {}
+        self.commits = {}
+        self.conflicts = set()
+        self.protection = {}
+        self.requests = Counter()
+        self.not_modified = 0
+        self.ratelimit = {
+            name: RateLimitBudget(ratelimit, ratelimit_window) for name in ('core', 'graphql')
+        }
+        self._rng = random.Random(seed)  # noqa: S311
+        self._ids = 0
+        self.app = self._create_app()
+
+    def add_pull(self, repo: str, number: int, **fields: Any) -> FakePull:  # noqa: ANN401
+        pr = FakePull(
+            repo,
+            number,
+            head_sha=fields.pop('head_sha', hashlib.sha1(f'{repo}#{number}'.encode()).hexdigest()),  # noqa: S324
+            head_ref=fields.pop('head_ref', f'feature-{number}'),
+            **fields,
+        )
+        self.pulls[repo, number] = pr
+        return pr
+
+    def add_branch(self, repo: str, branch: str, sha: str | None = None) -> str:
+        sha = sha or hashlib.sha1(f'{repo}:{branch}'.encode()).hexdigest()  # noqa: S324
+        self.refs[repo, branch] = sha
+        return sha
+
+    def is_ancestor(self, ancestor: str, sha: str) -> bool:
+        seen, todo = set(), [sha]
+        while todo:
+            if (c := todo.pop()) == ancestor:
+                return True
+            if c not in seen:
+                seen.add(c)
+                todo += self.commits.get(c, ())
+        return False
+
+    def _create_app(self) -> FastAPI:
+        app = FastAPI()
+        _ = app.middleware('http')(self._simulate)
+        repo = '/repos/{owner}/{name}'
+        app.add_api_route(
+            '/app/installations/{installation_id}/access_tokens',
+            self._create_token,
+            methods=['POST'],
+        )
+        app.add_api_route(f'{repo}/pulls', self._list_pulls, methods=['GET'])
+        app.add_api_route(f'{repo}/pulls/{{number}}', self._get_pull, methods=['GET'])
+        app.add_api_route(f'{repo}/pulls/{{number}}/merge', self._merge_pull, methods=['PUT'])
+        app.add_api_route(
+            f'{repo}/issues/{{number}}/comments', self._list_comments, methods=['GET']
+        )
+        app.add_api_route(
+            f'{repo}/issues/{{number}}/comments', self._create_comment, methods=['POST']
+        )
+        app.add_api_route(
+            f'{repo}/commits/{{ref}}/check-runs', self._list_check_runs, methods=['GET']
+        )
+        app.add_api_route(
+            f'{repo}/issues/{{number}}/labels/{{label}}', self._remove_label, methods=['DELETE']
+        )
+        app.add_api_route(f'{repo}/check-runs', self._create_check_run, methods=['POST'])
+        app.add_api_route(f'{repo}/git/ref/heads/{{branch:path}}', self._get_ref, methods=['GET'])
+        app.add_api_route(f'{repo}/git/refs', self._create_ref, methods=['POST'])
+        app.add_api_route(
+            f'{repo}/git/refs/heads/{{branch:path}}', self._update_ref, methods=['PATCH']
+        )
+        app.add_api_route(
+            f'{repo}/git/refs/heads/{{branch:path}}', self._delete_ref, methods=['DELETE']
+        )
+        app.add_api_route(f'{repo}/merges', self._merge, methods=['POST'])
+        app.add_api_route(
+            f'{repo}/branches/{{branch}}/protection/required_status_checks',
+            self._required_checks,
+            methods=['GET'],
+        )
+        app.add_api_route('/graphql', self._graphql, methods=['POST'])
+        return app
+
+    async def _simulate(
+        self, request: Request, call_next: Callable[[Request], Awaitable[Response]]
+    ) -> Response:
+        """Latency, failures, authentication and rate limit budget, before the actual route."""
+        self.requests[f'{request.method} {route_template(request.url.path)}'] += 1
+        if delay := self.latency + self._rng.uniform(0, self.jitter):
+            await asyncio.sleep(delay)
+        if self.fail_next:
+            return _error(self.fail_next.popleft(), 'scripted failure')
+        if self.error_rate and self._rng.random() < self.error_rate:
+            return _error(502, 'Server Error')
+
+        if not self._authorized(request):
+            return _error(401, 'Bad credentials')
+
+        resource = 'graphql' if request.url.path == '/graphql' else 'core'
+        budget = self.ratelimit[resource]
+        now = time.time()
+        if not budget.take(now):
+            r = _error(403, 'API rate limit exceeded')
+        else:
+            r = await call_next(request)
+            if r.status_code == httpx.codes.NOT_MODIFIED:
+                # conditional requests answered with 304 do not count against the limit
+                budget.remaining += 1
+                self.not_modified += 1
+        r.headers['x-ratelimit-limit'] = str(budget.limit)
+        r.headers['x-ratelimit-remaining'] = str(budget.remaining)
+        r.headers['x-ratelimit-reset'] = str(int(budget.reset))
+        r.headers['x-ratelimit-resource'] = resource
+        return r
+
+    def _authorized(self, request: Request) -> bool:
+        scheme, _, credentials = request.headers.get('authorization', '').partition(' ')
+        if scheme.lower() != 'bearer':
+            return False
+        if request.url.path.endswith('/access_tokens'):
+            # app JWT; signature is not checked, that is what jwt library is for
+            return credentials.count('.') == 2  # noqa: PLR2004
+        expires_at = self.tokens.get(credentials)
+        return expires_at is not None and datetime.now(tz=UTC) < expires_at
+
+    async def _create_token(self, installation_id: str) -> Response:
+        _ = installation_id
+        token = f'ghs_{secrets.token_hex(16)}'
+        expires_at = datetime.now(tz=UTC) + timedelta(seconds=self.token_lifetime)
+        self.tokens[token] = expires_at
+        return _json(
+            dict(token=token, expires_at=expires_at.strftime('%Y-%m-%dT%H:%M:%SZ')), status=201
+        )
+
+    async def _list_pulls(self, request: Request, owner: str, name: str) -> Response:
+        repo = f'{owner}/{name}'
+        prs = [
+            pr.rest()
+            for (r, _), pr in sorted(self.pulls.items())
+            if r == repo and pr.state == 'open'
+        ]
+        return self._page(request, prs)
+
+    async def _get_pull(self, request: Request, owner: str, name: str, number: int) -> Response:
+        pr = self.pulls.get((f'{owner}/{name}', number))
+        if pr is None:
+            return _error(404, 'Not Found')
+        return _json(pr.rest(), request=request)
+
+    async def _merge_pull(self, owner: str, name: str, number: int) -> Response:
+        pr = self.pulls.get((f'{owner}/{name}', number))
+        if pr is None:
+            return _error(404, 'Not Found')
+        if pr.state != 'open':
+            return _error(405, 'Pull Request is not mergeable')
+        pr.state, pr.merged = 'closed', True
+        return _json(dict(merged=True, sha=pr.head_sha, message='Pull Request successfully merged'))
+
+    async def _list_comments(
+        self, request: Request, owner: str, name: str, number: int
+    ) -> Response:
+        return self._page(request, self.comments.get((f'{owner}/{name}', number), []))
+
+    async def _create_comment(
+        self, request: Request, owner: str, name: str, number: int
+    ) -> Response:
+        body = json.loads(await request.body())
+        comment = dict(id=self._next_id(), body=body['body'], user=dict(login='qram[bot]'))
+        self.comments.setdefault((f'{owner}/{name}', number), []).append(comment)
+        return _json(comment, status=201)
+
+    async def _remove_label(self, owner: str, name: str, number: int, label: str) -> Response:
+        pr = self.pulls.get((f'{owner}/{name}', number))
+        if pr is None or label not in pr.labels:
+            return _error(404, 'Label does not exist')
+        pr.labels.remove(label)
+        return _json([dict(name=x) for x in pr.labels])
+
+    async def _list_check_runs(self, request: Request, owner: str, name: str, ref: str) -> Response:
+        runs = self.check_runs.get((f'{owner}/{name}', ref), [])
+        return self._page(request, runs, items_key='check_runs')
+
+    async def _create_check_run(self, request: Request, owner: str, name: str) -> Response:
+        body = json.loads(await request.body())
+        run = dict(
+            id=self._next_id(),
+            name=body['name'],
+            head_sha=body['head_sha'],
+            status=body.get('status', 'queued'),
+            conclusion=body.get('conclusion'),
+        )
+        self.check_runs.setdefault((f'{owner}/{name}', run['head_sha']), []).append(run)
+        return _json(run, status=201)
+
+    async def _get_ref(self, request: Request, owner: str, name: str, branch: str) -> Response:
+        sha = self.refs.get((f'{owner}/{name}', branch))
+        if sha is None:
+            return _error(404, 'Not Found')
+        return _json(
+            dict(ref=f'refs/heads/{branch}', object=dict(sha=sha, type='commit')), request=request
+        )
+
+    async def _create_ref(self, request: Request, owner: str, name: str) -> Response:
+        body = json.loads(await request.body())
+        branch = body['ref'].removeprefix('refs/heads/')
+        if (f'{owner}/{name}', branch) in self.refs:
+            return _error(422, 'Reference already exists')
+        self.refs[f'{owner}/{name}', branch] = body['sha']
+        return _json(dict(ref=body['ref'], object=dict(sha=body['sha'])), status=201)
+
+    async def _update_ref(self, request: Request, owner: str, name: str, branch: str) -> Response:
+        body = json.loads(await request.body())
+        repo = f'{owner}/{name}'
+        current = self.refs.get((repo, branch))
+        if current is None:
+            return _error(422, 'Reference does not exist')
+        if not body.get('force') and not self.is_ancestor(current, body['sha']):
+            return _error(422, 'Update is not a fast forward')
+        self.refs[repo, branch] = body['sha']
+        # like github, pull requests whose head made it into their base are merged
+        for pr in self.pulls.values():
+            if (pr.repo, pr.base_ref, pr.state) == (repo, branch, 'open') and self.is_ancestor(
+                pr.head_sha, body['sha']
+            ):
+                pr.state, pr.merged = 'closed', True
+        return _json(dict(ref=f'refs/heads/{branch}', object=dict(sha=body['sha'])))
+
+    async def _delete_ref(self, owner: str, name: str, branch: str) -> Response:
+        if self.refs.pop((f'{owner}/{name}', branch), None) is None:
+            return _error(422, 'Reference does not exist')
+        return Response(status_code=204)
+
+    async def _merge(self, request: Request, owner: str, name: str) -> Response:
+        body = json.loads(await request.body())
+        repo = f'{owner}/{name}'
+        base = self.refs.get((repo, body['base']))
+        if base is None:
+            return _error(404, 'Base does not exist')
+        head = self.refs.get((repo, body['head']), body['head'])
+        if self.is_ancestor(head, base):
+            return Response(status_code=204)
+        if (repo, head) in self.conflicts:
+            return _error(409, 'Merge conflict')
+        sha = hashlib.sha1(f'{base}+{head}'.encode()).hexdigest()  # noqa: S324
+        self.commits[sha] = (base, head)
+        self.refs[repo, body['base']] = sha
+        return _json(dict(sha=sha, commit=dict(message=body.get('commit_message', ''))), status=201)
+
+    async def _required_checks(
+        self, request: Request, owner: str, name: str, branch: str
+    ) -> Response:
+        checks = self.protection.get((f'{owner}/{name}', branch))
+        if checks is None:
+            return _error(404, 'Branch not protected')
+        return _json(
+            dict(strict=False, contexts=checks, checks=[dict(context=c) for c in checks]),
+            request=request,
+        )
+
+    async def _graphql(self, request: Request) -> Response:
+        body = json.loads(await request.body())
+        query, variables = body['query'], body.get('variables') or {}
+        repos = REPO_QUERY.findall(query)
+        if not repos:
+            return _json(dict(errors=[dict(message='fake github does not know this query')]))
+        data: dict[str, Any] = {}
+        errors = []
+        for alias, owner_var, name_var, prs in repos:
+            repo = f'{variables[owner_var]}/{variables[name_var]}'
+            data[alias] = {}
+            for pr_alias, number in PR_QUERY.findall(prs):
+                pr = self.pulls.get((repo, int(number)))
+                data[alias][pr_alias] = _graphql_node(pr) if pr else None
+                if pr is None:
+                    msg = f'Could not resolve to a PullRequest with the number of {number}.'
+                    errors.append(dict(type='NOT_FOUND', path=[alias, pr_alias], message=msg))
+        return _json(dict(data=data, errors=errors) if errors else dict(data=data))
+
+    def _page(
+        self, request: Request, items: list[dict[str, Any]], items_key: str | None = None
+    ) -> Response:
+        per_page = int(request.query_params.get('per_page', self.per_page))
+        page = int(request.query_params.get('page', 1))
+        last = max(1, -(-len(items) // per_page))
+        chunk = items[(page - 1) * per_page : page * per_page]
+        links = []
+        if page < last:
+            links.append(f'<{request.url.include_query_params(page=page + 1)}>; rel="next"')
+            links.append(f'<{request.url.include_query_params(page=last)}>; rel="last"')
+        content: Any = {'total_count': len(items), items_key: chunk} if items_key else chunk
+        r = _json(content, request=request)
+        if links and r.status_code == httpx.codes.OK:
+            r.headers['link'] = ', '.join(links)
+        return r
+
+    def _next_id(self) -> int:
+        self._ids += 1
+        return self._ids
+
+
+def _json(content: Any, *, status: int = 200, request: Request | None = None) -> Response:  # noqa: ANN401
+    """JSON response; with `request` of a GET, it gets an ETag and 304 if it is still current."""
+    body = json.dumps(content).encode()
+    if request is None or request.method != 'GET':
+        return Response(body, status_code=status, media_type='application/json')
+    etag = f'"{hashlib.sha1(body).hexdigest()}"'  # noqa: S324
+    if request.headers.get('if-none-match') == etag:
+        return Response(status_code=304, headers=dict(etag=etag))
+    return Response(
+        body, status_code=status, media_type='application/json', headers=dict(etag=etag)
+    )
+
+
+def _error(status: int, message: str) -> Response:
+    return _json(dict(message=message), status=status)
+
+
+def _graphql_node(pr: FakePull) -> dict[str, Any]:
+    approved = all(state == 'APPROVED' for state in pr.reviews.values())
+    return dict(
+        number=pr.number,
+        state='MERGED' if pr.merged else pr.state.upper(),
+        isDraft=pr.draft,
+        headRefOid=pr.head_sha,
+        mergeable='MERGEABLE',
+        mergeStateStatus='CLEAN',
+        reviewDecision=('APPROVED' if approved else 'CHANGES_REQUESTED') if pr.reviews else None,
+        latestReviews=dict(
+            nodes=[dict(state=s, author=dict(login=who)) for who, s in pr.reviews.items()]
+        ),
+        commits=dict(nodes=[dict(commit=dict(statusCheckRollup=None))]),
+    )
+
+
+def main() -> None:
+    p = ArgumentParser()
+    _ = p.add_argument('--host', default='127.0.0.1')
+    _ = p.add_argument('--port', type=int, default=8765)
+    _ = p.add_argument('--latency', type=float, default=0.0, help='seconds per response')
+    _ = p.add_argument('--jitter', type=float, default=0.0, help='random extra seconds')
+    _ = p.add_argument('--error-rate', type=float, default=0.0, help='share of 502s')
+    _ = p.add_argument('--ratelimit', type=int, default=5000, help='requests per hour')
+    _ = p.add_argument('--pulls', type=int, default=100, help='open pull requests in octo/repo')
+    args = p.parse_args()
+
+    fake = FakeGithub(
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        ratelimit=args.ratelimit,
+    )
+    for n in range(1, args.pulls + 1):
+        _ = fake.add_pull('octo/repo', n)
+    uvicorn.run(fake.app, host=args.host, port=args.port)
+
+
+if __name__ == '__main__':
+    main()
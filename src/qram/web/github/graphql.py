@@ -0,0 +1,227 @@
+import asyncio
+import logging
+import re
+from collections.abc import Awaitable, Callable, Mapping
+from dataclasses import dataclass
+from typing import Any
+
+logger = logging.getLogger(__name__)
+
+# Github GraphQL API lets one query fetch what would take several REST calls per pull request.
+# https://docs.github.com/en/graphql/overview/rate-limits-and-query-limits-for-the-graphql-api
+
+type GraphQLQuery = Callable[[str, dict[str, Any]], Awaitable[dict[str, Any]]]
+# repository as 'owner/name', and pull request number
+type PullRequestKey = tuple[str, int]
+
+REVIEWS_PER_PR = 50
+CHECKS_PER_PR = 100
+# github refuses queries over 500k nodes; stay well below, a response that big is slow anyway
+MAX_NODES_PER_QUERY = 50_000
+# upper bound of nodes a single pull request adds to a query: itself, its reviews,
+# last commit and check contexts of that commit
+PR_NODES = 1 + REVIEWS_PER_PR + 1 + CHECKS_PER_PR
+
+PR_FRAGMENT = f"""
+fragment PullRequestStatus on PullRequest {{
+  number
+  state
+  isDraft
+  headRefOid
+  mergeable
+  mergeStateStatus
+  reviewDecision
+  latestReviews(first: {REVIEWS_PER_PR}) {{
+    nodes {{ state author {{ login }} }}
+  }}
+  commits(last: 1) {{
+    nodes {{
+      commit {{
+        statusCheckRollup {{
+          state
+          contexts(first: {CHECKS_PER_PR}) {{
+            nodes {{
+              __typename
+              ... on CheckRun {{ name status conclusion }}
+              ... on StatusContext {{ context state }}
+            }}
+          }}
+        }}
+      }}
+    }}
+  }}
+}}
+"""
+
+
+class GraphQLError(Exception):
+    pass
+
+
+def is_read_only(document: str) -> bool:
+    """Whether a document has no mutations, so that sending it again changes nothing."""
+    # operations are at top level, fields of the same name are nested in braces
+    depth = 0
+    for m in re.finditer(r'[{}]|\bmutation\b', document):
+        match m[0]:
+            case '{':
+                depth += 1
+            case '}':
+                depth -= 1
+            case _ if depth == 0:
+                return False
+    return True
+
+
+@dataclass(frozen=True, slots=True)
+class PullRequestStatus:
+    """What decides whether a pull request can be merged, as of one query."""
+
+    repo: str
+    number: int
+    state: str
+    draft: bool
+    head_sha: str
+    # MERGEABLE, CONFLICTING or UNKNOWN while github is still computing it
+    mergeable: str
+    merge_state: str
+    # APPROVED, CHANGES_REQUESTED, REVIEW_REQUIRED, or None if reviews are not required
+    review_decision: str | None
+    approved_by: tuple[str, ...]
+    changes_requested_by: tuple[str, ...]
+    # combined state of all checks and statuses of head commit; None if there are none
+    checks_state: str | None
+    # check name or status context -> its conclusion, or its state while it is not done
+    checks: Mapping[str, str]
+
+    @classmethod
+    def from_node(cls, repo: str, node: dict[str, Any]) -> PullRequestStatus:
+        reviews = node['latestReviews']['nodes']
+        rollup = None
+        if commits := node['commits']['nodes']:
+            rollup = commits[0]['commit']['statusCheckRollup']
+        checks: dict[str, str] = {}
+        for c in rollup['contexts']['nodes'] if rollup else ():
+            if c['__typename'] == 'CheckRun':
+                checks[c['name']] = c['conclusion'] or c['status']
+            else:
+                checks[c['context']] = c['state']
+        return cls(
+            repo=repo,
+            number=node['number'],
+            state=node['state'],
+            draft=node['isDraft'],
+            head_sha=node['headRefOid'],
+            mergeable=node['mergeable'],
+            merge_state=node['mergeStateStatus'],
+            review_decision=node['reviewDecision'],
+            approved_by=_review_authors(reviews, 'APPROVED'),
+            changes_requested_by=_review_authors(reviews, 'CHANGES_REQUESTED'),
+            checks_state=rollup['state'] if rollup else None,
+            checks=checks,
+        )
+
+
+class PullRequestLoader:
+    """Coalesces pull request lookups made within one event loop tick into batched queries.
+
+    Every `load` made before the loop gets around to the scheduled dispatch joins the same
+    batch; lookups of the same pull request share the result. Batch is split so that no query
+    exceeds `max_nodes` by estimate.
+    """
+
+    query: GraphQLQuery
+    max_nodes: int
+    queries: int
+    loaded: int
+    _pending: dict[PullRequestKey, asyncio.Future[PullRequestStatus]]
+    _tasks: set[asyncio.Task[None]]
+
+    def __init__(self, query: GraphQLQuery, max_nodes: int = MAX_NODES_PER_QUERY) -> None:
+        self.query = query
+        self.max_nodes = max_nodes
+        self.queries = 0
+        self.loaded = 0
+        self._pending = {}
+        self._tasks = set()
+
+    def load(self, repo: str, number: int) -> asyncio.Future[PullRequestStatus]:
+        key = (repo, number)
+        if (future := self._pending.get(key)) is not None:
+            return future
+        loop = asyncio.get_running_loop()
+        if not self._pending:
+            _ = loop.call_soon(self._dispatch)
+        future = self._pending[key] = loop.create_future()
+        return future
+
+    def _dispatch(self) -> None:
+        pending, self._pending = self._pending, {}
+        per_query = max(self.max_nodes // PR_NODES, 1)
+        keys = list(pending)
+        for i in range(0, len(keys), per_query):
+            batch = {k: pending[k] for k in keys[i : i + per_query]}
+            task = asyncio.create_task(self._fetch(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _fetch(self, batch: dict[PullRequestKey, asyncio.Future[PullRequestStatus]]) -> None:
+        query, variables, aliases = build_query(list(batch))
+        self.queries += 1
+        try:
+            data = await self.query(query, variables)
+        except Exception as e:
+            for future in batch.values():
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for key, future in batch.items():
+            if future.done():
+                # cancelled by whoever was waiting for it
+                continue
+            repo_alias, pr_alias = aliases[key]
+            node = (data.get(repo_alias) or {}).get(pr_alias)
+            if node is None:
+                future.set_exception(GraphQLError(f'pull request {key[0]}#{key[1]} not found'))
+                continue
+            try:
+                future.set_result(PullRequestStatus.from_node(key[0], node))
+            except (KeyError, TypeError) as e:
+                future.set_exception(GraphQLError(f'unexpected pull request data: {e}'))
+                continue
+            self.loaded += 1
+
+
+def build_query(
+    keys: list[PullRequestKey],
+) -> tuple[str, dict[str, Any], dict[PullRequestKey, tuple[str, str]]]:
+    """Aliased query for all of `keys`, with pull requests grouped under their repository.
+
+    Returns query, its variables and (repository alias, pull request alias) of every key.
+    """
+    by_repo: dict[str, list[int]] = {}
+    for repo, number in keys:
+        by_repo.setdefault(repo, []).append(number)
+
+    params: list[str] = []
+    fields: list[str] = []
+    variables: dict[str, Any] = {}
+    aliases: dict[PullRequestKey, tuple[str, str]] = {}
+    for i, (repo, numbers) in enumerate(by_repo.items()):
+        owner, name = repo.split('/', 1)
+        variables[f'o{i}'], variables[f'n{i}'] = owner, name
+        params.append(f'$o{i}: String!, $n{i}: String!')
+        prs = []
+        for number in numbers:
+            alias = f'pr{number}'
+            aliases[repo, number] = (f'r{i}', alias)
+            prs.append(f'{alias}: pullRequest(number: {number}) {{ ...PullRequestStatus }}')
+        fields.append(f'r{i}: repository(owner: $o{i}, name: $n{i}) {{ {" ".join(prs)} }}')
+
+    query = f'query({", ".join(params)}) {{ {" ".join(fields)} }}\n{PR_FRAGMENT}'
+    return query, variables, aliases
+
+
+def _review_authors(reviews: list[dict[str, Any]], state: str) -> tuple[str, ...]:
+    # author is null for deleted accounts
+    return tuple(r['author']['login'] for r in reviews if r['state'] == state and r['author'])
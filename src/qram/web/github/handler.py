@@ -1,16 +1,50 @@
 import hashlib
 import hmac
 import logging
-from typing import Any, cast, override
+import time
+from functools import partial
+from typing import TYPE_CHECKING, Any, cast, override
 
+import httpx
 from fastapi import Request
 from fastapi.responses import JSONResponse
 
 from qram.config import AppConfig, CfgGithub
-from qram.web import WebhookHandlerBase, get_cors_headers
+from qram.metrics import FAST_BUCKETS, REGISTRY
+from qram.web import WebhookHandlerBase, codec, get_cors_headers
+from qram.web.coalesce import Coalescer
+from qram.web.codec import FastJSONResponse
+from qram.web.dedup import DeliveryDedup
+from qram.web.github.cache import ResponseCache
+from qram.web.github.events import EVENT_TYPES, GithubEvent, coalescing_key, parse_event
+from qram.web.queue import WorkQueue
+from qram.web.spool import SpoolEntry, WebhookSpool
+
+if TYPE_CHECKING:
+    # qram.mq consumes events defined in this package
+    from qram.mq import MergeQueue, PullIndex
 
 logger = logging.getLogger(__name__)
 
+WEBHOOK_REQUESTS = REGISTRY.counter(
+    'qram_webhook_requests_total',
+    'Webhook deliveries received, by event type and response status.',
+    ('event', 'status'),
+)
+SIGNATURE_SECONDS = REGISTRY.histogram(
+    'qram_webhook_signature_seconds',
+    'CPU time spent on hashing and verifying webhook signatures.',
+    buckets=FAST_BUCKETS,
+)
+DECODE_SECONDS = REGISTRY.histogram(
+    'qram_webhook_decode_seconds',
+    'Time spent on decoding webhook JSON payloads.',
+    buckets=FAST_BUCKETS,
+)
+
+
+type Delivery = tuple[GithubEvent, int | None]
+
 
 class InvalidPayloadError(Exception):
     pass
@@ -18,10 +52,51 @@ class InvalidPayloadError(Exception):
 
 class GithubWebhookHandler(WebhookHandlerBase):
     app_config: AppConfig
+    queue: WorkQueue
+    spool: WebhookSpool | None
+    dedup: DeliveryDedup | None
+    # github API responses that events make stale
+    cache: ResponseCache | None
+    merge_queue: MergeQueue | None
+    # state of pull requests, kept current with every event
+    index: PullIndex | None
+    # events with their spool entry ids, held back for a burst about the same thing to end
+    coalescer: Coalescer[Delivery] | None
+    hmac_key: bytes
+    _cors_headers: dict[str, str]
+    # keyed once; copied per request instead of re-deriving the key pads every time
+    _mac: hmac.HMAC
 
-    def __init__(self, cfg: AppConfig) -> None:
+    def __init__(  # noqa: PLR0913
+        self,
+        cfg: AppConfig,
+        queue: WorkQueue,
+        spool: WebhookSpool | None = None,
+        dedup: DeliveryDedup | None = None,
+        cache: ResponseCache | None = None,
+        *,
+        merge_queue: MergeQueue | None = None,
+        index: PullIndex | None = None,
+    ) -> None:
         assert cfg.github, 'github config must be set'
         self.app_config = cfg
+        self.queue = queue
+        self.spool = spool
+        self.dedup = dedup
+        self.cache = cache
+        self.merge_queue = merge_queue
+        self.index = index
+        self.coalescer = None
+        if cfg.coalesce.window > 0:
+            self.coalescer = Coalescer(
+                cfg.coalesce.window, cfg.coalesce.max_delay, self.release, self.superseded
+            )
+        # handler lives as long as the app, so anything derived from config is computed once
+        self.hmac_key = cfg.github.hmac.encode('utf-8')
+        self._mac = hmac.new(self.hmac_key, digestmod=hashlib.sha256)
+        self._cors_headers = get_cors_headers(
+            cfg.cors_origin, additional_headers=['x-hub-signature-256']
+        )
 
     @property
     def github_config(self) -> CfgGithub:
@@ -30,40 +105,212 @@ class GithubWebhookHandler(WebhookHandlerBase):
 
     @override
     def get_cors_headers(self) -> dict[str, str]:
-        return get_cors_headers(
-            self.app_config.cors_origin, additional_headers=['x-hub-signature-256']
-        )
+        return self._cors_headers
 
     @override
     async def handle(self, request: Request) -> JSONResponse:
-        body = await request.body()
-        verify_resp = self.verify_signature(request, body)
-        if verify_resp:
-            return verify_resp
+        response = await self.handle_delivery(request)
+        event = request.headers.get('x-github-event')
+        # anyone can send any header, and each label value is a separate series
+        label = event if event in EVENT_TYPES else 'other'
+        WEBHOOK_REQUESTS.inc(label, str(response.status_code))
+        return response
+
+    async def handle_delivery(self, request: Request) -> JSONResponse:
+        body = await self.read_verified_body(request)
+        if isinstance(body, JSONResponse):
+            return body
 
         headers = self.get_cors_headers()
 
+        event_name = request.headers.get('x-github-event')
+        if not event_name:
+            msg = 'missing X-GitHub-Event header'
+            logger.info(msg)
+            return FastJSONResponse(status_code=400, content=dict(error=msg), headers=headers)
+        if event_name not in EVENT_TYPES:
+            # still a success for github: it is us who are not interested
+            logger.debug(f'ignoring unsupported event: {event_name}')
+            return FastJSONResponse(status_code=200, content='ignored', headers=headers)
+
+        delivery = request.headers.get('x-github-delivery')
+        if delivery and self.dedup is not None and self.dedup.check(delivery):
+            logger.info(f'delivery {delivery} already accepted; skipping')
+            return FastJSONResponse(status_code=200, content='OK', headers=headers)
+
         try:
-            payload = await self.verify_json_payload(request)
+            response = await self.accept(request, event_name, body, delivery)
+        except BaseException:
+            self.unsee(delivery)
+            raise
+        if response.status_code == httpx.codes.BAD_REQUEST:
+            self.unsee(delivery)
+        return response
+
+    def unsee(self, delivery: str | None) -> None:
+        """Forget a delivery that was not accepted after all, so its redelivery is not skipped."""
+        if delivery and self.dedup is not None:
+            self.dedup.forget(delivery)
+        if delivery and self.spool:
+            # accepted ones are remembered there too, for deduplication after a restart
+            self.spool.forget(delivery)
+
+    async def accept(
+        self, request: Request, event_name: str, body: bytes, delivery: str | None
+    ) -> JSONResponse:
+        """Spool a delivery seen for the first time and pass it on to be processed."""
+        headers = self.get_cors_headers()
+        try:
+            event = self.parse_payload(event_name, body)
         except Exception as e:
             msg = f'could not parse JSON body: {e}'
             logger.info(msg)
-            return JSONResponse(status_code=400, content=dict(error=msg), headers=headers)
+            return FastJSONResponse(status_code=400, content=dict(error=msg), headers=headers)
+
+        if self.cache is not None:
+            # right away, so that no request made after ack gets a stale copy
+            _ = self.cache.invalidate_event(event)
+
+        entry_id = None
+        if self.spool:
+            # must hit the disk before we ack, or a crash loses the delivery for good
+            entry_id = await self.spool.append(dict(request.headers), body, delivery=delivery)
+        # acknowledge right away; github gives up on deliveries after 10 seconds
+        if not self.dispatch(event, entry_id):
+            return self.queue_full(entry_id, delivery)
+        return FastJSONResponse(status_code=200, content='OK', headers=headers)
+
+    def dispatch(self, event: GithubEvent, entry_id: int | None) -> bool:
+        """Pass an accepted delivery on to be processed; False if there is no room for it."""
+        key = coalescing_key(event)
+        if self.coalescer is None or key is None:
+            return self.queue.submit(partial(self.process_entry, event, entry_id))
+        if self.queue.depth >= self.queue.max_size:
+            return False
+        self.coalescer.add(*key, (event, entry_id))
+        return True
+
+    def queue_full(self, entry_id: int | None, delivery: str | None) -> JSONResponse:
+        msg = 'webhook queue is full; try again later'
+        logger.warning(msg)
+        if self.spool and entry_id is not None:
+            # github is told to redeliver, so this copy must not be replayed
+            self.spool.mark_done(entry_id)
+        # ...and redelivery must not be mistaken for a duplicate
+        self.unsee(delivery)
+        retry_after = str(self.app_config.queue.retry_after)
+        return FastJSONResponse(
+            status_code=503,
+            content=dict(error=msg),
+            headers={**self.get_cors_headers(), 'Retry-After': retry_after},
+        )
+
+    async def release(self, deliveries: list[Delivery]) -> None:
+        """Queue coalesced deliveries; waits for room, as they have been acked long ago."""
+        for event, entry_id in deliveries:
+            await self.queue.put(partial(self.process_entry, event, entry_id))
 
-        logger.debug(f'github webhook payload: {payload}')
-        self.process_payload(payload)
-        return JSONResponse(status_code=200, content='OK', headers=headers)
+    def superseded(self, delivery: Delivery) -> None:
+        _, entry_id = delivery
+        # a later delivery tells all it did
+        if self.spool and entry_id is not None:
+            self.spool.mark_done(entry_id)
 
-    def process_payload(self, payload: dict[str, Any]) -> None:
-        pass
+    @override
+    async def flush(self) -> None:
+        if self.coalescer is not None:
+            await self.coalescer.flush()
+
+    async def process_entry(self, event: GithubEvent, entry_id: int | None) -> None:
+        try:
+            await self.process_payload(event)
+        finally:
+            # failed deliveries are not retried on restart either; they would likely fail again
+            if self.spool and entry_id is not None:
+                self.spool.mark_done(entry_id)
+
+    async def process_payload(self, event: GithubEvent) -> None:
+        if self.index is not None:
+            # first, so that whatever reacts to the event sees it reflected there
+            self.index.apply(event)
+        if self.merge_queue is not None:
+            await self.merge_queue.handle(event)
+
+    @override
+    async def replay(self, entries: list[SpoolEntry]) -> None:
+        """Requeue spooled deliveries that were acked but not processed before last shutdown."""
+        logger.info(f'replaying {len(entries)} spooled webhook deliveries')
+        for entry in entries:
+            try:
+                event = self.parse_payload(entry.headers['x-github-event'], entry.body)
+            except Exception:
+                logger.exception(f'spooled delivery {entry.id} is unreadable; dropping it')
+                if self.spool:
+                    self.spool.mark_done(entry.id)
+                continue
+            await self.queue.put(partial(self.process_entry, event, entry.id))
+
+    def parse_payload(self, event_name: str, body: bytes) -> GithubEvent:
+        # decode the very bytes that were verified instead of reading request again
+        payload = self.verify_json_payload(body)
+        if logger.isEnabledFor(logging.DEBUG):
+            # formatting a 200KB payload is not free, even if the record is then dropped
+            logger.debug(f'github webhook payload: {payload}')
+        try:
+            return parse_event(event_name, payload)
+        except (KeyError, TypeError) as e:
+            msg = f'{event_name} payload lacks expected field: {e}'
+            raise InvalidPayloadError(msg) from e
+
+    async def read_verified_body(self, request: Request) -> bytes | JSONResponse:
+        """Read request body, hashing it as it streams in, and verify X-Hub-Signature-256.
+
+        Returns the body, or a JSONResponse on failure. Bodies over the configured size limit
+        are rejected as soon as that becomes known, without buffering the rest.
+        """
+        sig_hex = self.parse_signature_header(request)
+        if isinstance(sig_hex, JSONResponse):
+            return sig_hex
+
+        max_size = self.app_config.max_body_size
+        length = request.headers.get('content-length', '')
+        if length.isdigit() and int(length) > max_size:
+            return self.body_too_large(max_size)
+
+        mac = self._mac.copy()
+        chunks: list[bytes] = []
+        size = 0
+        hashing = 0.0
+        async for chunk in request.stream():
+            size += len(chunk)
+            if size > max_size:
+                return self.body_too_large(max_size)
+            t = time.perf_counter()
+            mac.update(chunk)
+            hashing += time.perf_counter() - t
+            chunks.append(chunk)
+
+        t = time.perf_counter()
+        denied = self.verify_digest(mac, sig_hex)
+        SIGNATURE_SECONDS.observe(hashing + time.perf_counter() - t)
+        if denied:
+            return denied
+        return b''.join(chunks)
 
     def verify_signature(self, request: Request, body: bytes) -> JSONResponse | None:
-        """Verify the GitHub X-Hub-Signature-256 header.
+        """Verify the GitHub X-Hub-Signature-256 header against already read body.
 
         Returns a JSONResponse on failure, or None on success.
         """
-        assert self.app_config.github
+        sig_hex = self.parse_signature_header(request)
+        if isinstance(sig_hex, JSONResponse):
+            return sig_hex
+        mac = self._mac.copy()
+        mac.update(body)
+        return self.verify_digest(mac, sig_hex)
 
+    def parse_signature_header(self, request: Request) -> str | JSONResponse:
+        """Return hex digest from X-Hub-Signature-256 header, or a JSONResponse on failure."""
         signature = request.headers.get('x-hub-signature-256')
 
         if not signature:
@@ -83,23 +330,31 @@ class GithubWebhookHandler(WebhookHandlerBase):
             logger.info(msg)
             return self.deny_request(msg)
 
-        mac = hmac.new(
-            self.app_config.github.hmac.encode('utf-8'), msg=body, digestmod=hashlib.sha256
-        )
+        return sig_hex
+
+    def verify_digest(self, mac: hmac.HMAC, sig_hex: str) -> JSONResponse | None:
         expected = mac.hexdigest()
         if not hmac.compare_digest(expected, sig_hex):
             msg = 'request denied; content does not match X-Hub-Signature-256'
             logger.info(msg)
             return self.deny_request(msg)
-
         return None
 
-    async def verify_json_payload(self, request: Request) -> dict[str, Any]:
+    def body_too_large(self, max_size: int) -> JSONResponse:
+        msg = f'request denied; body exceeds {max_size} bytes'
+        logger.info(msg)
+        return FastJSONResponse(
+            status_code=413, content=dict(error=msg), headers=self.get_cors_headers()
+        )
+
+    def verify_json_payload(self, body: bytes) -> dict[str, Any]:
+        t = time.perf_counter()
         try:
-            payload = await request.json()
+            payload = codec.loads(body)
         except Exception as e:
             msg = f'failed to parse JSON payload: {e}'
             raise InvalidPayloadError(msg) from e
+        DECODE_SECONDS.observe(time.perf_counter() - t)
         if not payload:
             msg = 'empty payload'
             raise InvalidPayloadError(msg)
@@ -114,6 +369,6 @@ class GithubWebhookHandler(WebhookHandlerBase):
         return p
 
     def deny_request(self, msg: str) -> JSONResponse:
-        return JSONResponse(
+        return FastJSONResponse(
             status_code=401, content=dict(error=msg), headers=self.get_cors_headers()
         )
@@ -0,0 +1,176 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+
+from httpx import Response
+
+logger = logging.getLogger(__name__)
+
+# Github API budget is counted per resource; every response reports what is left of it.
+# https://docs.github.com/en/rest/using-the-rest-api/rate-limits-for-the-rest-api
+
+# how many requests may go out back to back before pacing kicks in
+RATE_LIMIT_BURST = 10
+# share of the budget that reads leave to mutations
+MUTATION_RESERVE = 0.1
+# ""wait for at least one minute before retrying"", when secondary limit gives no Retry-After
+SECONDARY_LIMIT_BACKOFF = 60
+# waits are re-evaluated at least this often, in case a response in between changed the budget
+MAX_SLEEP = 1.0
+# how often reads check whether mutations that are ahead of them have gone out
+PRIORITY_POLL = 0.05
+
+SAFE_METHODS = frozenset(('GET', 'HEAD', 'OPTIONS'))
+
+
+@dataclass(slots=True)
+class RateLimitBucket:
+    """What is known about one resource budget, plus a token bucket pacing requests against it.
+
+    The token bucket refills at the rate that spreads the remaining budget evenly until reset,
+    so a burst cannot use up an hour's worth of requests in a minute.
+    """
+
+    name: str
+    # unknown until first response in this bucket
+    limit: int | None = None
+    remaining: int | None = None
+    # wall-clock time the budget is restored
+    reset: float = 0
+    # nothing goes out until then: Retry-After, exhausted or secondary limit
+    blocked_until: float = 0
+    tokens: float = RATE_LIMIT_BURST
+    refilled_at: float = 0
+    waiting_mutations: int = 0
+    # counters, for metrics
+    sent: int = 0
+    throttled: int = 0
+    rate_limited: int = 0
+
+    def delay(self, now: float, *, mutation: bool) -> float:
+        """Seconds to wait before sending a request; 0 or less means go ahead."""
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        if self.remaining is None or now >= self.reset:
+            # nothing known, or budget is already restored
+            return 0
+        if not mutation:
+            if self.waiting_mutations:
+                return PRIORITY_POLL
+            if self.remaining <= self.reserve():
+                return self.reset - now
+        if self.remaining <= 0:
+            return self.reset - now
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self._rate(now)
+
+    def take(self, now: float) -> None:
+        self.sent += 1
+        if self.remaining is not None and now < self.reset:
+            # local estimate until the response brings the real figure
+            self.remaining -= 1
+            self.tokens -= 1
+
+    def reserve(self) -> int:
+        return int((self.limit or 0) * MUTATION_RESERVE)
+
+    def _rate(self, now: float) -> float:
+        return max(self.remaining or 0, 1) / max(self.reset - now, 1)
+
+    def _refill(self, now: float) -> None:
+        burst = min(RATE_LIMIT_BURST, self.remaining or 0)
+        self.tokens = min(burst, self.tokens + (now - self.refilled_at) * self._rate(now))
+        self.refilled_at = now
+
+
+class RateLimitScheduler:
+    """Paces github API requests by what response headers say is left of each budget."""
+
+    buckets: dict[str, RateLimitBucket]
+
+    def __init__(self) -> None:
+        self.buckets = {}
+
+    def bucket(self, resource: str) -> RateLimitBucket:
+        b = self.buckets.get(resource)
+        if b is None:
+            b = self.buckets[resource] = RateLimitBucket(resource)
+        return b
+
+    async def acquire(self, resource: str, *, mutation: bool) -> None:
+        """Wait until a request to `resource` may go out; mutations jump ahead of reads."""
+        b = self.bucket(resource)
+        if mutation:
+            b.waiting_mutations += 1
+        try:
+            throttled = False
+            while (delay := b.delay(time.time(), mutation=mutation)) > 0:
+                if not throttled:
+                    throttled = True
+                    b.throttled += 1
+                    logger.debug(f'github {resource} rate limit: waiting {delay:.2f}s')
+                await asyncio.sleep(min(delay, MAX_SLEEP))
+            b.take(time.time())
+        finally:
+            if mutation:
+                b.waiting_mutations -= 1
+
+    def update(self, resource: str, r: Response, now: float | None = None) -> None:
+        """Record budget reported by response to a request that was sent to `resource`."""
+        now = time.time() if now is None else now
+        h = r.headers
+        b = self.bucket(h.get('x-ratelimit-resource', resource))
+        remaining = h.get('x-ratelimit-remaining')
+        if remaining is not None and remaining.isdigit():
+            b.remaining = int(remaining)
+            b.limit = int(h.get('x-ratelimit-limit') or remaining)
+            b.reset = float(h.get('x-ratelimit-reset') or now)
+
+        if r.status_code not in (403, 429):
+            return
+        retry_after = h.get('retry-after', '')
+        if retry_after.isdigit():
+            until = now + int(retry_after)
+        elif b.remaining == 0:
+            until = b.reset
+        elif 'secondary rate limit' in r.text.lower():
+            until = now + SECONDARY_LIMIT_BACKOFF
+        else:
+            # plain permission error
+            return
+        b.rate_limited += 1
+        b.blocked_until = max(b.blocked_until, until)
+        logger.warning(f'github {b.name} rate limit hit; holding requests for {until - now:.0f}s')
+
+    def snapshot(self) -> dict[str, dict[str, float | None]]:
+        """Current budget and counters per bucket."""
+        return {
+            name: dict(
+                limit=b.limit,
+                remaining=b.remaining,
+                reset=b.reset,
+                blocked_until=b.blocked_until,
+                waiting_mutations=b.waiting_mutations,
+                sent=b.sent,
+                throttled=b.throttled,
+                rate_limited=b.rate_limited,
+            )
+            for name, b in self.buckets.items()
+        }
+
+
+def resource_for(destination: str) -> str:
+    """Guess the budget a request draws from; response tells the real one."""
+    destination = destination.lstrip('/')
+    if destination == 'graphql':
+        return 'graphql'
+    if destination.startswith('search/'):
+        return 'search'
+    return 'core'
+
+
+def is_mutation(method: str) -> bool:
+    return method.upper() not in SAFE_METHODS
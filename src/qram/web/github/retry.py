@@ -0,0 +1,208 @@
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass
+
+import httpx
+from httpx import Response
+
+from qram.config import CfgRetry
+
+logger = logging.getLogger(__name__)
+
+type Send = Callable[[], Awaitable[Response]]
+
+# requests that can be repeated without changing the outcome
+IDEMPOTENT_METHODS = frozenset(('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'))
+# failures where request most likely did not reach github, or github did not get to process it
+TRANSIENT_ERRORS = (
+    httpx.ConnectError,
+    httpx.ConnectTimeout,
+    httpx.ReadError,
+    httpx.WriteError,
+    httpx.RemoteProtocolError,
+)
+# GET latencies kept for hedging; no hedging until there are this many
+LATENCY_WINDOW = 200
+LATENCY_MIN_SAMPLES = 20
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+@dataclass(slots=True)
+class CircuitBreaker:
+    """Fails calls fast after `threshold` consecutive failures, for `reset_after` seconds.
+
+    Then lets a single probe through: its success closes the circuit, failure opens it again.
+    """
+
+    threshold: int
+    reset_after: float
+    failures: int = 0
+    opened_at: float | None = None
+    probing: bool = False
+    # counters, for metrics
+    opened: int = 0
+    rejected: int = 0
+
+    @property
+    def is_open(self) -> bool:
+        return self.opened_at is not None
+
+    def allow(self, now: float | None = None) -> bool:
+        if self.opened_at is None:
+            return True
+        now = time.monotonic() if now is None else now
+        if self.probing or now - self.opened_at < self.reset_after:
+            self.rejected += 1
+            return False
+        self.probing = True
+        return True
+
+    def record(self, *, success: bool, now: float | None = None) -> None:
+        self.probing = False
+        if success:
+            self.failures = 0
+            self.opened_at = None
+            return
+        self.failures += 1
+        if self.opened_at is not None or self.failures >= self.threshold:
+            if self.opened_at is None:
+                self.opened += 1
+                logger.warning(f'github API failed {self.failures} times in a row; failing fast')
+            self.opened_at = time.monotonic() if now is None else now
+
+
+class LatencyTracker:
+    """Rolling window of request latencies, for the delay after which GETs are hedged."""
+
+    _samples: deque[float]
+    _p95: float | None
+    _since_sorted: int
+
+    def __init__(self, window: int = LATENCY_WINDOW) -> None:
+        self._samples = deque(maxlen=window)
+        self._p95 = None
+        self._since_sorted = 0
+
+    def add(self, seconds: float) -> None:
+        self._samples.append(seconds)
+        self._since_sorted += 1
+
+    def p95(self) -> float | None:
+        if len(self._samples) < LATENCY_MIN_SAMPLES:
+            return None
+        # sorting the window on every request would cost more than hedging saves
+        if self._p95 is None or self._since_sorted >= LATENCY_MIN_SAMPLES:
+            ordered = sorted(self._samples)
+            self._p95 = ordered[int(len(ordered) * 0.95)]
+            self._since_sorted = 0
+        return self._p95
+
+
+class RetryingSender:
+    """Sends requests with retries of transient failures, hedging and a circuit breaker.
+
+    Only idempotent requests are retried: 5xx responses and errors where request most likely
+    did not get through, with jittered exponential backoff, as long as `deadline` allows.
+    Hedged GETs get a second, concurrent attempt if the first one is slower than p95 so far.
+    An attempt still running at `deadline` is cancelled, and TimeoutError raised.
+    """
+
+    policy: CfgRetry
+    breaker: CircuitBreaker
+    latency: LatencyTracker
+    retries: int
+    hedges: int
+
+    def __init__(self, policy: CfgRetry) -> None:
+        self.policy = policy
+        self.breaker = CircuitBreaker(policy.breaker_threshold, policy.breaker_reset_after)
+        self.latency = LatencyTracker()
+        self.retries = 0
+        self.hedges = 0
+
+    async def send(self, method: str, send: Send, *, idempotent: bool | None = None) -> Response:
+        if idempotent is None:
+            idempotent = method.upper() in IDEMPOTENT_METHODS
+        attempts = self.policy.attempts if idempotent else 1
+        hedge = self.policy.hedge_gets and method.upper() == 'GET'
+        deadline = time.monotonic() + self.policy.deadline
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                async with asyncio.timeout(deadline - time.monotonic()):
+                    r = await (self._hedged(send) if hedge else self._attempt(send))
+            except TRANSIENT_ERRORS as e:
+                delay = self.backoff(attempt)
+                if attempt >= attempts or time.monotonic() + delay > deadline:
+                    raise
+                logger.info(f'{method} failed with {type(e).__name__}; retry in {delay:.2f}s')
+            else:
+                if not is_transient(r):
+                    return r
+                delay = self.backoff(attempt)
+                if attempt >= attempts or time.monotonic() + delay > deadline:
+                    return r
+                logger.info(f'{method} got {r.status_code}; retry in {delay:.2f}s')
+            self.retries += 1
+            await asyncio.sleep(delay)
+
+    def backoff(self, attempt: int) -> float:
+        # full jitter: retries of many clients spread out instead of arriving in waves
+        cap = min(self.policy.max_delay, self.policy.base_delay * 2 ** (attempt - 1))
+        return random.uniform(0, cap)  # noqa: S311
+
+    async def _attempt(self, send: Send) -> Response:
+        if not self.breaker.allow():
+            msg = 'github API circuit is open after repeated failures'
+            raise CircuitOpenError(msg)
+        start = time.monotonic()
+        try:
+            r = await send()
+        except TRANSIENT_ERRORS:
+            self.breaker.record(success=False)
+            raise
+        except asyncio.CancelledError:
+            # neither success nor failure; if it was the probe, another one may go
+            self.breaker.probing = False
+            raise
+        self.breaker.record(success=not is_transient(r))
+        if r.is_success:
+            self.latency.add(time.monotonic() - start)
+        return r
+
+    async def _hedged(self, send: Send) -> Response:
+        p95 = self.latency.p95()
+        first = asyncio.create_task(self._attempt(send))
+        attempts = {first}
+        try:
+            if p95 is None:
+                return await first
+            done, _ = await asyncio.wait(attempts, timeout=p95)
+            if done:
+                return first.result()
+            self.hedges += 1
+            attempts.add(asyncio.create_task(self._attempt(send)))
+            pending = set(attempts)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    # one good answer is enough; failure only counts if both attempts fail
+                    if task.exception() is None and not is_transient(task.result()):
+                        return task.result()
+            return await first
+        finally:
+            # the slower one, or both if we are cancelled, e.g. at deadline
+            for task in attempts:
+                _ = task.cancel()
+
+
+def is_transient(r: Response) -> bool:
+    return r.status_code >= httpx.codes.INTERNAL_SERVER_ERROR
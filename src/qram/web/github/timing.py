@@ -0,0 +1,96 @@
+import re
+import time
+from collections.abc import Mapping
+from typing import Any
+
+import httpx
+
+from qram.metrics import REGISTRY
+
+# Per-phase latency of github API calls, collected by event hooks of the shared client.
+# Connection phases come from httpcore trace events, so they are only there for requests that
+# actually opened a new connection.
+
+HTTP_PHASES = REGISTRY.histogram(
+    'qram_github_http_phase_seconds',
+    'Latency of github API calls by phase: connect (DNS+TCP), tls, ttfb and total.',
+    ('phase', 'method', 'route'),
+)
+
+# request extension under which timings travel from request hook to response hook
+TIMER_EXTENSION = 'qram_timer'
+
+SHA = re.compile(r'[0-9a-f]{40}')
+# segments that follow these are names, not part of the route
+NAMED_AFTER = {
+    'users': '{owner}',
+    'orgs': '{owner}',
+    'branches': '{branch}',
+    'labels': '{label}',
+    'heads': '{branch}',
+    'compare': '{basehead}',
+    'installations': '{n}',
+}
+
+
+class PhaseTimer:
+    """Timestamps of one request; also its httpcore trace callback."""
+
+    __slots__ = ('connect', 'start', 'tls')
+
+    def __init__(self) -> None:
+        self.start = time.perf_counter()
+        self.connect: float | None = None
+        self.tls: float | None = None
+
+    async def __call__(self, event: str, info: Mapping[str, Any]) -> None:
+        _ = info
+        if event == 'connection.connect_tcp.complete':
+            self.connect = time.perf_counter() - self.start
+        elif event == 'connection.start_tls.complete':
+            self.tls = time.perf_counter() - self.start - (self.connect or 0)
+
+
+async def start_timer(request: httpx.Request) -> None:
+    timer = PhaseTimer()
+    request.extensions[TIMER_EXTENSION] = timer
+    request.extensions['trace'] = timer
+
+
+async def observe_phases(response: httpx.Response, *, api_path: str = '/') -> None:
+    request = response.request
+    timer: PhaseTimer | None = request.extensions.get(TIMER_EXTENSION)
+    if timer is None:
+        return
+    # response hook runs once headers are in, body is not read yet
+    ttfb = time.perf_counter() - timer.start
+    _ = await response.aread()
+    total = time.perf_counter() - timer.start
+
+    labels = (request.method, route_template(request.url.path, api_path))
+    if timer.connect is not None:
+        HTTP_PHASES.observe(timer.connect, 'connect', *labels)
+    if timer.tls is not None:
+        HTTP_PHASES.observe(timer.tls, 'tls', *labels)
+    HTTP_PHASES.observe(ttfb, 'ttfb', *labels)
+    HTTP_PHASES.observe(total, 'total', *labels)
+
+
+def route_template(path: str, api_path: str = '/') -> str:
+    """Replace ids and names in api path with placeholders, to keep metric labels few.
+
+    'repos/o/r/pulls/12/files' -> 'repos/{owner}/{repo}/pulls/{n}/files'
+
+    `api_path` is the path of api url, e.g. '/api/v3/' on github enterprise, and is left out.
+    """
+    parts = path.removeprefix(api_path.rstrip('/')).strip('/').split('/')
+    if parts[:1] == ['repos'] and len(parts) >= 3:  # noqa: PLR2004
+        parts[1:3] = ['{owner}', '{repo}']
+    for i, part in enumerate(parts):
+        if i and (name := NAMED_AFTER.get(parts[i - 1])):
+            parts[i] = name
+        elif part.isdigit():
+            parts[i] = '{n}'
+        elif SHA.fullmatch(part):
+            parts[i] = '{sha}'
+    return '/'.join(parts)
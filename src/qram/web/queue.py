@@ -0,0 +1,92 @@
+import asyncio
+import logging
+import time
+from collections.abc import Awaitable, Callable
+
+from qram.metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+type Job = Callable[[], Awaitable[None]]
+
+QUEUE_LAG = REGISTRY.histogram(
+    'qram_queue_lag_seconds',
+    'Time jobs spend in the work queue before a worker picks them up.',
+)
+
+
+class WorkQueue:
+    """Bounded in-process job queue drained by a pool of asyncio workers.
+
+    Lets webhook handlers acknowledge deliveries right away and do the actual processing later.
+    `submit` never waits: when the queue is full it refuses the job, and it is up to the caller
+    to push back on the sender.
+    """
+
+    workers: int
+    max_size: int
+    # job, and when it was enqueued
+    _queue: asyncio.Queue[tuple[Job, float]]
+    _tasks: list[asyncio.Task[None]]
+    _closing: bool
+
+    def __init__(self, workers: int, max_size: int) -> None:
+        assert workers > 0, 'at least one worker is required'
+        self.workers = workers
+        self.max_size = max_size
+        self._queue = asyncio.Queue(maxsize=max_size)
+        self._tasks = []
+        self._closing = False
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize()
+
+    def start(self) -> None:
+        assert not self._tasks, 'work queue already started'
+        self._closing = False
+        self._tasks = [
+            asyncio.create_task(self._work(), name=f'work-queue-{i}') for i in range(self.workers)
+        ]
+        logger.debug(f'work queue started with {self.workers} workers')
+
+    def submit(self, job: Job) -> bool:
+        """Enqueue job without waiting; returns False if it was not accepted."""
+        if self._closing:
+            return False
+        try:
+            self._queue.put_nowait((job, time.monotonic()))
+        except asyncio.QueueFull:
+            return False
+        return True
+
+    async def put(self, job: Job) -> None:
+        """Enqueue job, waiting for free space; for internal producers that can afford to wait."""
+        assert not self._closing, 'work queue is closing'
+        await self._queue.put((job, time.monotonic()))
+
+    async def stop(self, drain_timeout: float) -> None:
+        """Stop accepting jobs, give queued ones `drain_timeout` seconds to finish, then cancel."""
+        self._closing = True
+        try:
+            await asyncio.wait_for(self._queue.join(), drain_timeout)
+        except TimeoutError:
+            logger.warning(
+                f'work queue not drained in {drain_timeout}s; dropping {self.depth} jobs'
+            )
+        for t in self._tasks:
+            _ = t.cancel()
+        _ = await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        logger.debug('work queue stopped')
+
+    async def _work(self) -> None:
+        while True:
+            job, enqueued_at = await self._queue.get()
+            QUEUE_LAG.observe(time.monotonic() - enqueued_at)
+            try:
+                await job()
+            except Exception:
+                logger.exception('queued job failed')
+            finally:
+                self._queue.task_done()
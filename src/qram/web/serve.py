@@ -0,0 +1,108 @@
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import time
+from multiprocessing.connection import wait
+from multiprocessing.context import SpawnProcess
+from types import FrameType
+
+import uvicorn
+
+from qram.config import AppConfig
+from qram.web.app import create_app, run_app, uvicorn_config
+
+logger = logging.getLogger(__name__)
+
+# seconds before a worker that died is started again, so that one failing on startup does
+# not take the supervisor into a busy loop
+WORKER_RESTART_DELAY = 1
+
+
+def configure_logging(*, debug: bool = False) -> None:
+    # time :: severity :: module :: msg
+    logging.basicConfig(
+        level=logging.DEBUG if debug else logging.INFO,
+        format='%(asctime)s :: %(levelname)s :: %(name)s :: %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S',
+        force=True,
+    )
+
+
+def serve(cfg: AppConfig, *, debug: bool = False) -> None:
+    if cfg.server.workers > 1:
+        run_workers(cfg, debug=debug)
+    else:
+        run_app(create_app(cfg), cfg, debug=debug)
+
+
+def run_workers(cfg: AppConfig, *, debug: bool = False) -> None:
+    """Serve from `cfg.server.workers` processes until signalled, restarting any that dies.
+
+    With `reuse_port`, each worker listens on its own SO_REUSEPORT socket and the kernel
+    balances connections between them, instead of them all waking up for every connection on
+    one shared socket and some of them getting most of it.
+
+    Metrics are kept per worker; whichever one is scraped shows those of all of them, each
+    series labeled with the `worker` it came from.
+    """
+    ctx = multiprocessing.get_context('spawn')
+    sock = None
+    if not cfg.server.reuse_port:
+        sock = bind_socket(cfg.bind_to, cfg.port, reuse_port=False)
+    stopping = False
+
+    def spawn(i: int) -> SpawnProcess:
+        p = ctx.Process(target=_worker, args=(cfg, sock, debug), name=f'qram-worker-{i}')
+        p.start()
+        return p
+
+    workers = {i: spawn(i) for i in range(cfg.server.workers)}
+
+    def stop(signum: int, frame: FrameType | None) -> None:
+        _ = frame
+        nonlocal stopping
+        logger.info(f'got {signal.Signals(signum).name}; stopping workers')
+        stopping = True
+        for p in workers.values():
+            p.terminate()
+
+    _ = signal.signal(signal.SIGINT, stop)
+    _ = signal.signal(signal.SIGTERM, stop)
+    logger.info(f'serving on {cfg.bind_to}:{cfg.port} with {len(workers)} workers')
+    while workers:
+        ready = wait([p.sentinel for p in workers.values()])
+        for i, p in list(workers.items()):
+            if p.sentinel not in ready:
+                continue
+            p.join()
+            if stopping:
+                del workers[i]
+                continue
+            logger.warning(f'{p.name} exited with {p.exitcode}; restarting it')
+            time.sleep(WORKER_RESTART_DELAY)
+            workers[i] = spawn(i)
+    if sock:
+        sock.close()
+
+
+def bind_socket(host: str, port: int, *, reuse_port: bool) -> socket.socket:
+    family = socket.AF_INET6 if ':' in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.set_inheritable(True)
+    return sock
+
+
+def _worker(cfg: AppConfig, sock: socket.socket | None, debug: bool) -> None:  # noqa: FBT001
+    # own process group, so that ctrl-c in a terminal reaches only the supervisor; workers are
+    # then stopped by it once, instead of a second signal making uvicorn skip graceful shutdown
+    os.setpgrp()
+    configure_logging(debug=debug)
+    if sock is None:
+        sock = bind_socket(cfg.bind_to, cfg.port, reuse_port=True)
+    uvicorn.Server(uvicorn_config(create_app(cfg), cfg, debug=debug)).run(sockets=[sock])
@@ -0,0 +1,256 @@
+import asyncio
+import fcntl
+import logging
+import os
+import secrets
+import sqlite3
+import time
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager, closing
+from datetime import UTC, datetime
+from pathlib import Path
+
+# State that worker processes of one server must agree on, so that running more of them does
+# not mean processing a redelivery twice, or each of them refreshing its own github token.
+# Everything here is a few rows in a SQLite file plus flock(2)ed lock files next to it: no
+# extra service to run, and locks are released by the kernel when a worker dies.
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS claims (
+    delivery TEXT PRIMARY KEY,
+    at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS tokens (
+    name TEXT PRIMARY KEY,
+    token TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS metrics (
+    worker TEXT PRIMARY KEY,
+    exposition TEXT NOT NULL
+);
+"""
+
+# seconds between attempts to take a lock held by another worker
+LOCK_POLL = 0.05
+# seconds claims wait for the write lock of another worker, blocking the event loop meanwhile
+CLAIM_BUSY_TIMEOUT = 0.1
+# seconds everything else, done in a thread, waits for it
+BUSY_TIMEOUT = 5
+
+
+class SharedState:
+    """Delivery claims and access tokens shared by worker processes, in a SQLite file.
+
+    Claims are one write transaction each; without an fsync (WAL with synchronous=NORMAL)
+    that is tens of microseconds, cheap enough to do inline on every webhook. Losing the
+    last few claims in a power cut only means a redelivery might get processed twice, and so
+    does a claim that could not be made because the database was busy for too long. Expired
+    claims are pruned by the leader; tokens are rare enough to be loaded and stored in a thread.
+    So are metrics each worker publishes for whichever of them gets scraped to show them all.
+
+    Each open state holds a lock named after its random `worker_id` for as long as it lives,
+    by which others can tell whether it is still around (pids get recycled, e.g. by a restarted
+    container). One of them also holds the leader lock: the leader does what must be done once
+    per server rather than once per worker, like renewing github token ahead of expiry or
+    replaying deliveries of workers that are gone. If it dies, another one takes over.
+    """
+
+    path: Path
+    ttl: float
+    worker_id: str
+    _db: sqlite3.Connection | None
+    _alive: ProcessLock
+    _leader: ProcessLock
+
+    def __init__(self, path: Path, *, ttl: float = 24 * 3600) -> None:
+        self.path = path
+        self.ttl = ttl
+        self.worker_id = secrets.token_hex(8)
+        self._db = None
+        self._alive = ProcessLock(self._lock_path(f'worker-{self.worker_id}'))
+        self._leader = ProcessLock(self._lock_path('leader'))
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        assert self._db is not None, 'shared state is not open'
+        return self._db
+
+    @property
+    def is_leader(self) -> bool:
+        return self._leader.held
+
+    def open(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # other workers hold the write lock only for a single statement, so waiting is short
+        self._db = sqlite3.connect(self.path, timeout=CLAIM_BUSY_TIMEOUT, isolation_level=None)
+        with closing(self._connect()) as db:
+            _ = db.execute('PRAGMA journal_mode=WAL')
+            _ = db.executescript(_SCHEMA)
+        _ = self._db.execute('PRAGMA synchronous=NORMAL')
+        self._prune(time.time())
+        taken = self._alive.try_acquire()
+        assert taken, f'worker id {self.worker_id} is taken'
+
+    def close(self) -> None:
+        self._leader.release()
+        self._alive.path.unlink(missing_ok=True)
+        self._alive.release()
+        self.db.close()
+        self._db = None
+
+    def try_lead(self) -> bool:
+        """Become the leader, unless another worker already is; True if we are."""
+        return self._leader.try_acquire()
+
+    def is_alive(self, worker_id: str) -> bool:
+        lock = ProcessLock(self._lock_path(f'worker-{worker_id}'))
+        if not lock.path.exists():
+            return False
+        if not lock.try_acquire():
+            return True
+        # it is gone; nobody is going to look for its lock again
+        lock.path.unlink(missing_ok=True)
+        lock.release()
+        return False
+
+    def claim(self, delivery_id: str, now: float | None = None) -> bool:
+        """Return True if no worker claimed the delivery within `ttl`; it is then ours.
+
+        If the database stays busy, the delivery is taken as not claimed, and so processed.
+        """
+        now = time.time() if now is None else now
+        try:
+            c = self.db.execute(
+                'INSERT INTO claims (delivery, at) VALUES (?, ?)'
+                ' ON CONFLICT (delivery) DO UPDATE SET at = excluded.at WHERE claims.at < ?',
+                (delivery_id, now, now - self.ttl),
+            )
+        except sqlite3.OperationalError as e:
+            if not _is_busy(e):
+                raise
+            logger.warning(f'could not claim delivery {delivery_id}, shared state is busy')
+            return True
+        return c.rowcount > 0
+
+    def release(self, delivery_id: str) -> None:
+        try:
+            _ = self.db.execute('DELETE FROM claims WHERE delivery = ?', (delivery_id,))
+        except sqlite3.OperationalError as e:
+            if not _is_busy(e):
+                raise
+            # its redelivery is then skipped until the claim expires
+            logger.warning(f'could not release delivery {delivery_id}, shared state is busy')
+
+    async def prune(self) -> None:
+        """Drop claims older than `ttl`, which nobody is going to be told about anymore."""
+        await asyncio.to_thread(self._prune, time.time())
+
+    async def publish_metrics(self, exposition: str) -> None:
+        """Replace metrics this worker published before."""
+        await asyncio.to_thread(self._publish_metrics, exposition)
+
+    async def all_metrics(self) -> list[str]:
+        """Latest metrics published by each worker that is still around."""
+        return await asyncio.to_thread(self._all_metrics)
+
+    async def load_token(self, name: str) -> tuple[str, datetime] | None:
+        return await asyncio.to_thread(self._load_token, name)
+
+    async def store_token(self, name: str, token: str, expires_at: datetime) -> None:
+        await asyncio.to_thread(self._store_token, name, token, expires_at)
+
+    @asynccontextmanager
+    async def token_lock(self) -> AsyncIterator[None]:
+        """Held while a token is being requested, so that workers do not request one each."""
+        lock = ProcessLock(self._lock_path('token'))
+        try:
+            # polled rather than waited for in a thread, which could not be cancelled; it is
+            # only contended while another worker is requesting a token, which is rare
+            while not lock.try_acquire():  # noqa: ASYNC110
+                await asyncio.sleep(LOCK_POLL)
+            yield
+        finally:
+            lock.release()
+
+    def _connect(self) -> sqlite3.Connection:
+        """Connection of its own for a thread, which can wait for the database to be free."""
+        return sqlite3.connect(self.path, timeout=BUSY_TIMEOUT, isolation_level=None)
+
+    def _prune(self, now: float) -> None:
+        with closing(self._connect()) as db:
+            _ = db.execute('DELETE FROM claims WHERE at < ?', (now - self.ttl,))
+
+    def _publish_metrics(self, exposition: str) -> None:
+        with closing(self._connect()) as db:
+            _ = db.execute(
+                'INSERT OR REPLACE INTO metrics (worker, exposition) VALUES (?, ?)',
+                (self.worker_id, exposition),
+            )
+
+    def _all_metrics(self) -> list[str]:
+        with closing(self._connect()) as db:
+            rows = db.execute('SELECT worker, exposition FROM metrics ORDER BY worker').fetchall()
+            gone = [(w,) for w, _ in rows if w != self.worker_id and not self.is_alive(w)]
+            _ = db.executemany('DELETE FROM metrics WHERE worker = ?', gone)
+        dead = {w for (w,) in gone}
+        return [exposition for w, exposition in rows if w not in dead]
+
+    def _load_token(self, name: str) -> tuple[str, datetime] | None:
+        with closing(self._connect()) as db:
+            row = db.execute(
+                'SELECT token, expires_at FROM tokens WHERE name = ?', (name,)
+            ).fetchone()
+        if row is None:
+            return None
+        token, expires_at = row
+        return token, datetime.fromtimestamp(expires_at, tz=UTC)
+
+    def _store_token(self, name: str, token: str, expires_at: datetime) -> None:
+        with closing(self._connect()) as db:
+            _ = db.execute(
+                'INSERT OR REPLACE INTO tokens (name, token, expires_at) VALUES (?, ?, ?)',
+                (name, token, expires_at.timestamp()),
+            )
+
+    def _lock_path(self, name: str) -> Path:
+        return self.path.with_name(f'{self.path.name}.{name}.lock')
+
+
+def _is_busy(e: sqlite3.OperationalError) -> bool:
+    return e.sqlite_errorcode in {sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED}
+
+
+class ProcessLock:
+    """flock(2) on a file, held until released or until the process holding it dies."""
+
+    path: Path
+    _fd: int | None
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self._fd = None
+
+    @property
+    def held(self) -> bool:
+        return self._fd is not None
+
+    def try_acquire(self) -> bool:
+        if self._fd is not None:
+            return True
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        self._fd = fd
+        return True
+
+    def release(self) -> None:
+        if self._fd is not None:
+            # closing the descriptor releases the lock
+            os.close(self._fd)
+            self._fd = None
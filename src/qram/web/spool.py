@@ -0,0 +1,238 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+from collections.abc import Callable
+from contextlib import closing
+from dataclasses import dataclass
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# seconds a connection of its own waits for the writer to commit
+BUSY_TIMEOUT = 5
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS deliveries (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    headers TEXT NOT NULL,
+    body BLOB NOT NULL,
+    done INTEGER NOT NULL DEFAULT 0,
+    owner TEXT
+);
+CREATE TABLE IF NOT EXISTS seen (
+    delivery TEXT PRIMARY KEY,
+    at REAL NOT NULL
+);
+"""
+
+
+# serialized headers, body, delivery id, time of arrival, future for the stored entry id
+type _Append = tuple[str, bytes, str | None, float, asyncio.Future[int]]
+
+
+@dataclass(frozen=True)
+class SpoolEntry:
+    id: int
+    headers: dict[str, str]
+    body: bytes
+
+
+class WebhookSpool:
+    """Append-only on-disk journal of accepted webhook deliveries (SQLite in WAL mode).
+
+    Deliveries are durably written before they are acknowledged, and marked done once processed,
+    so whatever was acked but not processed before a crash or restart can be replayed on startup.
+
+    Also persists ids of accepted deliveries for `seen_ttl` seconds, so that deduplication
+    survives restarts.
+
+    When several worker processes share one spool, each delivery records the `owner` worker
+    that accepted it, so that only deliveries of workers that are gone get replayed.
+
+    Writes go through a single writer task doing group commit: everything appended while the
+    previous commit was being fsync'ed is written in the next single transaction, so a burst of
+    deliveries shares one fsync instead of paying for one each.
+    """
+
+    path: Path
+    compact_every: int
+    seen_ttl: float
+    owner: str | None
+    _db: sqlite3.Connection | None
+    _appends: list[_Append]
+    _done: list[int]
+    # delivery ids to be no longer seen
+    _forgotten: list[str]
+    _writer: asyncio.Task[None] | None
+    _done_since_compact: int
+
+    def __init__(
+        self,
+        path: Path,
+        *,
+        compact_every: int = 1000,
+        seen_ttl: float = 24 * 3600,
+        owner: str | None = None,
+    ) -> None:
+        self.path = path
+        self.compact_every = compact_every
+        self.seen_ttl = seen_ttl
+        self.owner = owner
+        self._db = None
+        self._appends = []
+        self._done = []
+        self._forgotten = []
+        self._writer = None
+        self._done_since_compact = 0
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        assert self._db is not None, 'spool is not open'
+        return self._db
+
+    def open(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # connection is only ever used by one thread at a time: either the event loop thread
+        # while writer is idle, or the writer's worker thread
+        self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        _ = self._db.execute('PRAGMA journal_mode=WAL')
+        # fsync WAL on every commit; commits are batched, so it is cheap enough
+        _ = self._db.execute('PRAGMA synchronous=FULL')
+        _ = self._db.executescript(_SCHEMA)
+        columns = {row[1] for row in self._db.execute('PRAGMA table_info(deliveries)')}
+        if 'owner' not in columns:
+            # spool written before deliveries had owners
+            _ = self._db.execute('ALTER TABLE deliveries ADD COLUMN owner TEXT')
+        logger.info(f'webhook spool opened at {self.path}')
+
+    async def close(self) -> None:
+        await self.flush()
+        self.compact()
+        self.db.close()
+        self._db = None
+
+    async def append(
+        self, headers: dict[str, str], body: bytes, *, delivery: str | None = None
+    ) -> int:
+        """Durably store a delivery; returns its id once it is committed to disk."""
+        fut: asyncio.Future[int] = asyncio.get_running_loop().create_future()
+        self._appends.append((json.dumps(headers), body, delivery, time.time(), fut))
+        self._kick()
+        return await fut
+
+    def mark_done(self, entry_id: int) -> None:
+        """Mark a delivery processed. Not waited for: losing it only means a repeated replay."""
+        self._done.append(entry_id)
+        self._kick()
+
+    def forget(self, delivery: str) -> None:
+        """Stop remembering a delivery as seen, so that it is not deduplicated after a restart."""
+        self._forgotten.append(delivery)
+        self._kick()
+
+    async def flush(self) -> None:
+        while self._writer is not None:
+            await asyncio.shield(self._writer)
+
+    def pending(self) -> list[SpoolEntry]:
+        rows = self.db.execute(
+            'SELECT id, headers, body FROM deliveries WHERE done = 0 ORDER BY id'
+        ).fetchall()
+        return [SpoolEntry(id=i, headers=json.loads(h), body=b) for i, h, b in rows]
+
+    async def adopt_orphans(self, is_alive: Callable[[str], bool]) -> list[SpoolEntry]:
+        """Take over unprocessed deliveries of owners that are gone, e.g. a crashed worker."""
+        return await asyncio.to_thread(self._adopt_orphans, is_alive)
+
+    def seen_since(self, at: float) -> list[tuple[str, float]]:
+        """Return (delivery id, time it was accepted) for deliveries accepted after `at`."""
+        return self.db.execute('SELECT delivery, at FROM seen WHERE at >= ?', (at,)).fetchall()
+
+    def compact(self) -> int:
+        """Drop processed deliveries and shrink the WAL; returns number of dropped entries."""
+        dropped = self.db.execute('DELETE FROM deliveries WHERE done = 1').rowcount
+        _ = self.db.execute('DELETE FROM seen WHERE at < ?', (time.time() - self.seen_ttl,))
+        _ = self.db.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        self._done_since_compact = 0
+        logger.debug(f'webhook spool compacted: {dropped} entries dropped')
+        return dropped
+
+    def _adopt_orphans(self, is_alive: Callable[[str], bool]) -> list[SpoolEntry]:
+        # on a connection of its own, as the writer may be using the other one meanwhile
+        with closing(sqlite3.connect(self.path, timeout=BUSY_TIMEOUT, isolation_level=None)) as db:
+            owners = db.execute(
+                'SELECT DISTINCT owner FROM deliveries WHERE done = 0 AND owner IS NOT ?',
+                (self.owner,),
+            ).fetchall()
+            # payloads are read only for owners that are gone, which is hardly ever
+            gone = [owner for (owner,) in owners if owner is None or not is_alive(owner)]
+            if not gone:
+                return []
+            with db:
+                _ = db.execute('BEGIN IMMEDIATE')
+                rows = [
+                    row
+                    for owner in gone
+                    for row in db.execute(
+                        'SELECT id, headers, body FROM deliveries WHERE done = 0 AND owner IS ?',
+                        (owner,),
+                    )
+                ]
+                _ = db.executemany(
+                    'UPDATE deliveries SET owner = ? WHERE id = ?',
+                    [(self.owner, i) for i, *_ in rows],
+                )
+        return [SpoolEntry(id=i, headers=json.loads(h), body=b) for i, h, b in sorted(rows)]
+
+    def _kick(self) -> None:
+        if self._writer is None:
+            self._writer = asyncio.create_task(self._write(), name='webhook-spool-writer')
+
+    async def _write(self) -> None:
+        try:
+            while self._appends or self._done or self._forgotten:
+                appends, self._appends = self._appends, []
+                done, self._done = self._done, []
+                forgotten, self._forgotten = self._forgotten, []
+                try:
+                    ids = await asyncio.to_thread(self._commit, appends, done, forgotten)
+                except Exception as e:
+                    logger.exception('webhook spool commit failed')
+                    for *_, fut in appends:
+                        if not fut.done():
+                            fut.set_exception(e)
+                    continue
+                for (*_, fut), entry_id in zip(appends, ids, strict=True):
+                    # caller might have been cancelled meanwhile; entry is stored anyway
+                    if not fut.done():
+                        fut.set_result(entry_id)
+                self._done_since_compact += len(done)
+                if self._done_since_compact >= self.compact_every:
+                    _ = await asyncio.to_thread(self.compact)
+        finally:
+            self._writer = None
+
+    def _commit(self, appends: list[_Append], done: list[int], forgotten: list[str]) -> list[int]:
+        ids: list[int] = []
+        with self.db:
+            _ = self.db.execute('BEGIN')
+            for headers, body, delivery, at, _ in appends:
+                c = self.db.execute(
+                    'INSERT INTO deliveries (headers, body, owner) VALUES (?, ?, ?)',
+                    (headers, body, self.owner),
+                )
+                assert c.lastrowid is not None
+                ids.append(c.lastrowid)
+                if delivery:
+                    _ = self.db.execute(
+                        'INSERT OR REPLACE INTO seen (delivery, at) VALUES (?, ?)', (delivery, at)
+                    )
+            _ = self.db.executemany(
+                'UPDATE deliveries SET done = 1 WHERE id = ?', [(i,) for i in done]
+            )
+            _ = self.db.executemany(
+                'DELETE FROM seen WHERE delivery = ?', [(d,) for d in forgotten]
+            )
+        return ids
@@ -1,11 +1,23 @@
-from unittest.mock import patch
+import asyncio
+import hashlib
+import hmac
+import json
+import time
+from collections.abc import Callable, Iterator
+from pathlib import Path
+from unittest.mock import AsyncMock, patch
 
 import httpx
 import pytest
 from fastapi.testclient import TestClient
 
-from qram.config import AppConfig, CfgGithub
+from qram.config import AppConfig, CfgGithub, CfgSpool
 from qram.web.app import create_app
+from qram.web.github import AsyncGithubApi, GithubWebhookHandler
+from qram.web.github.events import PingEvent
+from qram.web.spool import WebhookSpool
+
+PING = {'x-github-event': 'ping'}
 
 
 @pytest.fixture(scope='module')
@@ -24,24 +36,36 @@ def config() -> AppConfig:
 
 
 @pytest.fixture(scope='module')
-def running_app(config: AppConfig) -> TestClient:
+def running_app(config: AppConfig) -> Iterator[TestClient]:
     app = create_app(config)
-    return TestClient(app)
+    # context manager runs app lifespan
+    with TestClient(app) as client:
+        yield client
 
 
 class TestAppWithGithubHandler:
+    def test_lifespan_sets_up_shared_github_client(self, running_app: TestClient) -> None:
+        api = running_app.app.state.github_api  # type: ignore[attr-defined]
+        assert isinstance(api, AsyncGithubApi)
+        assert not api.client.is_closed
+
+    def test_lifespan_sets_up_webhook_handler_once(self, running_app: TestClient) -> None:
+        handler = running_app.app.state.webhook_handler  # type: ignore[attr-defined]
+        assert isinstance(handler, GithubWebhookHandler)
+
+        _ = running_app.options('/webhook')
+        _ = post_signed(running_app, {'zen': 'z'})
+
+        assert running_app.app.state.webhook_handler is handler  # type: ignore[attr-defined]
+
     def test_webhook_cors_headers_should_match_between_methods(
         self, config: AppConfig, running_app: TestClient
     ) -> None:
         response_options = running_app.options('/webhook')
         assert response_options.status_code == 200
-        with (
-            # avoid payload verification and processing
-            patch('qram.web.github.handler.GithubWebhookHandler.verify_signature') as mock_verify,
-            patch('qram.web.github.handler.GithubWebhookHandler.process_payload') as _mock_process,
-        ):
-            mock_verify.return_value = None
-            response_post = running_app.post('/webhook', json={'a': 'b'})
+        # avoid payload processing
+        with patch('qram.web.github.handler.GithubWebhookHandler.process_payload'):
+            response_post = post_signed(running_app, {'a': 'b'})
             assert response_post.status_code == 200
 
         def cors_headers(r: httpx.Response) -> dict[str, str]:
@@ -60,8 +84,119 @@ class TestAppWithGithubHandler:
         assert 'does not match' in response.text
 
     def test_webhook_rejects_invalid_payload(self, running_app: TestClient) -> None:
-        with patch('qram.web.github.handler.GithubWebhookHandler.verify_signature') as mock_verify:
-            mock_verify.return_value = None
-            response = running_app.post('/webhook', json='not-a-dict')
-            assert response.status_code == 400
-            assert 'not a dict' in response.text
+        response = post_signed(running_app, 'not-a-dict')
+        assert response.status_code == 400
+        assert 'not a dict' in response.text
+
+    def test_metrics_are_exposed(self, running_app: TestClient) -> None:
+        for _ in range(2):
+            _ = post_signed(running_app, {'zen': 'z'}, headers={'x-github-delivery': 'same-id'})
+
+        response = running_app.get('/metrics')
+
+        assert response.status_code == 200
+        assert response.headers['content-type'].startswith('text/plain')
+        assert 'qram_webhook_requests_total{event="ping",status="200"}' in response.text
+        assert 'qram_queue_depth ' in response.text
+        assert '# TYPE qram_github_token_refreshes_total counter' in response.text
+        assert 'qram_dedup_misses_total 1\n' in response.text
+        assert 'qram_dedup_hits_total 1\n' in response.text
+        assert 'qram_github_cache_hit_ratio ' in response.text
+        assert 'qram_github_cache_bytes_saved_total ' in response.text
+
+    def test_webhook_rejects_oversized_body(self, config: AppConfig) -> None:
+        cfg = config.model_copy(update=dict(max_body_size=16))
+        with TestClient(create_app(cfg)) as client:
+            response = post_signed(client, {'a': 'long enough to be over the limit'})
+        assert response.status_code == 413
+
+
+class TestAppWithSpool:
+    def test_pending_deliveries_are_replayed_on_startup(
+        self, config: AppConfig, tmp_path: Path
+    ) -> None:
+        path = tmp_path / 'spool.sqlite'
+
+        async def leave_pending() -> None:
+            spool = WebhookSpool(path)
+            spool.open()
+            _ = await spool.append(PING, b'{"zen": "z"}')
+            await spool.close()
+
+        asyncio.run(leave_pending())
+        cfg = config.model_copy(update=dict(spool=CfgSpool(path=str(path))))
+
+        with (
+            patch(
+                'qram.web.github.handler.GithubWebhookHandler.process_payload',
+                new_callable=AsyncMock,
+            ) as mock_process,
+            TestClient(create_app(cfg)),
+        ):
+            wait_for(lambda: mock_process.await_count > 0)
+
+        mock_process.assert_awaited_once_with(PingEvent(action=None, repo=None, zen='z'))
+        assert not pending_entries(path)
+
+    def test_accepted_delivery_is_spooled_then_done(
+        self, config: AppConfig, tmp_path: Path
+    ) -> None:
+        path = tmp_path / 'spool.sqlite'
+        cfg = config.model_copy(update=dict(spool=CfgSpool(path=str(path))))
+
+        with (
+            patch(
+                'qram.web.github.handler.GithubWebhookHandler.process_payload',
+                new_callable=AsyncMock,
+            ) as mock_process,
+            TestClient(create_app(cfg)) as client,
+        ):
+            response = post_signed(client, {'a': 'b'})
+            assert response.status_code == 200
+            wait_for(lambda: mock_process.await_count > 0)
+
+        assert not pending_entries(path)
+
+    def test_seen_deliveries_survive_restart(self, config: AppConfig, tmp_path: Path) -> None:
+        path = tmp_path / 'spool.sqlite'
+        cfg = config.model_copy(update=dict(spool=CfgSpool(path=str(path))))
+
+        with patch(
+            'qram.web.github.handler.GithubWebhookHandler.process_payload',
+            new_callable=AsyncMock,
+        ) as mock_process:
+            for _ in range(2):
+                with TestClient(create_app(cfg)) as client:
+                    response = post_signed(
+                        client, {'zen': 'z'}, headers={'x-github-delivery': 'same-id'}
+                    )
+                    assert response.status_code == 200
+
+        mock_process.assert_awaited_once_with(PingEvent(action=None, repo=None, zen='z'))
+
+
+def post_signed(
+    client: TestClient, payload: object, headers: dict[str, str] | None = None
+) -> httpx.Response:
+    body = json.dumps(payload).encode()
+    # matches hmac in config fixture
+    mac = hmac.new(b'hmac', body, hashlib.sha256).hexdigest()
+    r: httpx.Response = client.post(
+        '/webhook',
+        content=body,
+        headers={**PING, 'x-hub-signature-256': f'sha256={mac}', **(headers or {})},
+    )
+    return r
+
+
+def wait_for(condition: Callable[[], bool], timeout: float = 2) -> None:
+    start = time.time()
+    while not condition():
+        assert time.time() - start < timeout, 'condition not met in time'
+        time.sleep(0.01)
+
+
+def pending_entries(path: Path) -> list[int]:
+    spool = WebhookSpool(path)
+    spool.open()
+    return [e.id for e in spool.pending()]
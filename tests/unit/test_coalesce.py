@@ -0,0 +1,63 @@
+import asyncio
+
+from qram.web.coalesce import COALESCED_IN, COALESCED_OUT, Coalescer
+
+
+class Sink:
+    def __init__(self) -> None:
+        self.released: list[list[str]] = []
+        self.superseded: list[str] = []
+
+    async def release(self, items: list[str]) -> None:
+        self.released.append(items)
+
+    def coalescer(self, window: float = 0.05, max_delay: float = 1.0) -> Coalescer[str]:
+        return Coalescer(window, max_delay, self.release, self.superseded.append)
+
+
+async def test_burst_is_released_once_quiet() -> None:
+    sink = Sink()
+    c = sink.coalescer()
+    c.add('pr1', 'pull_request', 'opened')
+    c.add('pr1', 'check', 'queued')
+    c.add('pr2', 'pull_request', 'labeled')
+    c.add('pr1', 'check', 'completed')
+
+    assert len(c) == 3
+    await asyncio.sleep(0.02)
+    assert sink.released == []
+
+    await asyncio.sleep(0.1)
+
+    assert sorted(sink.released) == [['labeled'], ['opened', 'completed']]
+    assert sink.superseded == ['queued']
+    assert len(c) == 0
+
+
+async def test_busy_key_is_released_after_max_delay() -> None:
+    sink = Sink()
+    c = sink.coalescer(window=0.05, max_delay=0.1)
+
+    for n in range(8):
+        c.add('pr', 'check', str(n))
+        await asyncio.sleep(0.02)
+
+    assert sink.released
+    assert sink.released[0][0] != '7'
+    await c.flush()
+    assert sink.released[-1] == ['7']
+
+
+async def test_flush_releases_everything_at_once() -> None:
+    sink = Sink()
+    c = sink.coalescer(window=60)
+    events_in = COALESCED_IN.collect().get((), 0)
+    evaluations_out = COALESCED_OUT.collect().get((), 0)
+    for n in range(3):
+        c.add('pr', 'check', str(n))
+
+    await c.flush()
+
+    assert sink.released == [['2']]
+    assert COALESCED_IN.collect()[()] - events_in == 3
+    assert COALESCED_OUT.collect()[()] - evaluations_out == 1
@@ -0,0 +1,30 @@
+import pytest
+
+from qram.web.codec import FastJSONResponse, get_codec
+
+
+class TestGetCodec:
+    def test_stdlib_is_always_available(self) -> None:
+        codec = get_codec(['json'])
+
+        assert codec.name == 'json'
+        assert codec.loads(b'{"a": [1, "\\u00e9"]}') == {'a': [1, 'é']}
+        assert codec.dumps({'a': [1, 'é']}) == '{"a":[1,"é"]}'.encode()
+
+    def test_missing_library_falls_back_to_stdlib(self) -> None:
+        codec = get_codec(['msgspec', 'orjson'])
+
+        assert codec.name in ('msgspec', 'orjson', 'json')
+        assert codec.loads(b'{"a": 1}') == {'a': 1}
+
+    def test_unknown_library_raises(self) -> None:
+        with pytest.raises(ValueError, match='unknown JSON library'):
+            _ = get_codec(['simplejson'])
+
+
+class TestFastJSONResponse:
+    def test_renders_same_as_starlette(self) -> None:
+        resp = FastJSONResponse(content={'error': 'nope', 'n': 1})
+
+        assert bytes(resp.body) == b'{"error":"nope","n":1}'
+        assert resp.headers['content-type'] == 'application/json'
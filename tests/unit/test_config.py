@@ -2,7 +2,7 @@ from pathlib import Path
 
 import pytest
 
-from qram.config import AppConfig
+from qram.config import AppConfig, CfgCoalesce, CfgDedup, CfgGithub, CfgHttp, CfgQueue, CfgRetry
 
 
 def clear_env(monkeypatch: pytest.MonkeyPatch) -> None:
@@ -16,11 +16,62 @@ def clear_env(monkeypatch: pytest.MonkeyPatch) -> None:
         'QRAM_GITHUB_PEM_FILE',
         'QRAM_GITHUB_HMAC',
         'QRAM_GITHUB_HMAC_FILE',
+        'QRAM_GITHUB_API_URL',
+        'QRAM_MAX_BODY_SIZE',
+        'QRAM_HTTP2',
+        'QRAM_HTTP_MAX_CONNECTIONS',
+        'QRAM_HTTP_MAX_KEEPALIVE_CONNECTIONS',
+        'QRAM_HTTP_KEEPALIVE_EXPIRY',
+        'QRAM_HTTP_CACHE_MAX_BYTES',
+        'QRAM_HTTP_CONNECT_TIMEOUT',
+        'QRAM_HTTP_READ_TIMEOUT',
+        'QRAM_HTTP_WRITE_TIMEOUT',
+        'QRAM_HTTP_POOL_TIMEOUT',
+        'QRAM_HTTP_READ_TIMEOUT_OVERRIDES',
+        'QRAM_RETRY_ATTEMPTS',
+        'QRAM_RETRY_BASE_DELAY',
+        'QRAM_RETRY_MAX_DELAY',
+        'QRAM_RETRY_DEADLINE',
+        'QRAM_RETRY_HEDGE_GETS',
+        'QRAM_RETRY_BREAKER_THRESHOLD',
+        'QRAM_RETRY_BREAKER_RESET_AFTER',
+        'QRAM_QUEUE_WORKERS',
+        'QRAM_QUEUE_MAX_SIZE',
+        'QRAM_QUEUE_RETRY_AFTER',
+        'QRAM_QUEUE_DRAIN_TIMEOUT',
+        'QRAM_SPOOL_PATH',
+        'QRAM_SPOOL_COMPACT_EVERY',
+        'QRAM_DEDUP_MAX_SIZE',
+        'QRAM_DEDUP_TTL',
+        'QRAM_COALESCE_WINDOW',
+        'QRAM_COALESCE_MAX_DELAY',
+        'QRAM_SERVER_WORKERS',
+        'QRAM_SERVER_LOOP',
+        'QRAM_SERVER_HTTP',
+        'QRAM_SERVER_REUSE_PORT',
+        'QRAM_SERVER_STATE_PATH',
+        'QRAM_MERGE_QUEUE_ENABLED',
+        'QRAM_MERGE_QUEUE_LABEL',
+        'QRAM_MERGE_QUEUE_BATCH_SIZE',
+        'QRAM_MERGE_QUEUE_MAX_BATCH_SIZE',
+        'QRAM_MERGE_QUEUE_TARGET_FAILURE_RATE',
+        'QRAM_MERGE_QUEUE_FAILURE_WINDOW',
+        'QRAM_MERGE_QUEUE_DEPTH',
+        'QRAM_MERGE_QUEUE_REQUIRED_CHECKS',
+        'QRAM_MERGE_QUEUE_BRANCH_PREFIX',
     ]
     for k in unwanted:
         monkeypatch.delenv(k, raising=False)
 
 
+def set_github_env(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setenv('QRAM_PROVIDER', 'github')
+    monkeypatch.setenv('QRAM_GITHUB_APP_ID', '1')
+    monkeypatch.setenv('QRAM_GITHUB_INSTALLATION_ID', '2')
+    monkeypatch.setenv('QRAM_GITHUB_PEM', 'pem')
+    monkeypatch.setenv('QRAM_GITHUB_HMAC', 'hmac')
+
+
 class TestAppConfig:
     class TestLoadFromEnv:
         def test_can_load_literal_secrets(self, monkeypatch: pytest.MonkeyPatch) -> None:
@@ -39,6 +90,157 @@ class TestAppConfig:
             assert cfg.github.pem == 'ppp'
             assert cfg.github.hmac == 'hhh'
 
+        def test_http_settings_default_when_unset(self, monkeypatch: pytest.MonkeyPatch) -> None:
+            clear_env(monkeypatch)
+            set_github_env(monkeypatch)
+
+            cfg = AppConfig.config_from_env()
+
+            assert cfg.http == CfgHttp()
+
+        def test_http_settings_can_be_overridden(self, monkeypatch: pytest.MonkeyPatch) -> None:
+            clear_env(monkeypatch)
+            set_github_env(monkeypatch)
+            monkeypatch.setenv('QRAM_HTTP2', '0')
+            monkeypatch.setenv('QRAM_HTTP_MAX_CONNECTIONS', '7')
+            monkeypatch.setenv('QRAM_HTTP_KEEPALIVE_EXPIRY', '1.5')
+            monkeypatch.setenv('QRAM_HTTP_CACHE_MAX_BYTES', '0')
+            monkeypatch.setenv('QRAM_HTTP_CONNECT_TIMEOUT', '2')
+            monkeypatch.setenv('QRAM_HTTP_READ_TIMEOUT_OVERRIDES', '{"repos/{owner}/{repo}": 3}')
+
+            cfg = AppConfig.config_from_env()
+
+            assert cfg.http.http2 is False
+            assert cfg.http.max_connections == 7
+            assert cfg.http.max_keepalive_connections == CfgHttp().max_keepalive_connections
+            assert cfg.http.keepalive_expiry == 1.5
+            assert cfg.http.cache_max_bytes == 0
+            assert cfg.http.connect_timeout == 2
+            assert cfg.http.read_timeout == CfgHttp().read_timeout
+            assert cfg.http.read_timeout_overrides == {'repos/{owner}/{repo}': 3}
+
+        def test_api_url_can_be_overridden(self, monkeypatch: pytest.MonkeyPatch) -> None:
+            clear_env(monkeypatch)
+            set_github_env(monkeypatch)
+            assert AppConfig.config_from_env().github == CfgGithub(
+                app_id='1', installation_id='2', pem='pem', hmac='hmac'
+            )
+            monkeypatch.setenv('QRAM_GITHUB_API_URL', 'https://ghe.example.com/api/v3')
+
+            cfg = AppConfig.config_from_env()
+
+            assert cfg.github is not None
+            assert cfg.github.api_url == 'https://ghe.example.com/api/v3/'
+
+        def test_max_body_size_can_be_overridden(self, monkeypatch: pytest.MonkeyPatch) -> None:
+            clear_env(monkeypatch)
+            set_github_env(monkeypatch)
+            monkeypatch.setenv('QRAM_MAX_BODY_SIZE', '1024')
+
+            cfg = AppConfig.config_from_env()
+
+            assert cfg.max_body_size == 1024
+
+        def test_queue_settings_can_be_overridden(self, monkeypatch: pytest.MonkeyPatch) -> None:
+            clear_env(monkeypatch)
+            set_github_env(monkeypatch)
+            monkeypatch.setenv('QRAM_QUEUE_WORKERS', '16')
+            monkeypatch.setenv('QRAM_QUEUE_RETRY_AFTER', '30')
+
+            cfg = AppConfig.config_from_env()
+
+            assert cfg.queue.workers == 16
+            assert cfg.queue.retry_after == 30
+            assert cfg.queue.max_size == CfgQueue().max_size
+
+        def test_spool_is_disabled_by_default(self, monkeypatch: pytest.MonkeyPatch) -> None:
+            clear_env(monkeypatch)
+            set_github_env(monkeypatch)
+
+            cfg = AppConfig.config_from_env()
+
+            assert cfg.spool.path is None
+
+        def test_spool_settings_can_be_overridden(self, monkeypatch: pytest.MonkeyPatch) -> None:
+            clear_env(monkeypatch)
+            set_github_env(monkeypatch)
+            monkeypatch.setenv('QRAM_SPOOL_PATH', '/var/lib/qram/spool.sqlite')
+            monkeypatch.setenv('QRAM_SPOOL_COMPACT_EVERY', '50')
+
+            cfg = AppConfig.config_from_env()
+
+            assert cfg.spool.path == '/var/lib/qram/spool.sqlite'
+            assert cfg.spool.compact_every == 50
+
+        def test_dedup_settings_can_be_overridden(self, monkeypatch: pytest.MonkeyPatch) -> None:
+            clear_env(monkeypatch)
+            set_github_env(monkeypatch)
+            monkeypatch.setenv('QRAM_DEDUP_TTL', '600')
+
+            cfg = AppConfig.config_from_env()
+
+            assert cfg.dedup.ttl == 600
+            assert cfg.dedup.max_size == CfgDedup().max_size
+
+        def test_retry_settings_can_be_overridden(self, monkeypatch: pytest.MonkeyPatch) -> None:
+            clear_env(monkeypatch)
+            set_github_env(monkeypatch)
+            monkeypatch.setenv('QRAM_RETRY_ATTEMPTS', '2')
+            monkeypatch.setenv('QRAM_RETRY_HEDGE_GETS', 'true')
+
+            cfg = AppConfig.config_from_env()
+
+            assert cfg.retry.attempts == 2
+            assert cfg.retry.hedge_gets is True
+            assert cfg.retry.deadline == CfgRetry().deadline
+
+        def test_coalesce_settings_can_be_overridden(self, monkeypatch: pytest.MonkeyPatch) -> None:
+            clear_env(monkeypatch)
+            set_github_env(monkeypatch)
+            monkeypatch.setenv('QRAM_COALESCE_WINDOW', '0')
+
+            cfg = AppConfig.config_from_env()
+
+            assert cfg.coalesce.window == 0
+            assert cfg.coalesce.max_delay == CfgCoalesce().max_delay
+
+        def test_server_settings_can_be_overridden(self, monkeypatch: pytest.MonkeyPatch) -> None:
+            clear_env(monkeypatch)
+            set_github_env(monkeypatch)
+            monkeypatch.setenv('QRAM_SERVER_WORKERS', '8')
+            monkeypatch.setenv('QRAM_SERVER_LOOP', 'uvloop')
+            monkeypatch.setenv('QRAM_SERVER_REUSE_PORT', '0')
+
+            cfg = AppConfig.config_from_env()
+
+            assert cfg.server.workers == 8
+            assert cfg.server.loop == 'uvloop'
+            assert cfg.server.reuse_port is False
+            assert cfg.server.http == 'auto'
+
+        def test_merge_queue_settings_can_be_overridden(
+            self, monkeypatch: pytest.MonkeyPatch
+        ) -> None:
+            clear_env(monkeypatch)
+            set_github_env(monkeypatch)
+            monkeypatch.setenv('QRAM_MERGE_QUEUE_ENABLED', '1')
+            monkeypatch.setenv('QRAM_MERGE_QUEUE_REQUIRED_CHECKS', '["build", "lint"]')
+
+            cfg = AppConfig.config_from_env()
+
+            assert cfg.merge_queue.enabled is True
+            assert cfg.merge_queue.required_checks == ['build', 'lint']
+            assert cfg.merge_queue.batch_size == 4
+
+        def test_merge_queue_needs_single_worker(self, monkeypatch: pytest.MonkeyPatch) -> None:
+            clear_env(monkeypatch)
+            set_github_env(monkeypatch)
+            monkeypatch.setenv('QRAM_MERGE_QUEUE_ENABLED', '1')
+            monkeypatch.setenv('QRAM_SERVER_WORKERS', '2')
+
+            with pytest.raises(ValueError, match='single worker'):
+                _ = AppConfig.config_from_env()
+
         def test_missing_required_env_var_raises(self, monkeypatch: pytest.MonkeyPatch) -> None:
             clear_env(monkeypatch)
             monkeypatch.setenv('QRAM_PROVIDER', 'github')
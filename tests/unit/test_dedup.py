@@ -0,0 +1,59 @@
+from pathlib import Path
+
+from qram.web.dedup import DeliveryDedup
+from qram.web.shared import SharedState
+
+
+class TestDeliveryDedup:
+    def test_second_sighting_is_a_duplicate(self) -> None:
+        d = DeliveryDedup(max_size=10, ttl=60)
+
+        assert not d.check('a', now=0)
+        assert d.check('a', now=1)
+        assert not d.check('b', now=2)
+        assert (d.hits, d.misses) == (1, 2)
+
+    def test_entries_expire_after_ttl(self) -> None:
+        d = DeliveryDedup(max_size=10, ttl=60)
+
+        assert not d.check('a', now=0)
+        assert not d.check('a', now=61)
+        assert len(d) == 1
+
+    def test_oldest_entries_evicted_over_max_size(self) -> None:
+        d = DeliveryDedup(max_size=2, ttl=60)
+        for i, delivery in enumerate('abc'):
+            assert not d.check(delivery, now=i)
+
+        assert len(d) == 2
+        assert not d.check('a', now=3)
+        assert d.check('c', now=3)
+
+    def test_forgotten_delivery_is_not_a_duplicate(self) -> None:
+        d = DeliveryDedup(max_size=10, ttl=60)
+        assert not d.check('a', now=0)
+
+        d.forget('a')
+
+        assert not d.check('a', now=1)
+
+    def test_loaded_entries_count_as_seen(self) -> None:
+        d = DeliveryDedup(max_size=2, ttl=60)
+
+        d.load([('b', 5), ('a', 1), ('c', 10)])
+
+        assert len(d) == 2
+        assert d.check('b', now=11)
+        assert d.check('c', now=11)
+        assert not d.check('a', now=11)
+
+    def test_delivery_seen_by_another_worker_is_a_duplicate(self, tmp_path: Path) -> None:
+        shared = [SharedState(tmp_path / 'shared.sqlite') for _ in range(2)]
+        for s in shared:
+            s.open()
+        a, b = (DeliveryDedup(max_size=10, ttl=60, shared=s) for s in shared)
+
+        assert not a.check('x', now=0)
+        assert b.check('x', now=1)
+        a.forget('x')
+        assert not b.check('x', now=2)
@@ -0,0 +1,241 @@
+import asyncio
+import json
+from datetime import UTC, datetime, timedelta
+from typing import override
+from unittest.mock import patch
+
+import httpx
+import jwt
+import pytest
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+from qram.config import AppConfig, CfgGithub
+from qram.web.github import AsyncGithubApi
+from qram.web.github.api import JwtSigner
+
+
+@pytest.fixture(scope='module')
+def pem() -> str:
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    return key.private_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PrivateFormat.PKCS8,
+        encryption_algorithm=serialization.NoEncryption(),
+    ).decode()
+
+
+@pytest.fixture
+def cfg(pem: str) -> AppConfig:
+    return AppConfig.model_construct(
+        github=CfgGithub.model_construct(app_id='42', installation_id='67', pem=pem),
+    )
+
+
+class FakeGithub:
+    """Minimal stand-in for api.github.com, recording every request it receives."""
+
+    def __init__(self) -> None:
+        self.requests: list[httpx.Request] = []
+        self.expiry = '2999-01-01T00:00:00Z'
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append(request)
+        if request.url.path == '/app/installations/67/access_tokens':
+            return httpx.Response(
+                201,
+                json=dict(token='installation-token', expires_at=self.expiry),  # noqa: S106
+            )
+        return httpx.Response(200, json=dict(path=request.url.path))
+
+    def token_requests(self) -> int:
+        return sum(1 for r in self.requests if r.url.path.endswith('/access_tokens'))
+
+
+@pytest.fixture
+def github() -> FakeGithub:
+    return FakeGithub()
+
+
+@pytest.fixture
+async def api(cfg: AppConfig, github: FakeGithub) -> AsyncGithubApi:
+    client = httpx.AsyncClient(transport=httpx.MockTransport(github))
+    return AsyncGithubApi(cfg, client)
+
+
+class TestAsyncGithubApi:
+    async def test_token_is_acquired_lazily_and_reused(
+        self, api: AsyncGithubApi, github: FakeGithub
+    ) -> None:
+        assert github.token_requests() == 0
+
+        r1 = await api.http_get('/repos/o/r')
+        r2 = await api.http_get('repos/o/r/pulls')
+
+        assert github.token_requests() == 1
+        assert json.loads(r1.content) == dict(path='/repos/o/r')
+        assert json.loads(r2.content) == dict(path='/repos/o/r/pulls')
+        assert github.requests[-1].headers['authorization'] == 'Bearer installation-token'
+
+    async def test_jwt_requests_skip_installation_token(
+        self, api: AsyncGithubApi, github: FakeGithub, pem: str
+    ) -> None:
+        _ = await api.http_get('app', use_jwt=True)
+
+        assert github.token_requests() == 0
+        auth = github.requests[-1].headers['authorization'].removeprefix('Bearer ')
+        public = serialization.load_pem_private_key(pem.encode(), None).public_key()
+        claims = jwt.decode(auth, public, algorithms=['RS256'])  # type: ignore[arg-type]
+        assert claims['iss'] == '42'
+
+    async def test_extra_headers_are_merged(self, api: AsyncGithubApi, github: FakeGithub) -> None:
+        _ = await api.http_post('repos/o/r/issues', json=dict(a=1), headers={'X-Extra': 'yes'})
+
+        sent = github.requests[-1]
+        assert sent.headers['x-extra'] == 'yes'
+        assert sent.headers['x-github-api-version'] == '2022-11-28'
+        assert json.loads(sent.content) == dict(a=1)
+
+    async def test_concurrent_requests_share_single_token_refresh(
+        self, api: AsyncGithubApi, github: FakeGithub
+    ) -> None:
+        _ = await asyncio.gather(*(api.http_get(f'repos/o/r/pulls/{i}') for i in range(10)))
+
+        assert github.token_requests() == 1
+        assert api.token_refreshes == 1
+
+    async def test_token_is_renewed_in_background_before_expiry(
+        self, api: AsyncGithubApi, github: FakeGithub
+    ) -> None:
+        # parse_token_response takes 5 minutes off, so this expires (for us) half a second later
+        expires = datetime.now(tz=UTC) + timedelta(minutes=5, seconds=0.5)
+        github.expiry = expires.isoformat().replace('+00:00', 'Z')
+        api.renew_jitter = 0
+
+        api.start()
+        try:
+            async with asyncio.timeout(3):
+                while github.token_requests() < 1:  # noqa: ASYNC110
+                    await asyncio.sleep(0.01)
+                github.expiry = '2999-01-01T00:00:00Z'
+                while github.token_requests() < 2:  # noqa: ASYNC110
+                    await asyncio.sleep(0.01)
+        finally:
+            await api.aclose()
+
+        # nothing but the renewal task ever talked to github
+        assert len(github.requests) == github.token_requests()
+        assert api.token_is_valid()
+
+    async def test_jwt_is_signed_once_and_reused(
+        self, api: AsyncGithubApi, github: FakeGithub
+    ) -> None:
+        _ = await api.http_get('app', use_jwt=True)
+        _ = await api.http_get('app/installations', use_jwt=True)
+        # token exchange is authorized with a JWT as well
+        _ = await api.http_get('repos/o/r')
+
+        jwts = {r.headers['authorization'] for r in github.requests[:-1]}
+        assert len(jwts) == 1
+        assert api.signer.signed == 1
+
+
+class TestJwtSigner:
+    def test_jwt_is_resigned_shortly_before_expiry(self, pem: str) -> None:
+        signer = JwtSigner('42', pem)
+        first = signer.get()
+        exp = jwt.decode(first, options=dict(verify_signature=False))['exp']
+
+        with patch('time.time', return_value=exp - 30):
+            second = signer.get()
+
+        assert second != first
+        assert signer.signed == 2
+
+    def test_invalid_pem_fails_only_when_signing(self) -> None:
+        signer = JwtSigner('42', 'pem')
+        with pytest.raises(ValueError):  # noqa: PT011
+            _ = signer.get()
+
+
+class PagedGithub(FakeGithub):
+    """Serves `total` numbered items in pages linked together like github does it."""
+
+    def __init__(self, total: int) -> None:
+        super().__init__()
+        self.total = total
+
+    @override
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        if not request.url.path.endswith('/pulls'):
+            return super().__call__(request)
+        self.requests.append(request)
+        per_page = int(request.url.params['per_page'])
+        page = int(request.url.params.get('page', '1'))
+        start = (page - 1) * per_page
+        items = [dict(number=n) for n in range(start, min(start + per_page, self.total))]
+        headers = {}
+        if start + per_page < self.total:
+            url = request.url.copy_merge_params(dict(page=page + 1))
+            headers['link'] = f'<{url}>; rel="next", <{url}>; rel="last"'
+        return httpx.Response(200, json=items, headers=headers)
+
+    def page_requests(self) -> list[httpx.Request]:
+        return [r for r in self.requests if r.url.path.endswith('/pulls')]
+
+
+class TestPaginate:
+    async def test_follows_next_links(self, cfg: AppConfig) -> None:
+        github = PagedGithub(total=25)
+        api = AsyncGithubApi(cfg, httpx.AsyncClient(transport=httpx.MockTransport(github)))
+
+        numbers = [
+            pr['number']
+            async for pr in api.paginate('repos/o/r/pulls', per_page=10, params=dict(state='open'))
+        ]
+
+        assert numbers == list(range(25))
+        pages = github.page_requests()
+        assert [r.url.params.get('page') for r in pages] == [None, '2', '3']
+        assert all(r.url.params['state'] == 'open' for r in pages)
+
+    async def test_max_items_stops_early(self, cfg: AppConfig) -> None:
+        github = PagedGithub(total=1000)
+        api = AsyncGithubApi(cfg, httpx.AsyncClient(transport=httpx.MockTransport(github)))
+
+        items = [pr async for pr in api.paginate('repos/o/r/pulls', per_page=10, max_items=15)]
+
+        assert len(items) == 15
+        # second page was needed, third one is not even prefetched
+        assert len(github.page_requests()) == 2
+
+    async def test_few_items_take_one_small_page(self, cfg: AppConfig) -> None:
+        github = PagedGithub(total=1000)
+        api = AsyncGithubApi(cfg, httpx.AsyncClient(transport=httpx.MockTransport(github)))
+
+        items = [pr async for pr in api.paginate('repos/o/r/pulls', max_items=5)]
+
+        assert len(items) == 5
+        assert [r.url.params['per_page'] for r in github.page_requests()] == ['5']
+
+    async def test_no_items_take_no_request(self, cfg: AppConfig) -> None:
+        github = PagedGithub(total=1000)
+        api = AsyncGithubApi(cfg, httpx.AsyncClient(transport=httpx.MockTransport(github)))
+
+        items = [pr async for pr in api.paginate('repos/o/r/pulls', max_items=0)]
+
+        assert items == []
+        assert github.page_requests() == []
+
+    async def test_items_key_unwraps_list(self, cfg: AppConfig, github: FakeGithub) -> None:
+        def checks(request: httpx.Request) -> httpx.Response:
+            if request.url.path.endswith('/access_tokens'):
+                return github(request)
+            return httpx.Response(200, json=dict(total_count=1, check_runs=[dict(id=7)]))
+
+        api = AsyncGithubApi(cfg, httpx.AsyncClient(transport=httpx.MockTransport(checks)))
+        runs = [
+            r async for r in api.paginate('repos/o/r/commits/a/check-runs', items_key='check_runs')
+        ]
+
+        assert runs == [dict(id=7)]
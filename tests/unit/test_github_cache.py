@@ -0,0 +1,130 @@
+from datetime import UTC, datetime
+
+import httpx
+import pytest
+
+from qram.config import AppConfig, CfgGithub
+from qram.web.github import AsyncGithubApi
+from qram.web.github.cache import ResponseCache, stale_paths
+from qram.web.github.events import PullRequestEvent, PushEvent
+
+
+def ok(content: bytes, etag: str | None = '"v1"') -> httpx.Response:
+    return httpx.Response(200, headers={'etag': etag} if etag else {}, content=content)
+
+
+def store(cache: ResponseCache, path: str, content: bytes = b'{}') -> None:
+    _ = cache.resolve(('installation', f'https://api.github.com/{path}'), path, ok(content))
+
+
+def key(path: str) -> tuple[str, str]:
+    return ('installation', f'https://api.github.com/{path}')
+
+
+class TestResponseCache:
+    def test_not_modified_serves_cached_body(self) -> None:
+        cache = ResponseCache(max_bytes=1024)
+        store(cache, 'repos/o/r', b'{"a": 1}')
+
+        entry = cache.get(key('repos/o/r'))
+        assert entry
+        assert cache.conditional_headers(entry) == {'If-None-Match': '"v1"'}
+        not_modified = httpx.Response(304, request=httpx.Request('GET', key('repos/o/r')[1]))
+        r = cache.resolve(key('repos/o/r'), 'repos/o/r', not_modified)
+
+        assert r.status_code == 200
+        assert r.content == b'{"a": 1}'
+        assert r.headers['etag'] == '"v1"'
+        assert cache.stats() == dict(
+            entries=1, bytes=8, hits=1, misses=1, hit_ratio=0.5, bytes_saved=8
+        )
+
+    def test_response_without_validators_is_not_kept(self) -> None:
+        cache = ResponseCache(max_bytes=1024)
+        _ = cache.resolve(key('repos/o/r'), 'repos/o/r', ok(b'{}', etag=None))
+
+        assert len(cache) == 0
+
+    def test_least_recently_used_is_evicted_over_byte_budget(self) -> None:
+        cache = ResponseCache(max_bytes=10)
+        store(cache, 'repos/o/r/pulls/1', b'1234')
+        store(cache, 'repos/o/r/pulls/2', b'1234')
+        _ = cache.get(key('repos/o/r/pulls/1'))
+        store(cache, 'repos/o/r/pulls/3', b'1234')
+
+        assert cache.get(key('repos/o/r/pulls/1'))
+        assert not cache.get(key('repos/o/r/pulls/2'))
+        assert cache.size == 8
+
+    def test_invalidate_drops_subtree_and_exact_paths(self) -> None:
+        cache = ResponseCache(max_bytes=1024)
+        for path in (
+            'repos/o/r/pulls',
+            'repos/o/r/pulls/1',
+            'repos/o/r/pulls/1/files',
+            'repos/o/r/pulls/10',
+            'repos/o/other/pulls/1',
+        ):
+            store(cache, path)
+
+        dropped = cache.invalidate('o/r', ['pulls/1', '=pulls'])
+
+        assert dropped == 3
+        assert cache.get(key('repos/o/r/pulls/10'))
+        assert cache.get(key('repos/o/other/pulls/1'))
+
+
+def test_stale_paths() -> None:
+    push = PushEvent(action=None, repo='o/r', ref='refs/heads/main', before='a', after='b')
+    assert 'branches/main' in stale_paths(push)
+    pr = PullRequestEvent(
+        action='synchronize',
+        repo='o/r',
+        number=5,
+        head_sha='abc',
+        head_ref='feature',
+        base_ref='main',
+        state='open',
+        merged=False,
+        draft=False,
+        labels=(),
+        label=None,
+    )
+    assert 'pulls/5' in stale_paths(pr)
+
+
+class FakeGithub:
+    """Serves a resource with an ETag, answering 304 when it is sent back."""
+
+    def __init__(self) -> None:
+        self.requests: list[httpx.Request] = []
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append(request)
+        if request.headers.get('if-none-match') == '"v1"':
+            return httpx.Response(304, headers={'etag': '"v1"'})
+        return httpx.Response(200, headers={'etag': '"v1"'}, json=dict(path=request.url.path))
+
+
+@pytest.fixture
+def cfg() -> AppConfig:
+    return AppConfig.model_construct(
+        github=CfgGithub.model_construct(app_id='42', installation_id='67', pem='pem'),
+    )
+
+
+async def test_api_revalidates_cached_get(cfg: AppConfig) -> None:
+    github = FakeGithub()
+    cache = ResponseCache(max_bytes=1024)
+    client = httpx.AsyncClient(transport=httpx.MockTransport(github))
+    api = AsyncGithubApi(cfg, client, cache)
+    # skip token exchange, it is not what is tested here
+    api.token, api.expires_at = 'token', datetime.max.replace(tzinfo=UTC)
+
+    first = await api.http_get('repos/o/r/pulls', params=dict(state='open'))
+    second = await api.http_get('repos/o/r/pulls', params=dict(state='open'))
+
+    assert first.json() == second.json() == dict(path='/repos/o/r/pulls')
+    assert 'if-none-match' not in github.requests[0].headers
+    assert github.requests[1].headers['if-none-match'] == '"v1"'
+    assert (cache.hits, cache.misses) == (1, 1)
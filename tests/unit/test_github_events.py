@@ -0,0 +1,110 @@
+import pytest
+
+from qram.web.github.events import (
+    EVENT_TYPES,
+    CheckRunEvent,
+    IssueCommentEvent,
+    PullRequestEvent,
+    StatusEvent,
+    coalescing_key,
+    parse_event,
+)
+
+REPO = {'full_name': 'o/r', 'name': 'r', 'owner': {'login': 'o'}}
+
+
+class TestParseEvent:
+    def test_pull_request(self) -> None:
+        payload = {
+            'action': 'labeled',
+            'repository': REPO,
+            'label': {'name': 'queue'},
+            'pull_request': {
+                'number': 5,
+                'state': 'open',
+                'draft': False,
+                'mergeable': True,
+                'head': {'sha': 'abc', 'ref': 'feature'},
+                'base': {'sha': 'def', 'ref': 'main'},
+                'labels': [{'name': 'queue'}, {'name': 'bug'}],
+                'body': 'long text nobody needs ' * 100,
+            },
+        }
+
+        e = parse_event('pull_request', payload)
+
+        assert e == PullRequestEvent(
+            action='labeled',
+            repo='o/r',
+            number=5,
+            head_sha='abc',
+            head_ref='feature',
+            base_ref='main',
+            state='open',
+            merged=False,
+            draft=False,
+            labels=('queue', 'bug'),
+            label='queue',
+            mergeable=True,
+        )
+
+    def test_check_run(self) -> None:
+        payload = {
+            'action': 'completed',
+            'repository': REPO,
+            'check_run': {
+                'id': 1,
+                'name': 'lint',
+                'head_sha': 'abc',
+                'status': 'completed',
+                'conclusion': 'success',
+                'pull_requests': [{'number': 5}, {'number': 6}],
+            },
+        }
+
+        e = parse_event('check_run', payload)
+
+        assert isinstance(e, CheckRunEvent)
+        assert (e.name, e.conclusion, e.pull_numbers) == ('lint', 'success', (5, 6))
+
+    def test_status(self) -> None:
+        payload = {'repository': REPO, 'sha': 'abc', 'context': 'ci/x', 'state': 'pending'}
+
+        e = parse_event('status', payload)
+
+        assert e == StatusEvent(action=None, repo='o/r', sha='abc', context='ci/x', state='pending')
+
+    def test_issue_comment_on_pr(self) -> None:
+        payload = {
+            'action': 'created',
+            'repository': REPO,
+            'issue': {'number': 3, 'pull_request': {'url': '...'}},
+            'comment': {'body': 'hi', 'user': {'login': 'me'}},
+        }
+
+        e = parse_event('issue_comment', payload)
+
+        assert isinstance(e, IssueCommentEvent)
+        assert e.is_pull_request
+        assert (e.number, e.author) == (3, 'me')
+
+    def test_events_have_no_instance_dict(self) -> None:
+        e = parse_event('ping', {'zen': 'z'})
+
+        assert not hasattr(e, '__dict__')
+
+    def test_unknown_event_raises(self) -> None:
+        assert 'fork' not in EVENT_TYPES
+        with pytest.raises(KeyError):
+            _ = parse_event('fork', {})
+
+
+def test_coalescing_key_groups_events_about_one_commit() -> None:
+    def status(context: str, state: str) -> StatusEvent:
+        return StatusEvent(action=None, repo='o/r', sha='abc', context=context, state=state)
+
+    pending, success, other = status('ci', 'pending'), status('ci', 'success'), status('x', 'y')
+
+    assert coalescing_key(pending) == coalescing_key(success)
+    assert coalescing_key(other) == (('o/r', 'abc'), ('status', 'x'))
+    assert coalescing_key(parse_event('ping', {'zen': 'z'})) is None
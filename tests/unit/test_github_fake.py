@@ -0,0 +1,124 @@
+import asyncio
+
+import httpx
+import pytest
+
+from qram.config import AppConfig, CfgGithub, CfgRetry
+from qram.web.github import AsyncGithubApi
+from qram.web.github.cache import ResponseCache
+from qram.web.github.fake import FakeGithub
+from qram.web.github.graphql import GraphQLError
+
+
+@pytest.fixture
+def fake() -> FakeGithub:
+    return FakeGithub(ratelimit=100)
+
+
+@pytest.fixture
+def api(fake: FakeGithub) -> AsyncGithubApi:
+    cfg = AppConfig.model_construct(
+        github=CfgGithub(
+            app_id='1', installation_id='2', pem='pem', hmac='h', api_url='http://github.test'
+        ),
+        retry=CfgRetry(base_delay=0.001, max_delay=0.002),
+    )
+    client = httpx.AsyncClient(transport=httpx.ASGITransport(fake.app))
+    api = AsyncGithubApi(cfg, client, ResponseCache(1 << 20))
+    api.rejwt = lambda: 'header.payload.signature'  # type: ignore[method-assign]
+    return api
+
+
+async def test_requests_use_installation_token(fake: FakeGithub, api: AsyncGithubApi) -> None:
+    _ = fake.add_pull('o/r', 1)
+
+    r = await api.http_get('repos/o/r/pulls/1')
+
+    assert r.status_code == 200
+    assert r.json()['head']['ref'] == 'feature-1'
+    assert list(fake.tokens) == [api.token]
+    assert fake.requests['POST app/installations/{n}/access_tokens'] == 1
+
+
+async def test_unknown_token_is_rejected(fake: FakeGithub, api: AsyncGithubApi) -> None:
+    _ = await api.get_valid_token()
+    fake.tokens.clear()
+
+    r = await api.http_get('repos/o/r/pulls/1')
+
+    assert r.status_code == 401
+
+
+async def test_paginate_follows_links(fake: FakeGithub, api: AsyncGithubApi) -> None:
+    for n in range(1, 76):
+        _ = fake.add_pull('o/r', n)
+
+    numbers = [pr['number'] async for pr in api.paginate('repos/o/r/pulls', per_page=30)]
+
+    assert numbers == list(range(1, 76))
+    assert fake.requests['GET repos/{owner}/{repo}/pulls'] == 3
+
+
+async def test_unchanged_response_is_served_from_cache(
+    fake: FakeGithub, api: AsyncGithubApi
+) -> None:
+    _ = fake.add_pull('o/r', 1)
+    first = await api.http_get('repos/o/r/pulls/1')
+    remaining = fake.ratelimit['core'].remaining
+
+    second = await api.http_get('repos/o/r/pulls/1')
+
+    assert second.status_code == 200
+    assert second.content == first.content
+    assert fake.not_modified == 1
+    assert api.cache is not None
+    assert api.cache.hits == 1
+    # 304 is free, both at github and in scheduler's view of the budget
+    assert fake.ratelimit['core'].remaining == remaining
+    assert api.ratelimit.buckets['core'].remaining == remaining
+
+
+async def test_server_errors_are_retried(fake: FakeGithub, api: AsyncGithubApi) -> None:
+    _ = fake.add_pull('o/r', 1)
+    _ = await api.get_valid_token()
+    fake.fail_next.extend([502, 503])
+
+    r = await api.http_get('repos/o/r/pulls/1')
+
+    assert r.status_code == 200
+    assert api.sender.retries == 2
+
+
+async def test_exhausted_rate_limit_holds_requests(fake: FakeGithub, api: AsyncGithubApi) -> None:
+    _ = await api.get_valid_token()
+    fake.ratelimit['core'].remaining = 1
+    _ = await api.http_get('repos/o/r/pulls/1')
+    sent = fake.requests.total()
+
+    # held back until reset, instead of being sent only to get 403
+    with pytest.raises(TimeoutError):
+        async with asyncio.timeout(0.1):
+            _ = await api.http_get('repos/o/r/pulls/1')
+
+    assert fake.requests.total() == sent
+    bucket = api.ratelimit.buckets['core']
+    assert (bucket.remaining, bucket.reset) == (0, int(fake.ratelimit['core'].reset))
+
+
+async def test_pull_requests_are_loaded_by_graphql(fake: FakeGithub, api: AsyncGithubApi) -> None:
+    _ = fake.add_pull('o/r', 1, reviews=dict(alice='APPROVED'))
+    _ = fake.add_pull('o/x', 2, draft=True)
+
+    one, two, missing = await asyncio.gather(
+        api.pull_requests.load('o/r', 1),
+        api.pull_requests.load('o/x', 2),
+        api.pull_requests.load('o/r', 3),
+        return_exceptions=True,
+    )
+
+    assert not isinstance(one, BaseException)
+    assert not isinstance(two, BaseException)
+    assert (one.approved_by, one.review_decision) == (('alice',), 'APPROVED')
+    assert two.draft
+    assert isinstance(missing, GraphQLError)
+    assert fake.requests['POST graphql'] == 1
@@ -0,0 +1,179 @@
+import asyncio
+import json
+import re
+from datetime import UTC, datetime
+from typing import Any
+
+import httpx
+import pytest
+
+from qram.config import AppConfig, CfgGithub
+from qram.web.github import AsyncGithubApi
+from qram.web.github.graphql import (
+    PR_NODES,
+    GraphQLError,
+    PullRequestLoader,
+    build_query,
+    is_read_only,
+)
+
+
+def pr_node(number: int) -> dict[str, Any]:
+    return dict(
+        number=number,
+        state='OPEN',
+        isDraft=False,
+        headRefOid=f'sha{number}',
+        mergeable='MERGEABLE',
+        mergeStateStatus='CLEAN',
+        reviewDecision='APPROVED',
+        latestReviews=dict(
+            nodes=[
+                dict(state='APPROVED', author=dict(login='alice')),
+                dict(state='CHANGES_REQUESTED', author=dict(login='bob')),
+                dict(state='APPROVED', author=None),
+            ]
+        ),
+        commits=dict(
+            nodes=[
+                dict(
+                    commit=dict(
+                        statusCheckRollup=dict(
+                            state='PENDING',
+                            contexts=dict(
+                                nodes=[
+                                    dict(
+                                        __typename='CheckRun',
+                                        name='build',
+                                        status='COMPLETED',
+                                        conclusion='SUCCESS',
+                                    ),
+                                    dict(
+                                        __typename='CheckRun',
+                                        name='test',
+                                        status='IN_PROGRESS',
+                                        conclusion=None,
+                                    ),
+                                    dict(__typename='StatusContext', context='ci', state='PENDING'),
+                                ]
+                            ),
+                        )
+                    )
+                )
+            ]
+        ),
+    )
+
+
+class FakeGraphQL:
+    """Answers batched pull request queries from a set of existing pull requests."""
+
+    def __init__(self, existing: set[int]) -> None:
+        self.existing = existing
+        self.queries: list[tuple[str, dict[str, Any]]] = []
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        body = json.loads(request.content)
+        query, variables = body['query'], body['variables']
+        self.queries.append((query, variables))
+        data: dict[str, Any] = {}
+        # good enough to parse what build_query makes
+        for repo_alias, prs in re.findall(r'(r\d+): repository\([^)]*\) \{ (.*?) \}\s*\}', query):
+            data[repo_alias] = {
+                f'pr{n}': pr_node(int(n)) if int(n) in self.existing else None
+                for n in re.findall(r'pullRequest\(number: (\d+)\)', prs)
+            }
+        return httpx.Response(200, json=dict(data=data))
+
+
+@pytest.fixture
+def cfg() -> AppConfig:
+    return AppConfig.model_construct(
+        github=CfgGithub.model_construct(app_id='42', installation_id='67', pem='pem'),
+    )
+
+
+def make_api(cfg: AppConfig, github: FakeGraphQL) -> AsyncGithubApi:
+    api = AsyncGithubApi(cfg, httpx.AsyncClient(transport=httpx.MockTransport(github)))
+    # skip token exchange, it is not what is tested here
+    api.token, api.expires_at = 'token', datetime.max.replace(tzinfo=UTC)
+    return api
+
+
+class TestPullRequestLoader:
+    async def test_lookups_within_tick_share_one_query(self, cfg: AppConfig) -> None:
+        github = FakeGraphQL(existing={1, 2, 3})
+        api = make_api(cfg, github)
+
+        prs = await asyncio.gather(
+            api.pull_requests.load('o/r', 1),
+            api.pull_requests.load('o/r', 2),
+            api.pull_requests.load('o/other', 3),
+            api.pull_requests.load('o/r', 1),
+        )
+
+        assert len(github.queries) == 1
+        expected = [('o/r', 1), ('o/r', 2), ('o/other', 3), ('o/r', 1)]
+        assert [(pr.repo, pr.number) for pr in prs] == expected
+        assert github.queries[0][1] == dict(o0='o', n0='r', o1='o', n1='other')
+
+    async def test_status_is_parsed(self, cfg: AppConfig) -> None:
+        api = make_api(cfg, FakeGraphQL(existing={7}))
+
+        pr = await api.pull_requests.load('o/r', 7)
+
+        assert pr.head_sha == 'sha7'
+        assert pr.approved_by == ('alice',)
+        assert pr.changes_requested_by == ('bob',)
+        assert pr.checks_state == 'PENDING'
+        assert pr.checks == dict(build='SUCCESS', test='IN_PROGRESS', ci='PENDING')
+
+    async def test_missing_pull_request_fails_alone(self, cfg: AppConfig) -> None:
+        api = make_api(cfg, FakeGraphQL(existing={1}))
+
+        found, missing = await asyncio.gather(
+            api.pull_requests.load('o/r', 1),
+            api.pull_requests.load('o/r', 2),
+            return_exceptions=True,
+        )
+
+        assert not isinstance(found, BaseException)
+        assert found.number == 1
+        assert isinstance(missing, GraphQLError)
+
+    async def test_batch_is_split_by_node_budget(self) -> None:
+        queries: list[dict[str, Any]] = []
+
+        async def query(q: str, variables: dict[str, Any]) -> dict[str, Any]:
+            queries.append(variables)
+            _ = q
+            return {}
+
+        loader = PullRequestLoader(query, max_nodes=2 * PR_NODES)
+        futures = [loader.load('o/r', n) for n in range(5)]
+        _ = await asyncio.gather(*futures, return_exceptions=True)
+
+        assert loader.queries == len(queries) == 3
+
+
+def test_build_query_groups_by_repository() -> None:
+    query, variables, aliases = build_query([('o/r', 1), ('o/x', 2), ('o/r', 3)])
+
+    assert variables == dict(o0='o', n0='r', o1='o', n1='x')
+    assert aliases == {
+        ('o/r', 1): ('r0', 'pr1'),
+        ('o/x', 2): ('r1', 'pr2'),
+        ('o/r', 3): ('r0', 'pr3'),
+    }
+    assert query.count('repository(') == 2
+    assert query.count('pullRequest(') == 3
+
+
+def test_only_documents_without_mutations_are_read_only() -> None:
+    query, _, _ = build_query([('o/r', 1)])
+
+    assert is_read_only(query)
+    assert is_read_only('{ mutation: viewer { login } }')
+    assert not is_read_only(
+        'mutation M { addStar(input: {starrableId: "x"}) { clientMutationId } }'
+    )
@@ -0,0 +1,142 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+
+from qram.web.github.ratelimit import (
+    RATE_LIMIT_BURST,
+    SECONDARY_LIMIT_BACKOFF,
+    RateLimitBucket,
+    RateLimitScheduler,
+    resource_for,
+)
+
+NOW = 1_000_000.0
+
+
+def limit_response(
+    remaining: int,
+    reset: float,
+    *,
+    limit: int = 5000,
+    status: int = 200,
+    headers: dict[str, str] | None = None,
+) -> httpx.Response:
+    return httpx.Response(
+        status,
+        headers={
+            'x-ratelimit-limit': str(limit),
+            'x-ratelimit-remaining': str(remaining),
+            'x-ratelimit-reset': str(int(reset)),
+            'x-ratelimit-resource': 'core',
+            **(headers or {}),
+        },
+    )
+
+
+@pytest.fixture
+def scheduler() -> RateLimitScheduler:
+    return RateLimitScheduler()
+
+
+class TestRateLimitBucket:
+    def test_unknown_budget_is_not_paced(self) -> None:
+        b = RateLimitBucket('core')
+        for _ in range(100):
+            assert b.delay(NOW, mutation=False) <= 0
+            b.take(NOW)
+
+    def test_burst_then_paced_to_spread_remaining_budget(self) -> None:
+        b = RateLimitBucket('core', limit=5000, remaining=3600, reset=NOW + 3600)
+        for _ in range(RATE_LIMIT_BURST):
+            assert b.delay(NOW, mutation=False) <= 0
+            b.take(NOW)
+
+        # ~1 request per second is what is left after the burst
+        assert b.delay(NOW, mutation=False) == pytest.approx(1, rel=0.01)
+
+    def test_exhausted_budget_waits_for_reset(self) -> None:
+        b = RateLimitBucket('core', limit=5000, remaining=0, reset=NOW + 30)
+        assert b.delay(NOW, mutation=True) == 30
+        assert b.delay(NOW + 30, mutation=True) <= 0
+
+    def test_reads_leave_reserve_to_mutations(self) -> None:
+        b = RateLimitBucket('core', limit=100, remaining=10, reset=NOW + 60)
+        assert b.delay(NOW, mutation=False) == 60
+        assert b.delay(NOW, mutation=True) <= 0
+
+    def test_reads_yield_to_waiting_mutations(self) -> None:
+        b = RateLimitBucket('core', waiting_mutations=1)
+        b.remaining, b.reset = 1000, NOW + 60
+        assert b.delay(NOW, mutation=False) > 0
+        assert b.delay(NOW, mutation=True) <= 0
+
+
+class TestRateLimitScheduler:
+    def test_update_tracks_bucket_from_response(self, scheduler: RateLimitScheduler) -> None:
+        r = limit_response(29, NOW + 60, limit=30, headers={'x-ratelimit-resource': 'search'})
+        scheduler.update('core', r, NOW)
+
+        assert scheduler.snapshot()['search'] == dict(
+            limit=30,
+            remaining=29,
+            reset=NOW + 60,
+            blocked_until=0,
+            waiting_mutations=0,
+            sent=0,
+            throttled=0,
+            rate_limited=0,
+        )
+
+    def test_retry_after_blocks_bucket(self, scheduler: RateLimitScheduler) -> None:
+        r = limit_response(100, NOW + 600, status=429, headers={'retry-after': '7'})
+        scheduler.update('core', r, NOW)
+
+        b = scheduler.bucket('core')
+        assert b.delay(NOW, mutation=True) == 7
+        assert b.rate_limited == 1
+
+    def test_secondary_limit_without_retry_after(self, scheduler: RateLimitScheduler) -> None:
+        r = httpx.Response(403, json=dict(message='You have exceeded a secondary rate limit.'))
+        scheduler.update('core', r, NOW)
+
+        assert scheduler.bucket('core').blocked_until == NOW + SECONDARY_LIMIT_BACKOFF
+
+    def test_plain_forbidden_is_not_rate_limit(self, scheduler: RateLimitScheduler) -> None:
+        scheduler.update('core', httpx.Response(403, json=dict(message='nope')), NOW)
+
+        assert scheduler.bucket('core').blocked_until == 0
+
+    async def test_acquire_waits_until_reset(self, scheduler: RateLimitScheduler) -> None:
+        reset = time.time() + 0.3
+        scheduler.update('core', limit_response(0, 0), time.time())
+        scheduler.bucket('core').reset = reset
+
+        await scheduler.acquire('core', mutation=False)
+
+        assert time.time() >= reset
+        assert scheduler.bucket('core').throttled == 1
+
+    async def test_mutations_go_before_reads(self, scheduler: RateLimitScheduler) -> None:
+        b = scheduler.bucket('core')
+        b.limit, b.remaining, b.reset = 100, 0, time.time() + 0.2
+        order: list[str] = []
+
+        async def send(name: str, *, mutation: bool) -> None:
+            await scheduler.acquire('core', mutation=mutation)
+            order.append(name)
+
+        read = asyncio.create_task(send('read', mutation=False))
+        await asyncio.sleep(0)
+        # once budget is back, it is the mutation that goes first
+        mutation = asyncio.create_task(send('mutation', mutation=True))
+        await asyncio.gather(read, mutation)
+
+        assert order == ['mutation', 'read']
+
+
+def test_resource_for() -> None:
+    assert resource_for('/graphql') == 'graphql'
+    assert resource_for('search/issues') == 'search'
+    assert resource_for('repos/o/r/pulls') == 'core'
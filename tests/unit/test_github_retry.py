@@ -0,0 +1,222 @@
+import asyncio
+import contextlib
+from datetime import UTC, datetime
+
+import httpx
+import pytest
+
+from qram.config import AppConfig, CfgGithub, CfgRetry
+from qram.web.github import AsyncGithubApi
+from qram.web.github.graphql import GraphQLError
+from qram.web.github.retry import CircuitBreaker, CircuitOpenError, RetryingSender
+
+FAST = CfgRetry(base_delay=0.001, max_delay=0.002)
+
+
+class Flaky:
+    """Fails first `failures` requests with `error` (a status code or an exception)."""
+
+    def __init__(self, failures: int, error: int | Exception = 503) -> None:
+        self.failures = failures
+        self.error = error
+        self.calls = 0
+
+    async def __call__(self) -> httpx.Response:
+        self.calls += 1
+        if self.calls > self.failures:
+            return httpx.Response(200)
+        if isinstance(self.error, Exception):
+            raise self.error
+        return httpx.Response(self.error)
+
+
+class TestRetryingSender:
+    async def test_idempotent_request_is_retried_until_success(self) -> None:
+        sender = RetryingSender(FAST)
+        send = Flaky(failures=2)
+
+        r = await sender.send('GET', send)
+
+        assert r.status_code == 200
+        assert send.calls == 3
+        assert sender.retries == 2
+
+    async def test_connection_errors_are_retried(self) -> None:
+        send = Flaky(failures=1, error=httpx.ConnectError('reset'))
+
+        r = await RetryingSender(FAST).send('PUT', send)
+
+        assert r.status_code == 200
+        assert send.calls == 2
+
+    async def test_post_is_not_retried(self) -> None:
+        send = Flaky(failures=1)
+
+        r = await RetryingSender(FAST).send('POST', send)
+
+        assert r.status_code == 503
+        assert send.calls == 1
+
+    async def test_client_errors_are_not_retried(self) -> None:
+        send = Flaky(failures=1, error=404)
+
+        r = await RetryingSender(FAST).send('GET', send)
+
+        assert r.status_code == 404
+        assert send.calls == 1
+
+    async def test_gives_up_after_attempts(self) -> None:
+        send = Flaky(failures=10, error=httpx.ConnectTimeout('slow'))
+
+        with pytest.raises(httpx.ConnectTimeout):
+            _ = await RetryingSender(FAST.model_copy(update=dict(attempts=3))).send('GET', send)
+        assert send.calls == 3
+
+    async def test_no_retry_past_deadline(self) -> None:
+        policy = CfgRetry(base_delay=10, max_delay=10, deadline=0)
+        send = Flaky(failures=1)
+
+        r = await RetryingSender(policy).send('GET', send)
+
+        assert r.status_code == 503
+        assert send.calls == 1
+
+    async def test_deadline_cuts_attempt_short(self) -> None:
+        cancelled = asyncio.Event()
+
+        async def send() -> httpx.Response:
+            try:
+                await asyncio.sleep(10)
+            finally:
+                cancelled.set()
+            return httpx.Response(200)
+
+        with pytest.raises(TimeoutError):
+            _ = await RetryingSender(FAST.model_copy(update=dict(deadline=0.01))).send('GET', send)
+        assert cancelled.is_set()
+
+    async def test_slow_get_is_hedged(self) -> None:
+        sender = RetryingSender(FAST.model_copy(update=dict(hedge_gets=True)))
+        for _ in range(50):
+            sender.latency.add(0.01)
+        calls = 0
+
+        async def send() -> httpx.Response:
+            nonlocal calls
+            calls += 1
+            if calls == 1:
+                await asyncio.sleep(10)
+            return httpx.Response(200)
+
+        async with asyncio.timeout(1):
+            r = await sender.send('GET', send)
+
+        assert r.status_code == 200
+        assert (calls, sender.hedges) == (2, 1)
+
+    # deadline comes after the second attempt was started, or before
+    @pytest.mark.parametrize('p95', [0.01, 1.0])
+    async def test_hedged_attempts_are_cancelled_at_deadline(self, p95: float) -> None:
+        sender = RetryingSender(FAST.model_copy(update=dict(hedge_gets=True, deadline=0.05)))
+        for _ in range(50):
+            sender.latency.add(p95)
+        running = 0
+
+        async def send() -> httpx.Response:
+            nonlocal running
+            running += 1
+            try:
+                await asyncio.sleep(10)
+            finally:
+                running -= 1
+            return httpx.Response(200)
+
+        with pytest.raises(TimeoutError):
+            _ = await sender.send('GET', send)
+        await asyncio.sleep(0)
+
+        assert sender.hedges == (p95 < 0.05)
+        assert running == 0
+
+    async def test_open_circuit_fails_fast(self) -> None:
+        sender = RetryingSender(FAST.model_copy(update=dict(breaker_threshold=2, attempts=1)))
+        send = Flaky(failures=10)
+
+        for _ in range(2):
+            _ = await sender.send('GET', send)
+        with pytest.raises(CircuitOpenError):
+            _ = await sender.send('GET', send)
+        assert send.calls == 2
+
+
+class TestCircuitBreaker:
+    def test_half_open_probe_closes_or_reopens(self) -> None:
+        breaker = CircuitBreaker(threshold=1, reset_after=10)
+        breaker.record(success=False, now=0)
+        assert not breaker.allow(now=5)
+
+        # one probe at a time once reset_after is over
+        assert breaker.allow(now=10)
+        assert not breaker.allow(now=10)
+        breaker.record(success=False, now=10)
+        assert not breaker.allow(now=15)
+
+        assert breaker.allow(now=20)
+        breaker.record(success=True, now=20)
+        assert breaker.allow(now=20)
+        assert (breaker.opened, breaker.rejected) == (1, 3)
+
+
+async def test_token_request_is_retried() -> None:
+    calls = 0
+
+    def github(request: httpx.Request) -> httpx.Response:
+        nonlocal calls
+        calls += 1
+        if calls == 1:
+            return httpx.Response(502)
+        if request.url.path.endswith('/access_tokens'):
+            return httpx.Response(201, json=dict(token='t', expires_at='2999-01-01T00:00:00Z'))  # noqa: S106
+        return httpx.Response(200)
+
+    cfg = AppConfig.model_construct(
+        github=CfgGithub.model_construct(app_id='42', installation_id='67', pem='pem'),
+        retry=FAST,
+    )
+    api = AsyncGithubApi(cfg, httpx.AsyncClient(transport=httpx.MockTransport(github)))
+    api.rejwt = lambda: 'jwt'  # type: ignore[method-assign]
+
+    token, expires_at = await api.get_token()
+
+    assert token == 't'  # noqa: S105
+    assert expires_at > datetime.now(tz=UTC)
+    assert calls == 2
+
+
+@pytest.mark.parametrize(
+    ('query', 'calls'),
+    [
+        ('query { viewer { login } }', 2),
+        ('mutation { addStar(input: {}) { clientMutationId } }', 1),
+    ],
+)
+async def test_graphql_queries_are_retried_but_mutations_not(query: str, calls: int) -> None:
+    sent = 0
+
+    def github(request: httpx.Request) -> httpx.Response:
+        nonlocal sent
+        sent += 1
+        _ = request
+        return httpx.Response(502) if sent == 1 else httpx.Response(200, json=dict(data={}))
+
+    cfg = AppConfig.model_construct(
+        github=CfgGithub.model_construct(app_id='42', installation_id='67', pem='pem'),
+        retry=FAST,
+    )
+    api = AsyncGithubApi(cfg, httpx.AsyncClient(transport=httpx.MockTransport(github)))
+    api.token, api.expires_at = 'token', datetime.max.replace(tzinfo=UTC)
+
+    with contextlib.suppress(GraphQLError):
+        _ = await api.graphql(query)
+
+    assert sent == calls
@@ -0,0 +1,79 @@
+from datetime import UTC, datetime
+from functools import partial
+
+import httpx
+import pytest
+
+from qram.config import AppConfig, CfgGithub, CfgHttp
+from qram.web.github import AsyncGithubApi
+from qram.web.github.timing import HTTP_PHASES, observe_phases, route_template, start_timer
+
+
+@pytest.mark.parametrize(
+    ('path', 'template'),
+    [
+        ('/repos/o/r/pulls/12/files', 'repos/{owner}/{repo}/pulls/{n}/files'),
+        (
+            'repos/o/r/commits/' + 'a' * 40 + '/check-runs',
+            'repos/{owner}/{repo}/commits/{sha}/check-runs',
+        ),
+        ('repos/o/r/branches/main/protection', 'repos/{owner}/{repo}/branches/{branch}/protection'),
+        ('app/installations/67/access_tokens', 'app/installations/{n}/access_tokens'),
+        ('graphql', 'graphql'),
+    ],
+)
+def test_route_template(path: str, template: str) -> None:
+    assert route_template(path) == template
+    # github enterprise serves the api under a path
+    assert route_template(f'/api/v3/{path.lstrip("/")}', '/api/v3/') == template
+
+
+async def test_hooks_record_phases_by_route() -> None:
+    client = httpx.AsyncClient(
+        transport=httpx.MockTransport(lambda _: httpx.Response(200, content=b'{}')),
+        event_hooks=dict(request=[start_timer], response=[observe_phases]),
+    )
+    labels = ('GET', 'repos/{owner}/{repo}/pulls/{n}')
+    before = {
+        phase: s.count for (phase, *rest), s in HTTP_PHASES.series.items() if tuple(rest) == labels
+    }
+
+    _ = await client.get('https://api.github.com/repos/o/r/pulls/1')
+    enterprise = httpx.AsyncClient(
+        transport=httpx.MockTransport(lambda _: httpx.Response(200, content=b'{}')),
+        event_hooks=dict(
+            request=[start_timer], response=[partial(observe_phases, api_path='/api/v3/')]
+        ),
+    )
+    _ = await enterprise.get('https://github.example.com/api/v3/repos/o/r/pulls/1')
+
+    after = {
+        phase: s.count for (phase, *rest), s in HTTP_PHASES.series.items() if tuple(rest) == labels
+    }
+    # mock transport opens no connections, so there is nothing to trace
+    assert {p: after[p] - before.get(p, 0) for p in after} == dict(ttfb=2, total=2)
+
+
+@pytest.mark.parametrize('api_url', ['https://api.github.com/', 'https://ghe.example.com/api/v3/'])
+async def test_read_timeout_override_applies_to_route(api_url: str) -> None:
+    sent: list[httpx.Request] = []
+
+    def github(request: httpx.Request) -> httpx.Response:
+        sent.append(request)
+        return httpx.Response(200)
+
+    cfg = AppConfig.model_construct(
+        github=CfgGithub.model_construct(
+            app_id='42', installation_id='67', pem='pem', api_url=api_url
+        ),
+        http=CfgHttp(read_timeout_overrides={'repos/{owner}/{repo}/compare/{basehead}': 99}),
+    )
+    client = httpx.AsyncClient(transport=httpx.MockTransport(github), timeout=httpx.Timeout(5))
+    api = AsyncGithubApi(cfg, client)
+    api.token, api.expires_at = 'token', datetime.max.replace(tzinfo=UTC)
+
+    _ = await api.http_get('repos/o/r/compare/main...feature')
+    _ = await api.http_get('repos/o/r/pulls')
+
+    assert [r.extensions['timeout']['read'] for r in sent] == [99, 5]
+    assert sent[0].extensions['timeout']['connect'] == 5
@@ -1,15 +1,23 @@
 import hashlib
 import hmac
 import json
+import sqlite3
+from collections.abc import AsyncIterator
+from pathlib import Path
 from unittest.mock import AsyncMock, Mock
 
+import httpx
 import pytest
 from fastapi import Request
 from fastapi.responses import JSONResponse
 
-from qram.config import AppConfig, CfgGithub
+from qram.config import AppConfig, CfgGithub, CfgQueue
+from qram.web.dedup import DeliveryDedup
 from qram.web.github import GithubWebhookHandler
+from qram.web.github.cache import ResponseCache
 from qram.web.github.handler import InvalidPayloadError
+from qram.web.queue import WorkQueue
+from qram.web.spool import WebhookSpool
 
 
 @pytest.fixture
@@ -17,12 +25,24 @@ def cfg() -> AppConfig:
     return AppConfig.model_construct(
         cors_origin='',
         github=CfgGithub.model_construct(hmac='secret'),
+        queue=CfgQueue(retry_after=42),
     )
 
 
 @pytest.fixture
-def handler(cfg: AppConfig) -> GithubWebhookHandler:
-    return GithubWebhookHandler(cfg)
+def queue() -> WorkQueue:
+    # never started, so submitted jobs just pile up
+    return WorkQueue(workers=1, max_size=1)
+
+
+@pytest.fixture
+def dedup() -> DeliveryDedup:
+    return DeliveryDedup(max_size=10, ttl=60)
+
+
+@pytest.fixture
+def handler(cfg: AppConfig, queue: WorkQueue, dedup: DeliveryDedup) -> GithubWebhookHandler:
+    return GithubWebhookHandler(cfg, queue, dedup=dedup)
 
 
 class TestVerifySignature:
@@ -81,42 +101,219 @@ class TestVerifySignature:
         assert 'does not match' in error_body(resp)
 
 
-class TestVerifyJsonPayload:
-    async def test_valid_json_payload(self, handler: GithubWebhookHandler) -> None:
+class TestReadVerifiedBody:
+    async def test_chunked_body_is_verified_and_returned(
+        self, handler: GithubWebhookHandler
+    ) -> None:
+        req = signed_request(handler, {'key': 'value'})
+
+        body = await handler.read_verified_body(req)
+
+        assert body == b'{"key": "value"}'
+
+    async def test_tampered_body_fails(self, handler: GithubWebhookHandler) -> None:
+        req = signed_request(handler, {'key': 'value'})
+        req.stream = lambda: stream_chunks(b'{"key": "other"}')
+
+        resp = await handler.read_verified_body(req)
+
+        assert isinstance(resp, JSONResponse)
+        assert resp.status_code == 401
+        assert 'does not match' in error_body(resp)
+
+    async def test_missing_signature_fails_before_reading(
+        self, handler: GithubWebhookHandler
+    ) -> None:
         req = Mock(spec=Request)
-        req.json = AsyncMock(return_value={'key': 'value'})
+        req.headers = {}
 
-        payload = await handler.verify_json_payload(req)
-        assert payload == {'key': 'value'}
+        resp = await handler.read_verified_body(req)
 
-    class TestInvalidPayloads:
-        async def test_invalid_json(self, handler: GithubWebhookHandler) -> None:
-            req = Mock(spec=Request)
-            req.json = AsyncMock(side_effect=ValueError('{"invalid json'))
+        assert isinstance(resp, JSONResponse)
+        assert resp.status_code == 401
+        req.stream.assert_not_called()
 
-            with pytest.raises(InvalidPayloadError, match='failed to parse'):
-                _ = await handler.verify_json_payload(req)
+    async def test_declared_oversized_body_fails_before_reading(
+        self, handler: GithubWebhookHandler
+    ) -> None:
+        req = signed_request(handler, {'key': 'value'})
+        req.headers['content-length'] = str(handler.app_config.max_body_size + 1)
+        req.stream = Mock()
 
-        async def test_empty_payload(self, handler: GithubWebhookHandler) -> None:
-            req = Mock(spec=Request)
-            req.json = AsyncMock(return_value={})
+        resp = await handler.read_verified_body(req)
 
-            with pytest.raises(InvalidPayloadError, match='empty payload'):
-                _ = await handler.verify_json_payload(req)
+        assert isinstance(resp, JSONResponse)
+        assert resp.status_code == 413
+        req.stream.assert_not_called()
 
-        async def test_non_dict_json(self, handler: GithubWebhookHandler) -> None:
-            req = Mock(spec=Request)
-            req.json = AsyncMock(return_value='1234')
+    async def test_streamed_oversized_body_fails(self, cfg: AppConfig, queue: WorkQueue) -> None:
+        handler = GithubWebhookHandler(cfg.model_copy(update=dict(max_body_size=10)), queue)
+        req = signed_request(handler, {'key': 'a long enough value'})
+
+        resp = await handler.read_verified_body(req)
+
+        assert isinstance(resp, JSONResponse)
+        assert resp.status_code == 413
+        assert 'exceeds 10 bytes' in error_body(resp)
 
-            with pytest.raises(InvalidPayloadError, match='not a dict'):
-                _ = await handler.verify_json_payload(req)
 
-        async def test_dict_with_non_string_keys(self, handler: GithubWebhookHandler) -> None:
-            req = Mock(spec=Request)
-            req.json = AsyncMock(return_value={1: 'value'})
+class TestVerifyJsonPayload:
+    def test_valid_json_payload(self, handler: GithubWebhookHandler) -> None:
+        payload = handler.verify_json_payload(b'{"key": "value"}')
+        assert payload == {'key': 'value'}
+
+    class TestInvalidPayloads:
+        def test_invalid_json(self, handler: GithubWebhookHandler) -> None:
+            with pytest.raises(InvalidPayloadError, match='failed to parse'):
+                _ = handler.verify_json_payload(b'{"invalid json')
+
+        def test_empty_payload(self, handler: GithubWebhookHandler) -> None:
+            with pytest.raises(InvalidPayloadError, match='empty payload'):
+                _ = handler.verify_json_payload(b'{}')
 
-            with pytest.raises(InvalidPayloadError, match='not all strings'):
-                _ = await handler.verify_json_payload(req)
+        def test_non_dict_json(self, handler: GithubWebhookHandler) -> None:
+            with pytest.raises(InvalidPayloadError, match='not a dict'):
+                _ = handler.verify_json_payload(b'"1234"')
+
+
+class TestHandle:
+    async def test_valid_webhook_is_queued_and_acked(
+        self, handler: GithubWebhookHandler, queue: WorkQueue
+    ) -> None:
+        resp = await handler.handle(signed_request(handler, {'key': 'value'}))
+
+        assert resp.status_code == 200
+        assert queue.depth == 1
+
+    async def test_full_queue_responds_with_retry_after(
+        self, handler: GithubWebhookHandler, queue: WorkQueue, dedup: DeliveryDedup
+    ) -> None:
+        _ = await handler.handle(signed_request(handler, {'key': 'value'}, delivery='1'))
+        resp = await handler.handle(signed_request(handler, {'key': 'value'}, delivery='2'))
+
+        assert resp.status_code == 503
+        assert resp.headers['retry-after'] == '42'
+        assert 'queue is full' in error_body(resp)
+        assert queue.depth == 1
+        # rejected delivery is to be redelivered, and should not be deduplicated then
+        assert not dedup.check('2')
+
+    async def test_rejected_delivery_is_not_deduplicated_after_restart(
+        self, cfg: AppConfig, queue: WorkQueue, tmp_path: Path
+    ) -> None:
+        spool = WebhookSpool(tmp_path / 'spool.sqlite')
+        spool.open()
+        handler = GithubWebhookHandler(cfg, queue, spool, DeliveryDedup(max_size=10, ttl=60))
+        for delivery in ('1', '2'):
+            _ = await handler.handle(signed_request(handler, {'key': 'value'}, delivery=delivery))
+        await spool.close()
+
+        spool.open()
+        dedup = DeliveryDedup(max_size=10, ttl=60)
+        dedup.load(spool.seen_since(0))
+        await spool.close()
+
+        assert dedup.check('1')
+        assert not dedup.check('2')
+
+    async def test_duplicate_delivery_is_acked_without_queueing(
+        self, handler: GithubWebhookHandler, queue: WorkQueue, dedup: DeliveryDedup
+    ) -> None:
+        first = signed_request(handler, {'key': 'value'}, delivery='abc')
+        again = signed_request(handler, {'key': 'value'}, delivery='abc')
+
+        _ = await handler.handle(first)
+        resp = await handler.handle(again)
+
+        assert resp.status_code == 200
+        assert queue.depth == 1
+        assert (dedup.hits, dedup.misses) == (1, 1)
+
+    async def test_delivery_that_fails_to_spool_is_accepted_again(
+        self, cfg: AppConfig, queue: WorkQueue, dedup: DeliveryDedup
+    ) -> None:
+        spool = Mock(spec=WebhookSpool)
+        msg = 'database or disk is full'
+        spool.append = AsyncMock(side_effect=[sqlite3.OperationalError(msg), 1])
+        handler = GithubWebhookHandler(cfg, queue, dedup=dedup, spool=spool)
+
+        with pytest.raises(sqlite3.OperationalError):
+            _ = await handler.handle(signed_request(handler, {'key': 'value'}, delivery='abc'))
+        resp = await handler.handle(signed_request(handler, {'key': 'value'}, delivery='abc'))
+
+        assert resp.status_code == 200
+        assert queue.depth == 1
+        assert dedup.hits == 0
+
+    async def test_unsupported_event_is_acked_without_queueing(
+        self, handler: GithubWebhookHandler, queue: WorkQueue
+    ) -> None:
+        resp = await handler.handle(signed_request(handler, {'k': 'v'}, event='fork'))
+
+        assert resp.status_code == 200
+        assert queue.depth == 0
+
+    async def test_payload_missing_event_fields_fails(
+        self, handler: GithubWebhookHandler, queue: WorkQueue
+    ) -> None:
+        resp = await handler.handle(signed_request(handler, {'k': 'v'}, event='push'))
+
+        assert resp.status_code == 400
+        assert 'lacks expected field' in error_body(resp)
+        assert queue.depth == 0
+
+    async def test_event_invalidates_cached_responses(
+        self, cfg: AppConfig, queue: WorkQueue
+    ) -> None:
+        cache = ResponseCache(max_bytes=1024)
+        url = 'https://api.github.com/repos/o/r/commits/abc/status'
+        r = httpx.Response(200, headers={'etag': '"1"'}, content=b'{}')
+        _ = cache.resolve(('installation', url), 'repos/o/r/commits/abc/status', r)
+        handler = GithubWebhookHandler(cfg, queue, cache=cache)
+        payload: dict[str, object] = dict(
+            sha='abc', context='ci', state='success', repository=dict(full_name='o/r')
+        )
+
+        resp = await handler.handle(signed_request(handler, payload, event='status'))
+
+        assert resp.status_code == 200
+        assert len(cache) == 0
+
+    async def test_burst_about_one_commit_is_queued_once(
+        self, handler: GithubWebhookHandler, queue: WorkQueue
+    ) -> None:
+        for state in ('pending', 'success'):
+            payload: dict[str, object] = dict(
+                sha='abc', context='ci', state=state, repository=dict(full_name='o/r')
+            )
+            resp = await handler.handle(signed_request(handler, payload, event='status'))
+            assert resp.status_code == 200
+        assert queue.depth == 0
+
+        await handler.flush()
+
+        assert queue.depth == 1
+
+
+def signed_request(
+    handler: GithubWebhookHandler,
+    payload: dict[str, object],
+    delivery: str | None = None,
+    event: str = 'ping',
+) -> Mock:
+    body = json.dumps(payload).encode()
+    mac = hmac.new(handler.github_config.hmac.encode(), body, hashlib.sha256).hexdigest()
+    req = Mock(spec=Request)
+    req.headers = {'x-hub-signature-256': f'sha256={mac}', 'x-github-event': event}
+    if delivery:
+        req.headers['x-github-delivery'] = delivery
+    req.stream = lambda: stream_chunks(body)
+    return req
+
+
+async def stream_chunks(body: bytes, chunk_size: int = 4) -> AsyncIterator[bytes]:
+    for i in range(0, len(body), chunk_size):
+        yield body[i : i + chunk_size]
 
 
 def error_body(resp: JSONResponse) -> str:
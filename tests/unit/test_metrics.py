@@ -0,0 +1,86 @@
+import threading
+
+from qram.metrics import Collector, Counter, Histogram, Registry, merge
+
+
+class TestHistogram:
+    def test_observations_land_in_buckets(self) -> None:
+        h = Histogram('h', 'help', ('method',), buckets=(0.1, 1.0))
+        for v in (0.05, 0.1, 0.5, 5.0):
+            h.observe(v, 'GET')
+        h.observe(0.2, 'POST')
+
+        get = h.series['GET',]
+        assert get.counts == [2, 1, 1]
+        assert get.cumulative() == [2, 3, 4]
+        assert (get.count, get.total) == (4, 5.65)
+        assert h.series['POST',].counts == [0, 1, 0]
+
+
+def test_registry_returns_existing_histogram() -> None:
+    r = Registry()
+    h = r.histogram('h', 'help', ('a',))
+
+    assert r.histogram('h', 'other help', ('a',)) is h
+
+
+class TestCounter:
+    def test_increments_from_threads_are_summed(self) -> None:
+        c = Counter('c', 'help', ('kind',))
+
+        def work() -> None:
+            for _ in range(1000):
+                c.inc('a')
+
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        c.inc('b', value=2)
+
+        assert c.collect() == {('a',): 4000, ('b',): 2}
+
+
+def test_render_prometheus_text() -> None:
+    r = Registry()
+    r.counter('requests_total', 'Requests.', ('event',)).inc('p"ng')
+    r.histogram('lag_seconds', 'Lag.', buckets=(1.0,)).observe(0.5)
+    r.register(Collector('depth', 'Depth.', 'gauge', (), lambda: [((), 3)]))
+
+    assert r.render().splitlines() == [
+        '# HELP requests_total Requests.',
+        '# TYPE requests_total counter',
+        'requests_total{event="p\\"ng"} 1',
+        '# HELP lag_seconds Lag.',
+        '# TYPE lag_seconds histogram',
+        'lag_seconds_bucket{le="1.0"} 1',
+        'lag_seconds_bucket{le="+Inf"} 1',
+        'lag_seconds_sum 0.5',
+        'lag_seconds_count 1',
+        '# HELP depth Depth.',
+        '# TYPE depth gauge',
+        'depth 3',
+    ]
+
+    r.unregister('depth')
+    assert 'depth' not in r.render()
+
+
+def test_workers_are_merged_under_one_header_per_metric() -> None:
+    r = Registry()
+    r.counter('requests_total', 'Requests.', ('event',)).inc('ping')
+    r.register(Collector('depth', 'Depth.', 'gauge', (), lambda: [((), 3)]))
+
+    merged = merge([r.render({'worker': 'a'}), r.render({'worker': 'b'})])
+
+    assert merged.splitlines() == [
+        '# HELP requests_total Requests.',
+        '# TYPE requests_total counter',
+        'requests_total{worker="a",event="ping"} 1',
+        'requests_total{worker="b",event="ping"} 1',
+        '# HELP depth Depth.',
+        '# TYPE depth gauge',
+        'depth{worker="a"} 3',
+        'depth{worker="b"} 3',
+    ]
@@ -0,0 +1,52 @@
+from qram.mq.checks import CheckAggregator, Outcome, RequiredChecks
+
+
+def test_passes_once_every_required_check_passed() -> None:
+    checks = RequiredChecks(frozenset({'build', 'test'}))
+
+    assert not checks.update('build', 'pending')
+    assert not checks.update('build', 'success')
+    assert not checks.update('lint', 'failure')
+    assert (checks.pending, checks.success) == (1, 1)
+    assert checks.update('test', 'success')
+    assert checks.outcome == 'passed'
+
+
+def test_first_failure_decides() -> None:
+    checks = RequiredChecks(frozenset({'build', 'test', 'e2e'}))
+
+    assert checks.update('test', 'failure')
+    assert checks.outcome == 'failed'
+    assert checks.failing() == ['test']
+    # decided for good
+    assert not checks.update('test', 'success')
+    assert checks.outcome == 'failed'
+
+
+def test_rerun_check_moves_between_counts() -> None:
+    checks = RequiredChecks(frozenset({'build', 'test'}))
+    _ = checks.update('build', 'success')
+    _ = checks.update('build', 'pending')
+
+    assert (checks.pending, checks.success, checks.failure) == (2, 0, 0)
+
+
+async def test_callback_is_awaited_once_decided() -> None:
+    decided: list[Outcome] = []
+
+    async def on_decided(outcome: Outcome) -> None:
+        decided.append(outcome)
+
+    agg = CheckAggregator()
+    _ = agg.watch('o/r', 'abc', frozenset({'ci'}), on_decided)
+
+    await agg.report('o/r', 'other', 'ci', 'success')
+    await agg.report('o/r', 'abc', 'lint', 'failure')
+    assert decided == []
+
+    await agg.report('o/r', 'abc', 'ci', 'failure')
+    await agg.report('o/r', 'abc', 'ci', 'success')
+    assert decided == ['failed']
+
+    assert agg.forget('o/r', 'abc')
+    assert not agg.forget('o/r', 'abc')
@@ -0,0 +1,449 @@
+from collections.abc import Sequence
+
+import pytest
+
+from qram.config import CfgMergeQueue
+from qram.mq import MergeQueue, PullIndex
+from qram.mq.engine import BranchQueue, Entry, MergeConflictError
+from qram.web.coalesce import Coalescer
+from qram.web.github.events import (
+    CheckRunEvent,
+    GithubEvent,
+    PullRequestEvent,
+    PullRequestReviewEvent,
+    PushEvent,
+    StatusEvent,
+    coalescing_key,
+)
+
+# fake backend keeps a single repository and branch
+# ruff: noqa: ARG002
+
+
+class Repo:
+    """In-memory MergeBackend; a sha spells out what was merged into it, e.g. 'base+1+2'."""
+
+    def __init__(self) -> None:
+        self.head = 'base'
+        self.branches: dict[str, str] = {}
+        self.deleted: list[str] = []
+        self.rejected: dict[int, str] = {}
+        self.conflicts: set[int] = set()
+        self.builds = 0
+        self.broken = False
+        # names of backend calls to fail, once each
+        self.down: set[str] = set()
+        self.required = frozenset({'ci'})
+
+    async def required_checks(self, repo: str, base: str) -> frozenset[str]:
+        return self.required
+
+    async def build(
+        self, repo: str, branch: str, base: str, onto: str | None, entries: Sequence[Entry]
+    ) -> str:
+        self.builds += 1
+        if self.broken:
+            msg = 'github is down'
+            raise RuntimeError(msg)
+        sha = onto or self.head
+        for e in entries:
+            if e.number in self.conflicts:
+                raise MergeConflictError(e.number)
+            sha = f'{sha}+{e.number}'
+        self.branches[branch] = sha
+        return sha
+
+    async def fast_forward(self, repo: str, base: str, sha: str) -> bool:
+        self.fail_if_down('fast_forward')
+        if not sha.startswith(f'{self.head}+'):
+            return False
+        self.head = sha
+        return True
+
+    async def delete_branch(self, repo: str, branch: str) -> None:
+        self.fail_if_down('delete_branch')
+        _ = self.branches.pop(branch, None)
+        self.deleted.append(branch)
+
+    async def reject(self, repo: str, number: int, reason: str) -> None:
+        self.fail_if_down('reject')
+        self.rejected[number] = reason
+
+    def fail_if_down(self, call: str) -> None:
+        if call in self.down:
+            self.down.remove(call)
+            msg = f'{call} failed'
+            raise RuntimeError(msg)
+
+
+def pull(
+    number: int,
+    action: str = 'labeled',
+    labels: Sequence[str] = ('merge-queue',),
+    sha: str | None = None,
+) -> PullRequestEvent:
+    return PullRequestEvent(
+        action=action,
+        repo='o/r',
+        number=number,
+        head_sha=sha or f'h{number}',
+        head_ref=f'feature-{number}',
+        base_ref='main',
+        state='open',
+        merged=False,
+        draft=False,
+        labels=tuple(labels),
+        label=None,
+    )
+
+
+def check(sha: str, conclusion: str = 'success', name: str = 'ci') -> CheckRunEvent:
+    return CheckRunEvent(
+        action='completed',
+        repo='o/r',
+        id=1,
+        name=name,
+        head_sha=sha,
+        status='completed',
+        conclusion=conclusion,
+        pull_numbers=(),
+    )
+
+
+@pytest.fixture
+def repo() -> Repo:
+    return Repo()
+
+
+@pytest.fixture
+async def mq(repo: Repo) -> MergeQueue:
+    mq = MergeQueue(CfgMergeQueue(enabled=True, batch_size=2, max_batch_size=2, depth=2), repo)
+    for n in range(1, 6):
+        await mq.handle(pull(n))
+    return mq
+
+
+async def filled(repo: Repo) -> MergeQueue:
+    """Queue with 1 merged and 2..5 tested in a single candidate."""
+    mq = MergeQueue(CfgMergeQueue(enabled=True, batch_size=4, depth=1), repo)
+    for n in range(1, 6):
+        await mq.handle(pull(n))
+    await mq.handle(check('base+1'))
+    return mq
+
+
+def queue(mq: MergeQueue) -> BranchQueue:
+    return mq.queues['o/r', 'main']
+
+
+def shas(mq: MergeQueue) -> list[str | None]:
+    return [c.sha for c in queue(mq).candidates]
+
+
+def probes(mq: MergeQueue) -> list[str | None]:
+    return [c.sha for c in queue(mq).probes]
+
+
+def waiting(mq: MergeQueue) -> list[int]:
+    return [e.number for e in queue(mq).waiting]
+
+
+async def test_pulls_queued_while_testing_are_batched(mq: MergeQueue) -> None:
+    # first one is tested as soon as it is queued, rather than waiting for a batch to fill up
+    assert shas(mq) == ['base+1', 'base+1+2']
+    assert waiting(mq) == [3, 4, 5]
+
+    await mq.handle(check('base+1'))
+
+    assert shas(mq) == ['base+1+2', 'base+1+2+3+4']
+    assert waiting(mq) == [5]
+
+
+async def test_passed_candidate_is_merged(mq: MergeQueue, repo: Repo) -> None:
+    await mq.handle(check('base+1'))
+
+    assert repo.head == 'base+1'
+    assert queue(mq).candidates[0].parent is None
+    assert 'qram/merge-queue/main/1' in repo.deleted
+    assert not repo.rejected
+
+
+async def test_later_candidate_passing_merges_everything_under_it(
+    mq: MergeQueue, repo: Repo
+) -> None:
+    await mq.handle(check('base+1+2'))
+
+    assert repo.head == 'base+1+2'
+    assert shas(mq) == ['base+1+2+3+4', 'base+1+2+3+4+5']
+    assert set(queue(mq).entries) == {3, 4, 5}
+
+
+async def test_failed_candidate_on_base_rejects_its_pull(mq: MergeQueue, repo: Repo) -> None:
+    await mq.handle(check('base+1', 'failure'))
+
+    assert set(repo.rejected) == {1}
+    assert repo.rejected[1] == 'Required checks failed when merged into `main`: ci.'
+    # batch size is halved after a failure
+    assert shas(mq) == ['base+2', 'base+2+3']
+    assert repo.head == 'base'
+
+
+async def test_failed_batch_is_bisected(repo: Repo) -> None:
+    mq = await filled(repo)
+    await mq.handle(check('base+1+2+3+4+5', 'failure'))
+
+    assert not repo.rejected
+    assert probes(mq) == ['base+1+2+3', 'base+1+4+5']
+
+    await mq.handle(check('base+1+2+3'))
+    await mq.handle(check('base+1+4+5', 'failure'))
+
+    assert probes(mq) == ['base+1+4', 'base+1+5']
+    assert waiting(mq) == [2, 3]
+
+    await mq.handle(check('base+1+5', 'failure'))
+    await mq.handle(check('base+1+4'))
+
+    assert set(repo.rejected) == {5}
+    assert probes(mq) == []
+    assert shas(mq) == ['base+1+4+2']
+    assert repo.head == 'base+1'
+
+
+async def test_probe_that_does_not_merge_leaves_its_sibling_be(repo: Repo) -> None:
+    mq = await filled(repo)
+    repo.conflicts.add(3)
+    await mq.handle(check('base+1+2+3+4+5', 'failure'))
+
+    assert set(repo.rejected) == {3}
+    assert probes(mq) == ['base+1+4+5']
+    assert waiting(mq) == [2]
+
+    await mq.handle(check('base+1+4+5'))
+
+    # 2 is left from the half that did not merge; the other half is fine on its own
+    assert probes(mq) == []
+    assert shas(mq) == ['base+1+4']
+    assert waiting(mq) == [5, 2]
+    await mq.handle(check('base+1+4'))
+    assert repo.head == 'base+1+4'
+
+
+async def test_pulls_failing_only_together_are_tested_one_by_one(repo: Repo) -> None:
+    mq = await filled(repo)
+    await mq.handle(check('base+1+2+3+4+5', 'failure'))
+    await mq.handle(check('base+1+2+3'))
+    await mq.handle(check('base+1+4+5'))
+
+    assert not repo.rejected
+    assert shas(mq) == ['base+1+2']
+    assert waiting(mq) == [3, 4, 5]
+
+
+async def test_failure_on_pending_parent_waits_for_the_parent(mq: MergeQueue, repo: Repo) -> None:
+    await mq.handle(check('base+1+2', 'failure'))
+
+    # not known yet whether 2 is to blame; next ones are tested without it meanwhile
+    assert not repo.rejected
+    # ...while its own checks are not waited for
+    assert 'qram/merge-queue/main/2' in repo.deleted
+    assert shas(mq) == ['base+1', 'base+1+2', 'base+1+3+4']
+
+    await mq.handle(check('base+1'))
+
+    assert repo.head == 'base+1'
+    assert set(repo.rejected) == {2}
+    assert shas(mq) == ['base+1+3+4', 'base+1+3+4+5']
+
+
+async def test_failed_parent_clears_failure_of_its_children(mq: MergeQueue, repo: Repo) -> None:
+    await mq.handle(check('base+1+2', 'failure'))
+    await mq.handle(check('base+1', 'failure'))
+
+    assert set(repo.rejected) == {1}
+    assert shas(mq) == ['base+2', 'base+2+3']
+
+
+async def test_requested_changes_take_pull_out_of_queue(repo: Repo) -> None:
+    index = PullIndex()
+    mq = MergeQueue(CfgMergeQueue(enabled=True), repo, index)
+
+    async def handle(event: GithubEvent) -> None:
+        index.apply(event)
+        await mq.handle(event)
+
+    await handle(pull(1))
+    await handle(
+        PullRequestReviewEvent(
+            action='submitted',
+            repo='o/r',
+            number=1,
+            commit_id='h1',
+            state='changes_requested',
+            author='a',
+        )
+    )
+
+    assert 'Changes were requested' in repo.rejected[1]
+    assert not queue(mq).entries
+
+    # labeling it again does not help until the reviewer changes their mind
+    await handle(pull(1))
+    assert not queue(mq).entries
+
+    await handle(
+        PullRequestReviewEvent(
+            action='submitted', repo='o/r', number=1, commit_id='h1', state='approved', author='a'
+        )
+    )
+    assert shas(mq) == ['base+1']
+
+
+async def test_unlabeled_pull_leaves_queue(mq: MergeQueue, repo: Repo) -> None:
+    await mq.handle(pull(2, action='unlabeled', labels=()))
+
+    assert shas(mq) == ['base+1', 'base+1+3+4']
+    assert 'qram/merge-queue/main/2' in repo.deleted
+    assert not repo.rejected
+
+
+async def test_pushed_pull_is_rejected(mq: MergeQueue, repo: Repo) -> None:
+    await mq.handle(pull(1, action='synchronize', sha='pushed'))
+
+    assert set(repo.rejected) == {1}
+    assert shas(mq) == ['base+2+3', 'base+2+3+4+5']
+
+
+async def test_push_told_by_coalesced_events_is_rejected(mq: MergeQueue, repo: Repo) -> None:
+    async def release(events: list[PullRequestEvent]) -> None:
+        for e in events:
+            await mq.handle(e)
+
+    coalescer = Coalescer(60, 60, release)
+    for event in (pull(1, 'synchronize', sha='new'), pull(1, 'labeled', sha='new')):
+        key = coalescing_key(event)
+        assert key
+        coalescer.add(*key, event)
+    await coalescer.flush()
+
+    assert set(repo.rejected) == {1}
+    assert 'New commits were pushed' in repo.rejected[1]
+
+
+async def test_conflicting_pull_is_rejected(mq: MergeQueue, repo: Repo) -> None:
+    repo.conflicts.add(6)
+    await mq.handle(check('base+1'))
+    await mq.handle(pull(6))
+    await mq.handle(check('base+1+2'))
+
+    assert set(repo.rejected) == {6}
+    assert shas(mq) == ['base+1+2+3+4', 'base+1+2+3+4+5']
+
+
+async def test_failed_build_waits_for_next_event(repo: Repo) -> None:
+    repo.broken = True
+    mq = MergeQueue(CfgMergeQueue(enabled=True, depth=2), repo)
+
+    await mq.handle(pull(1))
+
+    assert repo.builds == 1
+    assert shas(mq) == []
+    assert waiting(mq) == [1]
+
+    repo.broken = False
+    await mq.handle(pull(2))
+
+    assert shas(mq) == ['base+1+2']
+
+
+async def one_by_one(repo: Repo, *numbers: int) -> MergeQueue:
+    mq = MergeQueue(CfgMergeQueue(enabled=True, batch_size=1, max_batch_size=1, depth=2), repo)
+    for n in numbers:
+        await mq.handle(pull(n))
+    return mq
+
+
+async def test_failed_branch_deletion_does_not_stop_failure(repo: Repo) -> None:
+    mq = await one_by_one(repo, 1, 2)
+    assert shas(mq) == ['base+1', 'base+1+2']
+    repo.down = {'delete_branch'}
+
+    await mq.handle(check('base+1', 'failure'))
+
+    assert set(repo.rejected) == {1}
+    assert shas(mq) == ['base+2']
+    await mq.handle(check('base+2'))
+    assert repo.head == 'base+2'
+
+
+async def test_failed_merge_rebuilds_candidates(repo: Repo) -> None:
+    mq = await one_by_one(repo, 1, 2)
+    repo.down = {'fast_forward'}
+
+    await mq.handle(check('base+1'))
+
+    assert repo.head == 'base'
+    assert [c.outcome for c in queue(mq).candidates] == ['pending', 'pending']
+    await mq.handle(check('base+1'))
+    assert repo.head == 'base+1'
+
+
+async def test_failed_rejection_of_conflict_leaves_queue_whole(repo: Repo) -> None:
+    repo.conflicts = {2}
+    repo.down = {'reject'}
+
+    mq = await one_by_one(repo, 1, 2, 3)
+
+    assert 2 not in queue(mq).entries
+    assert shas(mq) == ['base+1', 'base+1+3']
+
+
+async def test_push_to_base_by_others_rebuilds_candidates(mq: MergeQueue, repo: Repo) -> None:
+    repo.head = 'other'
+    await mq.handle(
+        PushEvent(action=None, repo='o/r', ref='refs/heads/main', before='base', after='other')
+    )
+
+    assert shas(mq) == ['other+1+2', 'other+1+2+3+4']
+
+
+async def test_own_merge_does_not_rebuild_candidates(mq: MergeQueue) -> None:
+    await mq.handle(check('base+1'))
+    await mq.handle(
+        PushEvent(action=None, repo='o/r', ref='refs/heads/main', before='base', after='base+1')
+    )
+
+    assert shas(mq) == ['base+1+2', 'base+1+2+3+4']
+
+
+async def test_all_required_checks_must_pass(repo: Repo) -> None:
+    repo.required = frozenset({'ci', 'lint'})
+    mq = MergeQueue(CfgMergeQueue(enabled=True), repo)
+    await mq.handle(pull(1))
+
+    await mq.handle(check('base+1'))
+    await mq.handle(
+        StatusEvent(action=None, repo='o/r', sha='base+1', context='other', state='failure')
+    )
+    assert repo.head == 'base'
+
+    await mq.handle(
+        StatusEvent(action=None, repo='o/r', sha='base+1', context='lint', state='success')
+    )
+    assert repo.head == 'base+1'
+
+
+async def test_checks_of_discarded_candidates_are_ignored(mq: MergeQueue, repo: Repo) -> None:
+    await mq.handle(pull(2, action='unlabeled', labels=()))
+    await mq.handle(check('base+1+2'))
+
+    assert repo.head == 'base'
+
+
+async def test_nothing_is_merged_without_required_checks(repo: Repo) -> None:
+    repo.required = frozenset()
+    mq = MergeQueue(CfgMergeQueue(enabled=True), repo)
+    await mq.handle(pull(1))
+
+    assert shas(mq) == []
+    assert waiting(mq) == [1]
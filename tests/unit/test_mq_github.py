@@ -0,0 +1,147 @@
+import httpx
+import pytest
+
+from qram.config import AppConfig, CfgGithub, CfgMergeQueue
+from qram.mq import GithubMergeBackend, MergeQueue
+from qram.mq.engine import Entry, MergeConflictError
+from qram.web.github import AsyncGithubApi
+from qram.web.github.events import CheckRunEvent, PullRequestEvent
+from qram.web.github.fake import FakeGithub
+
+
+@pytest.fixture
+def fake() -> FakeGithub:
+    fake = FakeGithub()
+    _ = fake.add_branch('o/r', 'main')
+    fake.protection['o/r', 'main'] = ['ci']
+    for n in (1, 2):
+        _ = fake.add_pull('o/r', n, labels=['merge-queue'])
+    return fake
+
+
+@pytest.fixture
+def backend(fake: FakeGithub) -> GithubMergeBackend:
+    cfg = AppConfig.model_construct(
+        github=CfgGithub(
+            app_id='1', installation_id='2', pem='pem', hmac='h', api_url='http://github.test'
+        ),
+    )
+    client = httpx.AsyncClient(transport=httpx.ASGITransport(fake.app))
+    api = AsyncGithubApi(cfg, client)
+    api.rejwt = lambda: 'header.payload.signature'  # type: ignore[method-assign]
+    return GithubMergeBackend(api, 'merge-queue')
+
+
+def entries(fake: FakeGithub, *numbers: int) -> list[Entry]:
+    return [Entry(n, fake.pulls['o/r', n].head_sha) for n in numbers]
+
+
+async def test_required_checks_come_from_branch_protection(backend: GithubMergeBackend) -> None:
+    assert await backend.required_checks('o/r', 'main') == {'ci'}
+    assert await backend.required_checks('o/r', 'unprotected') == frozenset()
+
+
+async def test_candidate_merges_pulls_onto_base(
+    fake: FakeGithub, backend: GithubMergeBackend
+) -> None:
+    base = fake.refs['o/r', 'main']
+
+    sha = await backend.build('o/r', 'mq/main/1', 'main', None, entries(fake, 1, 2))
+
+    assert fake.refs['o/r', 'mq/main/1'] == sha
+    assert fake.is_ancestor(base, sha)
+    assert all(fake.is_ancestor(fake.pulls['o/r', n].head_sha, sha) for n in (1, 2))
+
+
+async def test_candidate_branch_is_reset_when_reused(
+    fake: FakeGithub, backend: GithubMergeBackend
+) -> None:
+    _ = fake.add_branch('o/r', 'mq/main/1', 'stale')
+
+    sha = await backend.build('o/r', 'mq/main/1', 'main', None, entries(fake, 1))
+
+    assert not fake.is_ancestor('stale', sha)
+
+
+async def test_conflict_names_the_pull(fake: FakeGithub, backend: GithubMergeBackend) -> None:
+    fake.conflicts.add(('o/r', fake.pulls['o/r', 2].head_sha))
+
+    with pytest.raises(MergeConflictError) as e:
+        _ = await backend.build('o/r', 'mq/main/1', 'main', None, entries(fake, 1, 2))
+
+    assert e.value.number == 2
+
+
+async def test_fast_forward_merges_pulls(fake: FakeGithub, backend: GithubMergeBackend) -> None:
+    sha = await backend.build('o/r', 'mq/main/1', 'main', None, entries(fake, 1))
+
+    assert await backend.fast_forward('o/r', 'main', sha)
+
+    assert fake.refs['o/r', 'main'] == sha
+    assert fake.pulls['o/r', 1].merged
+    assert not fake.pulls['o/r', 2].merged
+
+
+async def test_fast_forward_refuses_to_drop_commits(
+    fake: FakeGithub, backend: GithubMergeBackend
+) -> None:
+    sha = await backend.build('o/r', 'mq/main/1', 'main', None, entries(fake, 1))
+    moved = fake.add_branch('o/r', 'main', 'pushed-meanwhile')
+
+    assert not await backend.fast_forward('o/r', 'main', sha)
+    assert fake.refs['o/r', 'main'] == moved
+
+
+async def test_reject_comments_and_unlabels(fake: FakeGithub, backend: GithubMergeBackend) -> None:
+    await backend.reject('o/r', 1, 'Required checks failed.')
+    # label is gone already; not an error
+    await backend.reject('o/r', 1, 'Required checks failed.')
+
+    assert fake.comments['o/r', 1][0]['body'] == 'Removed from merge queue. Required checks failed.'
+    assert fake.pulls['o/r', 1].labels == []
+
+
+async def test_deleting_missing_branch_is_not_an_error(backend: GithubMergeBackend) -> None:
+    await backend.delete_branch('o/r', 'mq/main/404')
+
+
+async def test_queue_merges_pulls_once_checks_pass(
+    fake: FakeGithub, backend: GithubMergeBackend
+) -> None:
+    mq = MergeQueue(CfgMergeQueue(enabled=True), backend)
+    for n in (1, 2):
+        pr = fake.pulls['o/r', n]
+        await mq.handle(
+            PullRequestEvent(
+                action='labeled',
+                repo='o/r',
+                number=n,
+                head_sha=pr.head_sha,
+                head_ref=pr.head_ref,
+                base_ref='main',
+                state='open',
+                merged=False,
+                draft=False,
+                labels=tuple(pr.labels),
+                label='merge-queue',
+            )
+        )
+    candidate = fake.refs['o/r', 'qram/merge-queue/main/2']
+
+    await mq.handle(
+        CheckRunEvent(
+            action='completed',
+            repo='o/r',
+            id=1,
+            name='ci',
+            head_sha=candidate,
+            status='completed',
+            conclusion='success',
+            pull_numbers=(),
+        )
+    )
+
+    assert fake.refs['o/r', 'main'] == candidate
+    assert fake.pulls['o/r', 1].merged
+    assert fake.pulls['o/r', 2].merged
+    assert not [branch for _, branch in fake.refs if branch.startswith('qram/')]
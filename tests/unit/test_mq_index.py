@@ -0,0 +1,196 @@
+from collections.abc import Sequence
+
+import pytest
+
+from qram.mq import PullIndex
+from qram.mq.index import ORPHAN_SHAS_KEPT, CheckCounts
+from qram.web.github.events import (
+    CheckRunEvent,
+    CheckSuiteEvent,
+    PullRequestEvent,
+    PullRequestReviewEvent,
+    StatusEvent,
+)
+
+
+def pull(
+    *,
+    sha: str = 'h1',
+    action: str = 'opened',
+    labels: Sequence[str] = ('merge-queue',),
+    state: str = 'open',
+    mergeable: bool | None = None,
+) -> PullRequestEvent:
+    return PullRequestEvent(
+        action=action,
+        repo='o/r',
+        number=1,
+        head_sha=sha,
+        head_ref='feature-1',
+        base_ref='main',
+        state=state,
+        merged=False,
+        draft=False,
+        labels=tuple(labels),
+        label=None,
+        mergeable=mergeable,
+    )
+
+
+def review(author: str, state: str, action: str = 'submitted') -> PullRequestReviewEvent:
+    return PullRequestReviewEvent(
+        action=action, repo='o/r', number=1, commit_id='h1', state=state, author=author
+    )
+
+
+def run(name: str, sha: str = 'h1', conclusion: str | None = 'success') -> CheckRunEvent:
+    return CheckRunEvent(
+        action='completed' if conclusion else 'created',
+        repo='o/r',
+        id=1,
+        name=name,
+        head_sha=sha,
+        status='completed' if conclusion else 'queued',
+        conclusion=conclusion,
+        pull_numbers=(),
+    )
+
+
+@pytest.fixture
+def index() -> PullIndex:
+    index = PullIndex()
+    index.apply(pull())
+    return index
+
+
+def test_pull_is_found_by_number_and_head(index: PullIndex) -> None:
+    assert index.get('o/r', 1) is index.at_sha('o/r', 'h1')
+    assert index.get('o/r', 2) is None
+    assert index.at_sha('o/r', 'other') is None
+
+
+def test_labels_follow_events(index: PullIndex) -> None:
+    index.apply(pull(action='unlabeled', labels=()))
+
+    snapshot = index.snapshot('o/r', 1)
+    assert snapshot
+    assert not snapshot.queueable('merge-queue')
+
+
+def test_checks_are_counted_by_latest_state(index: PullIndex) -> None:
+    index.apply(run('build', conclusion=None))
+    index.apply(run('lint'))
+    index.apply(StatusEvent(action=None, repo='o/r', sha='h1', context='deploy', state='failure'))
+    assert index.checks['o/r', 'h1'] == CheckCounts(pending=1, success=1, failure=1)
+
+    index.apply(run('build'))
+    index.apply(StatusEvent(action=None, repo='o/r', sha='h1', context='deploy', state='success'))
+
+    snapshot = index.snapshot('o/r', 1)
+    assert snapshot
+    assert snapshot.checks == CheckCounts(success=3)
+    assert snapshot.checks.green
+
+
+def test_completed_suites_count_as_checks(index: PullIndex) -> None:
+    for status, conclusion in (('queued', None), ('completed', 'failure')):
+        index.apply(
+            CheckSuiteEvent(
+                action='completed',
+                repo='o/r',
+                head_sha='h1',
+                head_branch='feature-1',
+                status=status,
+                conclusion=conclusion,
+                app='ci',
+                pull_numbers=(1,),
+            )
+        )
+
+    assert index.checks['o/r', 'h1'] == CheckCounts(failure=1)
+
+
+def test_push_moves_head_and_drops_old_checks(index: PullIndex) -> None:
+    index.apply(run('ci'))
+    # checks of the new head may come before the pull request event
+    index.apply(run('ci', sha='h2', conclusion=None))
+
+    index.apply(pull(sha='h2', action='synchronize'))
+
+    assert index.at_sha('o/r', 'h1') is None
+    assert ('o/r', 'h1') not in index.checks
+    snapshot = index.snapshot('o/r', 1)
+    assert snapshot
+    assert snapshot.checks == CheckCounts(pending=1)
+
+
+def test_closed_pull_is_dropped(index: PullIndex) -> None:
+    index.apply(run('ci'))
+    index.apply(pull(action='closed', state='closed'))
+
+    assert index.get('o/r', 1) is None
+    assert index.snapshot('o/r', 1) is None
+    assert not index.by_sha
+    assert not index.checks
+
+
+def test_reviews_keep_latest_verdict_per_author(index: PullIndex) -> None:
+    index.apply(review('a', 'changes_requested'))
+    index.apply(review('b', 'approved'))
+    index.apply(review('a', 'commented'))
+    pr = index.get('o/r', 1)
+    assert pr
+    assert (pr.approvals, pr.changes_requested) == (1, 1)
+
+    index.apply(review('a', 'approved'))
+    pr = index.get('o/r', 1)
+    assert pr
+    assert (pr.approvals, pr.changes_requested) == (2, 0)
+
+    index.apply(review('b', 'dismissed', action='dismissed'))
+    pr = index.get('o/r', 1)
+    assert pr
+    assert (pr.approvals, pr.changes_requested) == (1, 0)
+
+
+def test_reviews_survive_pull_request_updates(index: PullIndex) -> None:
+    index.apply(review('a', 'changes_requested'))
+    index.apply(pull(action='labeled'))
+
+    snapshot = index.snapshot('o/r', 1)
+    assert snapshot
+    assert not snapshot.queueable('merge-queue')
+
+
+def test_unmergeable_pull_is_not_queueable(index: PullIndex) -> None:
+    index.apply(pull(action='edited', mergeable=False))
+
+    snapshot = index.snapshot('o/r', 1)
+    assert snapshot
+    assert not snapshot.queueable('merge-queue')
+
+
+def test_version_changes_with_every_event(index: PullIndex) -> None:
+    before = index.snapshot('o/r', 1)
+    index.apply(run('ci'))
+    after = index.snapshot('o/r', 1)
+
+    assert before
+    assert after
+    assert after.version > before.version
+    assert index.version % 2 == 0
+    # published records are replaced, not changed
+    assert before.checks == CheckCounts()
+
+
+def test_orphan_checks_are_bounded(index: PullIndex) -> None:
+    for n in range(ORPHAN_SHAS_KEPT + 1):
+        index.apply(run('ci', sha=f'orphan{n}'))
+
+    assert ('o/r', 'orphan0') not in index.checks
+    assert ('o/r', f'orphan{ORPHAN_SHAS_KEPT}') in index.checks
+    # checks of an open pull request are never evicted
+    index.apply(run('ci'))
+    for n in range(ORPHAN_SHAS_KEPT + 1):
+        index.apply(run('ci', sha=f'other{n}'))
+    assert ('o/r', 'h1') in index.checks
@@ -0,0 +1,50 @@
+from qram.config import CfgMergeQueue
+from qram.mq.sizing import BatchSizer
+
+
+def sizer(**kwargs: float) -> BatchSizer:
+    return BatchSizer(CfgMergeQueue.model_validate(dict(batch_size=4, failure_window=10) | kwargs))
+
+
+def test_grows_while_candidates_pass() -> None:
+    s = sizer(max_batch_size=6)
+    for _ in range(5):
+        s.record(failed=False)
+
+    assert s.batch_size == 6
+    assert s.failure_rate == 0
+
+
+def test_halves_when_failures_exceed_target() -> None:
+    s = sizer()
+    s.record(failed=True)
+    assert s.batch_size == 2
+
+    s.record(failed=True)
+    s.record(failed=True)
+    assert s.batch_size == 1
+
+
+def test_occasional_failure_within_target_keeps_size() -> None:
+    s = sizer(target_failure_rate=0.2)
+    for _ in range(9):
+        s.record(failed=False)
+    size = s.batch_size
+
+    s.record(failed=True)
+
+    assert s.failure_rate == 0.1
+    assert s.batch_size == size
+
+
+def test_does_not_grow_back_until_failures_leave_window() -> None:
+    s = sizer(target_failure_rate=0.2)
+    for _ in range(3):
+        s.record(failed=True)
+    s.record(failed=False)
+    assert s.batch_size == 1
+
+    for _ in range(9):
+        s.record(failed=False)
+    assert s.failure_rate == 0
+    assert s.batch_size > 1
@@ -0,0 +1,74 @@
+import asyncio
+from functools import partial
+
+from qram.web.queue import WorkQueue
+
+
+class TestWorkQueue:
+    async def test_submitted_jobs_are_processed(self) -> None:
+        q = WorkQueue(workers=2, max_size=10)
+        done: list[int] = []
+
+        async def job(i: int) -> None:
+            done.append(i)
+
+        q.start()
+        for i in range(5):
+            assert q.submit(partial(job, i))
+        await q.stop(drain_timeout=1)
+
+        assert sorted(done) == [0, 1, 2, 3, 4]
+
+    async def test_full_queue_refuses_jobs(self) -> None:
+        # not started: nothing drains the queue
+        q = WorkQueue(workers=1, max_size=2)
+
+        async def job() -> None:
+            pass
+
+        assert q.submit(job)
+        assert q.submit(job)
+        assert not q.submit(job)
+        assert q.depth == 2
+
+    async def test_failing_job_does_not_kill_worker(self) -> None:
+        q = WorkQueue(workers=1, max_size=10)
+        done: list[str] = []
+
+        async def bad() -> None:
+            raise RuntimeError
+
+        async def good() -> None:
+            done.append('good')
+
+        q.start()
+        assert q.submit(bad)
+        assert q.submit(good)
+        await q.stop(drain_timeout=1)
+
+        assert done == ['good']
+
+    async def test_stop_drains_then_refuses(self) -> None:
+        q = WorkQueue(workers=1, max_size=10)
+        done: list[str] = []
+
+        async def slow() -> None:
+            await asyncio.sleep(0.05)
+            done.append('slow')
+
+        q.start()
+        assert q.submit(slow)
+        await q.stop(drain_timeout=1)
+
+        assert done == ['slow']
+        assert not q.submit(slow)
+
+    async def test_stop_gives_up_after_timeout(self) -> None:
+        q = WorkQueue(workers=1, max_size=10)
+
+        async def stuck() -> None:
+            await asyncio.sleep(60)
+
+        q.start()
+        assert q.submit(stuck)
+        await asyncio.wait_for(q.stop(drain_timeout=0.05), timeout=1)
@@ -0,0 +1,15 @@
+import socket
+
+from qram.web.serve import bind_socket
+
+
+def test_workers_can_bind_same_port_with_reuse_port() -> None:
+    first = bind_socket('127.0.0.1', 0, reuse_port=True)
+    port = first.getsockname()[1]
+    second = bind_socket('127.0.0.1', port, reuse_port=True)
+    try:
+        assert second.getsockname()[1] == port
+        assert second.getsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT)
+    finally:
+        first.close()
+        second.close()
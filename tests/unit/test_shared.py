@@ -0,0 +1,181 @@
+import sqlite3
+import time
+from collections.abc import Iterator
+from contextlib import closing
+from datetime import UTC, datetime
+from pathlib import Path
+
+import httpx
+import pytest
+
+from qram.config import AppConfig, CfgGithub
+from qram.web.github import AsyncGithubApi
+from qram.web.shared import SharedState
+from qram.web.spool import WebhookSpool
+
+
+@pytest.fixture
+def state_path(tmp_path: Path) -> Path:
+    return tmp_path / 'shared.sqlite'
+
+
+@pytest.fixture
+def workers(state_path: Path) -> Iterator[tuple[SharedState, SharedState]]:
+    """Shared state as seen by two worker processes."""
+    a, b = SharedState(state_path, ttl=60), SharedState(state_path, ttl=60)
+    a.open()
+    b.open()
+    yield a, b
+    for s in (a, b):
+        if s._db is not None:  # noqa: SLF001
+            s.close()
+
+
+class TestSharedState:
+    def test_delivery_is_claimed_once(self, workers: tuple[SharedState, SharedState]) -> None:
+        a, b = workers
+
+        assert a.claim('d1', now=0)
+        assert not b.claim('d1', now=1)
+        assert b.claim('d2', now=1)
+
+    def test_claims_expire_or_get_released(self, workers: tuple[SharedState, SharedState]) -> None:
+        a, b = workers
+        assert a.claim('d1', now=0)
+        assert a.claim('d2', now=0)
+
+        b.release('d2')
+
+        assert b.claim('d1', now=61)
+        assert b.claim('d2', now=1)
+
+    async def test_expired_claims_are_pruned(
+        self, workers: tuple[SharedState, SharedState]
+    ) -> None:
+        a, b = workers
+        assert a.claim('old', now=time.time() - 61)
+        assert a.claim('new')
+
+        await b.prune()
+
+        assert [d for (d,) in a.db.execute('SELECT delivery FROM claims')] == ['new']
+
+    def test_busy_database_does_not_block_claims(
+        self, workers: tuple[SharedState, SharedState], state_path: Path
+    ) -> None:
+        a, _ = workers
+        with closing(sqlite3.connect(state_path, isolation_level=None)) as other:
+            _ = other.execute('BEGIN IMMEDIATE')
+
+            assert a.claim('d1')
+            assert a.claim('d1')
+            a.release('d1')
+
+    def test_one_leader_at_a_time(self, workers: tuple[SharedState, SharedState]) -> None:
+        a, b = workers
+
+        assert a.try_lead()
+        assert a.try_lead()
+        assert not b.try_lead()
+        a.close()
+        assert b.try_lead()
+        assert b.is_leader
+
+    def test_workers_see_whether_others_are_alive(
+        self, workers: tuple[SharedState, SharedState]
+    ) -> None:
+        a, b = workers
+
+        assert b.is_alive(a.worker_id)
+        a.close()
+        assert not b.is_alive(a.worker_id)
+        assert not b.is_alive('never-was')
+
+    async def test_metrics_of_live_workers_are_seen_by_all(
+        self, workers: tuple[SharedState, SharedState]
+    ) -> None:
+        a, b = workers
+        await a.publish_metrics('a1')
+        await a.publish_metrics('a2')
+        await b.publish_metrics('b1')
+
+        assert sorted(await b.all_metrics()) == ['a2', 'b1']
+
+        a.close()
+        assert await b.all_metrics() == ['b1']
+
+    async def test_tokens_are_stored(self, workers: tuple[SharedState, SharedState]) -> None:
+        a, b = workers
+        expires_at = datetime(2999, 1, 1, tzinfo=UTC)
+
+        await a.store_token('app', 't', expires_at)
+
+        assert await b.load_token('app') == ('t', expires_at)
+        assert await b.load_token('other') is None
+
+
+async def test_token_is_requested_by_one_worker_only(
+    workers: tuple[SharedState, SharedState],
+) -> None:
+    requests = 0
+
+    def github(request: httpx.Request) -> httpx.Response:
+        nonlocal requests
+        requests += 1
+        _ = request
+        return httpx.Response(201, json=dict(token='t', expires_at='2999-01-01T00:00:00Z'))  # noqa: S106
+
+    cfg = AppConfig.model_construct(
+        github=CfgGithub.model_construct(app_id='42', installation_id='67', pem='pem'),
+    )
+    apis = [
+        AsyncGithubApi(cfg, httpx.AsyncClient(transport=httpx.MockTransport(github)), None, s)
+        for s in workers
+    ]
+    for api in apis:
+        api.rejwt = lambda: 'jwt'  # type: ignore[method-assign]
+
+    tokens = [await api.get_valid_token() for api in apis]
+
+    assert tokens == ['t', 't']
+    assert requests == 1
+    assert [api.token_refreshes for api in apis] == [1, 0]
+
+
+async def test_deliveries_of_gone_workers_are_adopted(tmp_path: Path) -> None:
+    path = tmp_path / 'spool.sqlite'
+    alive = {'a': True, 'b': False}
+    for owner in ('a', 'b', None):
+        spool = WebhookSpool(path, owner=owner)
+        spool.open()
+        _ = await spool.append({}, f'{owner}'.encode())
+        await spool.close()
+
+    spool = WebhookSpool(path, owner='c')
+    spool.open()
+    orphans = await spool.adopt_orphans(alive.__getitem__)
+
+    assert [e.body for e in orphans] == [b'b', b'None']
+    # adopted ones are ours now
+    assert await spool.adopt_orphans(alive.__getitem__) == []
+
+
+async def test_owners_are_asked_about_once_each(tmp_path: Path) -> None:
+    path = tmp_path / 'spool.sqlite'
+    spool = WebhookSpool(path, owner='a')
+    spool.open()
+    for _ in range(3):
+        _ = await spool.append({}, b'a')
+    await spool.close()
+    asked: list[str] = []
+
+    def is_alive(owner: str) -> bool:
+        asked.append(owner)
+        return True
+
+    spool = WebhookSpool(path, owner='b')
+    spool.open()
+
+    assert await spool.adopt_orphans(is_alive) == []
+    assert asked == ['a']
+    await spool.close()
@@ -0,0 +1,74 @@
+import asyncio
+import time
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+
+from qram.web.spool import WebhookSpool
+
+
+@pytest.fixture
+def spool_path(tmp_path: Path) -> Path:
+    return tmp_path / 'spool' / 'webhooks.sqlite'
+
+
+class TestWebhookSpool:
+    async def test_appended_entries_survive_reopen(self, spool_path: Path) -> None:
+        spool = WebhookSpool(spool_path)
+        spool.open()
+        first = await spool.append({'x-github-event': 'push'}, b'{"a": 1}')
+        second = await spool.append({'x-github-event': 'ping'}, b'{"b": 2}')
+        await spool.close()
+
+        spool = WebhookSpool(spool_path)
+        spool.open()
+        pending = spool.pending()
+
+        assert [e.id for e in pending] == [first, second]
+        assert pending[0].headers == {'x-github-event': 'push'}
+        assert pending[1].body == b'{"b": 2}'
+
+    async def test_done_entries_are_not_pending_and_get_compacted(self, spool_path: Path) -> None:
+        spool = WebhookSpool(spool_path)
+        spool.open()
+        first = await spool.append({}, b'1')
+        second = await spool.append({}, b'2')
+        spool.mark_done(first)
+        await spool.flush()
+
+        assert [e.id for e in spool.pending()] == [second]
+        assert spool.compact() == 1
+        assert [e.id for e in spool.pending()] == [second]
+
+    async def test_persists_recent_delivery_ids(self, spool_path: Path) -> None:
+        spool = WebhookSpool(spool_path, seen_ttl=60)
+        spool.open()
+        _ = await spool.append({}, b'x', delivery='abc')
+        _ = await spool.append({}, b'y')
+
+        seen = spool.seen_since(time.time() - 60)
+
+        assert [d for d, _ in seen] == ['abc']
+        assert spool.seen_since(time.time() + 1) == []
+
+    async def test_concurrent_appends_share_commits(self, spool_path: Path) -> None:
+        spool = WebhookSpool(spool_path)
+        spool.open()
+
+        with patch.object(spool, '_commit', wraps=spool._commit) as commit:  # noqa: SLF001
+            ids = await asyncio.gather(*(spool.append({}, b'x') for _ in range(50)))
+
+        assert len(set(ids)) == 50
+        assert commit.call_count < 50
+        assert len(spool.pending()) == 50
+
+    async def test_compacts_after_enough_done_entries(self, spool_path: Path) -> None:
+        spool = WebhookSpool(spool_path, compact_every=3)
+        spool.open()
+        ids = [await spool.append({}, b'x') for _ in range(3)]
+        for i in ids:
+            spool.mark_done(i)
+        await spool.flush()
+
+        assert spool.db.execute('SELECT COUNT(*) FROM deliveries').fetchone() == (0,)